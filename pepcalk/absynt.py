@@ -6,7 +6,8 @@
 """
 from __future__ import absolute_import, division
 
-import ast
+import ast, tokenize
+from cStringIO import StringIO
 from pepcalk.utils import check_class
 
 
@@ -23,7 +24,48 @@ def get_statements_from_code(code):
     check_class(module, ast.Module)
     return module.body
 
-    
+
+def _remove_separator(source):
+    """ Returns the source of a statement without the semicolon that separates it from the
+        next statement, if any.
+    """
+    ignored = (tokenize.COMMENT, tokenize.NL, tokenize.NEWLINE, tokenize.ENDMARKER)
+    tokens = [token for token in tokenize.generate_tokens(StringIO(source).readline)
+              if token[0] not in ignored]
+    if not tokens or tokens[-1][1] != ';':
+        return source
+    row, col = tokens[-1][2]
+    lines = source.split('\n')
+    lines[row - 1] = (lines[row - 1][:col].rstrip() + lines[row - 1][col + 1:]).rstrip()
+    return '\n'.join(lines)
+
+
+def get_statement_sources(code, statements):
+    """ Returns the source code of each of the statements, as it appears in the code.
+        Trailing blank and comment lines and semicolons that separate statements are left
+        out.
+
+        :param statements: the list of statements of get_statements_from_code(code)
+    """
+    is_unicode = isinstance(code, unicode)
+    if is_unicode:
+        code = code.encode('utf-8') # The col_offset of the statements counts bytes
+
+    line_offsets = [0]
+    for line in code.split('\n'):
+        line_offsets.append(line_offsets[-1] + len(line) + 1)
+    starts = [line_offsets[stat.lineno - 1] + stat.col_offset for stat in statements]
+
+    sources = []
+    for start, end in zip(starts, starts[1:] + [len(code)]):
+        lines = code[start:end].rstrip().split('\n')
+        while len(lines) > 1 and (not lines[-1].strip() or lines[-1].lstrip().startswith('#')):
+            lines.pop()
+        source = _remove_separator('\n'.join(lines).rstrip())
+        sources.append(source.decode('utf-8') if is_unicode else source)
+    return sources
+
+
 def get_statement_from_code(code):
     """ Compiles the code string in 'single' mode
         Verifies it consists of a list of one statement element and returns this list.
@@ -38,60 +80,40 @@ def get_statement_from_code(code):
     return module.body[0]
 
 
-def ast_to_str(node):
-    """ String representation of an abstract syntax tree
+_OPERATORS = {
+    ast.Not: "not ",
+    ast.UAdd: "+",
+    ast.USub: "-",
+    ast.Add: "+",
+    ast.Sub: "-",
+    ast.Mult: "*",
+    ast.Div: "/",
+    ast.FloorDiv: "//",
+    ast.Mod: "%",
+    ast.Pow: "**",
+    ast.And: "and",
+    ast.Or: "or",
+}
+
+
+def _get_children(node, node_type):
+    """ Checks that the node is supported and returns the list of its child nodes, in the 
+        order in which they are rendered. Only called for nodes that have children.
     """
-    check_class(node, ast.AST)
-    node_type = type(node)
-    
-    if node_type == ast.Num:
-        return repr(node.n)  # escapes quotes
-    elif node_type == ast.Str:
-        return repr(node.s)
-    elif node_type == ast.Name:
-        return node.id
-    
-    elif node_type == ast.UnaryOp:
-        return ast_to_str(node.op) + ast_to_str(node.operand)
-    elif node_type == ast.Not:
-        return "not "
-    elif node_type == ast.UAdd:
-        return "+"
-    elif node_type == ast.USub:
-        return "-"
+    if node_type == ast.UnaryOp:
+        return [node.operand]
     
     elif node_type == ast.BinOp:
-        return "({} {} {})".format(ast_to_str(node.left), 
-                                   ast_to_str(node.op), 
-                                   ast_to_str(node.right))
-    elif node_type == ast.Add:
-        return "+"
-    elif node_type == ast.Sub:
-        return "-"
-    elif node_type == ast.Mult:
-        return "*"
-    elif node_type == ast.Div:
-        return "/"
-    elif node_type == ast.FloorDiv:
-        return "//"
-    elif node_type == ast.Mod:
-        return "%"
-    elif node_type == ast.Pow:
-        return "**"
+        return [node.left, node.right]
     
     elif node_type == ast.BoolOp:
-        op_str = " {} ".format(ast_to_str(node.op))
-        return '(' + op_str.join([ast_to_str(val) for val in node.values]) + ')'
-    elif node_type == ast.And:
-        return "and"    
-    elif node_type == ast.Or:
-        return "or"
+        return node.values
     
     elif node_type == ast.Attribute:
         if not isinstance(node.ctx, ast.Load):
             raise CompilationError("Only Attribute node.ctx 'Load' supported. Got: {}"
                                    .format(node.ctx))    
-        return "{}.{}".format(ast_to_str(node.value), node.attr)
+        return [node.value]
     
     elif node_type == ast.Call:
         
@@ -109,18 +131,11 @@ def ast_to_str(node):
         if not isinstance(node.func.ctx, ast.Load): # sanity check 
             raise AssertionError("node.func.ctx should be store. Got: {}".format(node.func.ctx))
         
-        param_strings = []
-        for arg in node.args:
-            #print "node.arg: {!r}: (id={}) {}".format(arg, arg.id, ast_to_str(arg))
-            param_strings.append(ast_to_str(arg))
-        for keyword in node.keywords:
-            param_strings.append(ast_to_str(keyword))
-        #print param_strings
-        return "{}({})".format(ast_to_str(node.func), ', '.join(param_strings))
+        return [node.func] + node.args + node.keywords
 
     elif node_type == ast.keyword:
         check_class(node.arg, basestring)
-        return "{}={}".format(node.arg, ast_to_str(node.value))
+        return [node.value]
     
     elif node_type == ast.Assign:
         # Targets can have more than one element. E.g. when the statement is: a = b = 6
@@ -136,61 +151,196 @@ def ast_to_str(node):
         if not isinstance(target.ctx, ast.Store): # sanity check 
             raise AssertionError("Target.ctx should be store. Got: {}".format(target.ctx))
         
-        return "{} = {}".format(target.id, ast_to_str(node.value))
+        return [node.value]
     
     else:
         raise CompilationError("Unsupported node type: {}".format(node_type))
     
 
+def _operator_str(op):
+    """ Returns the source of an operator node.
+    """
+    op_type = type(op)
+    if op_type not in _OPERATORS:
+        raise CompilationError("Unsupported node type: {}".format(op_type))
+    return _OPERATORS[op_type]
+
+
+# Operator precedences, from low to high, like in the Python grammar. An operand is put
+# between parentheses if its precedence is lower than the operator requires.
+_PRECEDENCES = {
+    ast.Or: 1,
+    ast.And: 2,
+    ast.Not: 3,
+    ast.Add: 4,
+    ast.Sub: 4,
+    ast.Mult: 5,
+    ast.Div: 5,
+    ast.FloorDiv: 5,
+    ast.Mod: 5,
+    ast.UAdd: 6,
+    ast.USub: 6,
+    ast.Pow: 7,
+}
+_LOWEST_PRECEDENCE = 0  # E.g. the value of an assignment or the argument of a call
+_ATOM_PRECEDENCE = 8    # Names, literals, calls and attribute references
+
+
+def _parenthesize(item, precedence):
+    """ Returns the source of a (source, precedence) item, between parentheses if its 
+        precedence is lower than the given precedence.
+    """
+    source, item_precedence = item
+    return source if item_precedence >= precedence else "(" + source + ")"
+
+
+def _render(node, node_type, items):
+    """ Returns the (source, precedence) of a node with children, given the (source, 
+        precedence) items of its children. Parentheses are only added where needed.
+    """
+    if node_type == ast.BinOp:
+        precedence = _PRECEDENCES[type(node.op)]
+        if type(node.op) == ast.Pow:
+            # Right associative and binds tighter than a unary operator on its left: 
+            # (-a) ** b and (a ** b) ** c need parentheses, a ** -b and a ** b ** c don't.
+            left, right = precedence + 1, _PRECEDENCES[ast.USub]
+        else:
+            left, right = precedence, precedence + 1
+        source = "{} {} {}".format(_parenthesize(items[0], left), _operator_str(node.op), 
+                                   _parenthesize(items[1], right))
+    elif node_type == ast.UnaryOp:
+        precedence = _PRECEDENCES[type(node.op)]
+        source = _operator_str(node.op) + _parenthesize(items[0], precedence)
+    elif node_type == ast.BoolOp:
+        precedence = _PRECEDENCES[type(node.op)]
+        op_str = " {} ".format(_operator_str(node.op))
+        source = op_str.join([_parenthesize(item, precedence + 1) for item in items])
+    elif node_type == ast.Attribute:
+        precedence = _ATOM_PRECEDENCE
+        if type(node.value) == ast.Num: # 1.real is a syntax error 
+            source = "({}).{}".format(items[0][0], node.attr)
+        else:
+            source = "{}.{}".format(_parenthesize(items[0], precedence), node.attr)
+    elif node_type == ast.Call:
+        precedence = _ATOM_PRECEDENCE
+        source = "{}({})".format(_parenthesize(items[0], precedence), 
+                                 ', '.join([item[0] for item in items[1:]]))
+    elif node_type == ast.keyword:
+        precedence = _LOWEST_PRECEDENCE
+        source = "{}={}".format(node.arg, items[0][0])
+    elif node_type == ast.Assign:
+        precedence = _LOWEST_PRECEDENCE
+        source = "{} = {}".format(node.targets[0].id, items[0][0])
+    else:
+        raise AssertionError("Unexpected node type: {}".format(node_type))
+    return source, precedence
+
+
+def analyze_expression(node, sources=None):
+    """ Returns a (source, symbols) tuple, where source is the canonical source code of an 
+        abstract syntax tree and symbols the list of symbols that it uses, in order of 
+        appearance and including duplicates. The source only has the parentheses that the 
+        operator precedences require, so that it parses back into the same tree.
+        
+        The tree is traversed once, without recursion, so that deeply nested expressions 
+        such as long sums are supported. Raises a CompilationError if the tree contains 
+        unsupported functionality.
+        
+        :param sources: optional dictionary to which the source of each sub-tree that is not
+            a name or literal is added, with the id() of its node as key.
+    """
+    check_class(node, ast.AST)
+    symbols = []
+    items = [] # The (source, precedence) tuples of the visited sub-trees.
+    
+    # Each stack item is a (node, n_children) tuple. The node is rendered when n_children 
+    # is not None, from the items of its children, which are on top of items by then.
+    stack = [(node, None)] 
+    while stack:
+        node, n_children = stack.pop()
+        node_type = type(node)
+        
+        if n_children is not None:
+            start = len(items) - n_children
+            item = _render(node, node_type, items[start:])
+            del items[start:]
+            items.append(item)
+            if sources is not None:
+                sources[id(node)] = item[0]
+        elif node_type == ast.Name:
+            symbols.append(node.id)
+            items.append((node.id, _ATOM_PRECEDENCE))
+        elif node_type == ast.Num:
+            source = repr(node.n)
+            # Negative literals, e.g. the -1 in (-1) ** 2, behave like a unary minus.
+            if source.startswith('-'):
+                items.append((source, _PRECEDENCES[ast.USub]))
+            else:
+                items.append((source, _ATOM_PRECEDENCE))
+        elif node_type == ast.Str:
+            items.append((repr(node.s), _ATOM_PRECEDENCE)) # escapes quotes
+        else:
+            children = _get_children(node, node_type)
+            stack.append((node, len(children)))
+            stack.extend([(child, None) for child in reversed(children)])
+            
+    assert len(items) == 1, "Expected one source, got: {}".format(len(items))
+    return items[0][0], symbols
+
+
+def ast_to_str(node):
+    """ String representation of an abstract syntax tree. See analyze_expression.
+    """
+    return analyze_expression(node)[0]
+    
+
 def wrap_expression(expr):
     """ Wraps an ast.expr node into an ast.Expression node, which can be used by compile()
     """
     check_class(expr, ast.expr)
     expression = ast.Expression()
     expression.body = expr
-    return expression    
-    
+    return expression
+
+
+def _copy_node(node, stack):
+    """ Returns a copy of node, or node itself if it is not a syntax tree node. The copied
+        nodes are pushed on the stack together with the original, to copy their fields.
+    """
+    if not isinstance(node, ast.AST):
+        return node
+    node_copy = type(node)()
+    stack.append((node, node_copy))
+    return node_copy
+
+
+def copy_tree(node):
+    """ Returns a deep copy of an abstract syntax tree. Unlike copy.deepcopy it doesn't use
+        recursion, so that deeply nested expressions such as long sums can be copied.
+    """
+    check_class(node, ast.AST)
+    stack = []
+    tree_copy = _copy_node(node, stack)
+    while stack:
+        node, node_copy = stack.pop()
+        for name in node._attributes: # e.g. lineno and col_offset
+            if hasattr(node, name):
+                setattr(node_copy, name, getattr(node, name))
+        for name, value in ast.iter_fields(node):
+            if isinstance(value, list):
+                setattr(node_copy, name, [_copy_node(item, stack) for item in value])
+            else:
+                setattr(node_copy, name, _copy_node(value, stack))
+    return tree_copy
+
 
-# TODO: use symbtable module?
 def expression_symbols(node):
-    """ Returns a list of symbols used in an expression.
-    
-        Does not check for unsupported functionality; use ast_to_st for that.
+    """ Returns a list of symbols used in an expression. See analyze_expression.
     """
     check_class(node, ast.AST)
-    node_type = type(node)
-    
-    if node_type == ast.Expr:
-        return expression_symbols(node.value)
-    elif node_type == ast.Num:
-        return []
-    elif node_type == ast.Str:
-        return []
-    elif node_type == ast.Name:
-        return [node.id]
-    elif node_type == ast.UnaryOp:
-        return expression_symbols(node.operand)
-    elif node_type == ast.BinOp:
-        return expression_symbols(node.left) + expression_symbols(node.right)
-    elif node_type == ast.BoolOp:
-        result = []
-        for val in node.values:
-            result += expression_symbols(val)
-        return result
-    elif node_type == ast.Attribute:
-        return expression_symbols(node.value)
-    elif node_type == ast.Call:
-        result = []
-        for arg in node.args:
-            result += expression_symbols(arg)
-        for keyword in node.keywords:
-            result += expression_symbols(keyword)
-        return result
-    elif node_type == ast.keyword:
-        return expression_symbols(node.value)
-    else:
-        raise CompilationError("Unsupported node type: {}. Statement: {}"
-                               .format(node_type, ast.dump(node)))
+    if type(node) == ast.Expr:
+        node = node.value
+    return analyze_expression(node)[1]
     
 
 def assignment_symbols(node):
@@ -9,6 +9,8 @@ from pepcalk.absynt import ast_to_str as a2s
 from pepcalk.absynt import get_statement_from_code as gsfc
 from pepcalk.absynt import expression_symbols as exprsym
 from pepcalk.absynt import assignment_symbols as asgnsym
+from pepcalk.absynt import analyze_expression, copy_tree
+from pepcalk.absynt import get_statement_sources, get_statements_from_code
 
 
 class AbsyntCase(unittest.TestCase):
@@ -25,31 +27,58 @@ class AbsyntCase(unittest.TestCase):
         
         self.assertRaises(CompilationError, gsfc, "a = 6; b = 7")
         self.assertRaises(SyntaxError, gsfc, "a = (")
-        
+
+
+    def test_get_statement_sources(self):
+
+        code = "a = 1; b = (a +\n     2) # plus two\n# comment\n\nc = -a"
+        self.assertEqual(get_statement_sources(code, get_statements_from_code(code)),
+                         ["a = 1", "b = (a +\n     2) # plus two", "c = -a"])
+        
+        # Only semicolons that separate statements are left out
+        code = u"s = u'\xe9';\nt = 1 ; # comment;\nu = 2 # comment;"
+        self.assertEqual(get_statement_sources(code, get_statements_from_code(code)),
+                         [u"s = u'\xe9'", "t = 1 # comment;", "u = 2 # comment;"])
+
 
     def test_ast_to_str(self):
         
-        self.assertEqual(a2s(gsfc("a = b + 1;")), "a = (b + 1)")
-        self.assertEqual(a2s(gsfc("a = +b - -1")), "a = (+b - -1)")
-        self.assertEqual(a2s(gsfc("a = -b - -1")), "a = (-b - -1)")
-        self.assertEqual(a2s(gsfc("a = a * 2 + 4")), "a = ((a * 2) + 4)")
-        self.assertEqual(a2s(gsfc("a = a + 2 * 4")), "a = (a + (2 * 4))")
-        self.assertEqual(a2s(gsfc("a = (a + 2) * 4")), "a = ((a + 2) * 4)")
-        self.assertEqual(a2s(gsfc("a = a // 2 / 4")), "a = ((a // 2) / 4)")
-        self.assertEqual(a2s(gsfc("a = a % 2 ** 4")), "a = (a % (2 ** 4))")
+        self.assertEqual(a2s(gsfc("a = b + 1;")), "a = b + 1")
+        self.assertEqual(a2s(gsfc("a = +b - -1")), "a = +b - -1")
+        self.assertEqual(a2s(gsfc("a = -b - -1")), "a = -b - -1")
+        self.assertEqual(a2s(gsfc("a = a * 2 + 4")), "a = a * 2 + 4")
+        self.assertEqual(a2s(gsfc("a = a + 2 * 4")), "a = a + 2 * 4")
+        self.assertEqual(a2s(gsfc("a = (a + 2) * 4")), "a = (a + 2) * 4")
+        self.assertEqual(a2s(gsfc("a = a // 2 / 4")), "a = a // 2 / 4")
+        self.assertEqual(a2s(gsfc("a = a % 2 ** 4")), "a = a % 2 ** 4")
         self.assertNotEqual(a2s(gsfc("a = 3.33000")), "a = 3.3300") # fails. a = 3.33
         
+        # Parentheses are only added where the operator precedence requires them
+        self.assertEqual(a2s(gsfc("a = (a - 2) - 4")), "a = a - 2 - 4")
+        self.assertEqual(a2s(gsfc("a = a - (2 - 4)")), "a = a - (2 - 4)")
+        self.assertEqual(a2s(gsfc("a = (-a) ** 2")), "a = (-a) ** 2")
+        self.assertEqual(a2s(gsfc("a = -a ** 2")), "a = -a ** 2")
+        self.assertEqual(a2s(gsfc("a = (-2) ** 2")), "a = (-2) ** 2")
+        self.assertEqual(a2s(gsfc("a = a ** -b ** c")), "a = a ** -b ** c")
+        self.assertEqual(a2s(gsfc("a = (a ** b) ** c")), "a = (a ** b) ** c")
+        self.assertEqual(a2s(gsfc("a = (not a) + 1")), "a = (not a) + 1")
+        self.assertEqual(a2s(gsfc("a = not (a + 1)")), "a = not a + 1")
+        self.assertEqual(a2s(gsfc("a = (b + c).sum()")), "a = (b + c).sum()")
+        self.assertEqual(a2s(gsfc("a = (1).real")), "a = (1).real")
+        
         # Other types
         self.assertEqual(a2s(gsfc("a = symbol")), "a = symbol")
         self.assertEqual(a2s(gsfc("a = 'string'")), "a = 'string'")
         self.assertEqual(a2s(gsfc(r"a = 'escaped \" quote'")), "a = 'escaped \" quote'")
         
         # None is just a symbol within an AST
-        self.assertEqual(a2s(gsfc("a = None + 1;")), "a = (None + 1)")
+        self.assertEqual(a2s(gsfc("a = None + 1;")), "a = None + 1")
         
-        self.assertEqual(a2s(gsfc("a = True and False and True")), "a = (True and False and True)")
-        self.assertEqual(a2s(gsfc("a = True or False or 3")), "a = (True or False or 3)")
-        self.assertEqual(a2s(gsfc("a = True or False and True")), "a = (True or (False and True))")
+        self.assertEqual(a2s(gsfc("a = True and False and True")), "a = True and False and True")
+        self.assertEqual(a2s(gsfc("a = True or False or 3")), "a = True or False or 3")
+        self.assertEqual(a2s(gsfc("a = True or False and True")), "a = True or False and True")
+        self.assertEqual(a2s(gsfc("a = (True or False) and True")), "a = (True or False) and True")
+        self.assertEqual(a2s(gsfc("a = True or (False or 3)")), "a = True or (False or 3)")
         
         self.assertEqual(a2s(gsfc("a = b1.c1.c2")), "a = b1.c1.c2")
         
@@ -79,6 +108,21 @@ class AbsyntCase(unittest.TestCase):
         self.assertEqual(exprsym(gsfc("a + b")), ['a', 'b'])
         self.assertEqual(exprsym(gsfc("a + b + a")), ['a', 'b', 'a'])
         self.assertEqual(exprsym(gsfc("a + b * c")), ['a', 'b', 'c'])
+        self.assertEqual(exprsym(gsfc("f(a, b=c)")), ['f', 'a', 'c'])
+        self.assertEqual(exprsym(gsfc("_np.sum(a).round(b)")), ['_np', 'a', 'b'])
+        self.assertRaises(CompilationError, exprsym, gsfc("a[0]"))
+        
+        
+    def test_deep_expression(self):
+        
+        terms = ["x{:d}".format(idx) for idx in range(5000)]
+        statement = gsfc("a = " + " + ".join(terms))
+        source, symbols = analyze_expression(statement.value)
+        self.assertEqual(symbols, terms)
+        self.assertEqual(source, " + ".join(terms))
+        self.assertEqual(a2s(statement), "a = " + source)
+        compile(source, '<test>', 'eval') # the parser can handle the rendered source
+        self.assertEqual(a2s(copy_tree(statement)), "a = " + source)
         
 
     def test_assignment_symbols(self):
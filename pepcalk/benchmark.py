@@ -0,0 +1,277 @@
+""" Benchmarks for pepcalk.
+
+    Run with: python -m pepcalk.benchmark --help
+    
+    Generates calculations of different topologies and sizes and times each phase of their 
+    compilation and execution separately. The results can be written to a JSON file and 
+    compared against the results of a previous run (the baseline).
+"""
+from __future__ import absolute_import, division
+
+import logging, argparse, json, platform, random, sys, time
+from collections import deque
+from timeit import default_timer
+
+import numpy as np
+
+from pepcalk.absynt import get_statements_from_code
+from pepcalk.calculation import Assignment, Calculation
+from pepcalk.compilecache import COMPILE_CACHE
+from pepcalk.graph import Node, Graph
+from pepcalk.utils import logging_basic_config
+
+logger = logging.getLogger(__name__)
+
+
+def make_chain_graph(n_nodes):
+    """ Returns a graph where each node connects to the node that was added before it.
+    """
+    graph = Graph([Node(idx) for idx in range(n_nodes)])
+    for idx in range(1, n_nodes):
+        graph.connect(idx, idx - 1)
+    return graph
+
+
+def make_random_graph(n_nodes, n_edges_per_node=3, seed=0):
+    """ Returns a directed acyclic graph where each node connects to n_edges_per_node
+        randomly chosen nodes that were added before it.
+    """
+    rng = random.Random(seed)
+    graph = Graph([Node(idx) for idx in range(n_nodes)])
+    for idx in range(1, n_nodes):
+        for _ in range(n_edges_per_node):
+            graph.connect(idx, rng.randrange(idx))
+    return graph
+
+
+def time_function(function, n_repeats=3, setup=None):
+    """ Calls function n_repeats times and returns the best wall time in seconds.
+    
+        If setup is given, it is called before each call of function and its result is 
+        passed to function, e.g. a new calculation, so that each repetition starts from the 
+        same state. The setup is not timed.
+    """
+    best_time = None
+    for _ in range(n_repeats):
+        if setup is None:
+            start_time = default_timer()
+            function()
+        else:
+            argument = setup()
+            start_time = default_timer()
+            function(argument)
+        duration = default_timer() - start_time
+        if best_time is None or duration < best_time:
+            best_time = duration
+    return best_time
+
+
+def benchmark_sort(sizes=(10**5, 10**6), n_repeats=3):
+    """ Times Graph.linearize and Graph.levels on chain and random graphs.
+
+        Returns a list of (graph_name, n_nodes, linearize_time, levels_time) tuples.
+    """
+    results = []
+    for n_nodes in sizes:
+        for graph_name, make_graph in [('chain', make_chain_graph),
+                                       ('random', make_random_graph)]:
+            graph = make_graph(n_nodes)
+            linearize_time = time_function(graph.linearize, n_repeats=n_repeats)
+            levels_time = time_function(graph.levels, n_repeats=n_repeats)
+            logger.info("{:8s} {:9d} nodes: linearize {:7.3f} s, levels {:7.3f} s"
+                        .format(graph_name, n_nodes, linearize_time, levels_time))
+            results.append((graph_name, n_nodes, linearize_time, levels_time))
+    return results
+
+
+TOPOLOGIES = ('chain', 'fan_out', 'fan_in', 'random')
+KINDS = ('scalar', 'array')
+PHASES = ('parse', 'assignments', 'symbol_graph', 'linearize', 'compile', 'execute')
+FAN_IN_WIDTH = 10
+
+
+def make_calculation_code(topology, n_assignments, kind='scalar', array_size=1000, seed=0):
+    """ Returns the source code of a calculation with n_assignments assignments.
+    
+        :param topology: 'chain': each assignment uses the previous one. 'fan_out': all 
+            assignments use the first one. 'fan_in': the assignments are summed in a tree 
+            where each sum has FAN_IN_WIDTH operands. 'random': each assignment uses up to 
+            three randomly chosen earlier assignments.
+        :param kind: 'scalar' or 'array'. In the latter case the first assignment(s) are 
+            arrays of array_size elements and the other values are arrays as well.
+    """
+    if topology not in TOPOLOGIES:
+        raise ValueError("Unknown topology {!r}, expected one of: {}".format(topology, 
+                                                                          TOPOLOGIES))
+    if kind not in KINDS:
+        raise ValueError("Unknown kind {!r}, expected one of: {}".format(kind, KINDS))
+    
+    initial_value = "1.0" if kind == 'scalar' else "_np.ones({:d})".format(array_size)
+    rng = random.Random(seed)
+    lines = ["x0 = {}".format(initial_value)]
+    if topology == 'fan_in':
+        # Leaves, followed by the sums of groups of FAN_IN_WIDTH earlier assignments.
+        n_leaves = max(1, n_assignments * (FAN_IN_WIDTH - 1) // FAN_IN_WIDTH)
+        for idx in range(1, n_leaves):
+            lines.append("x{:d} = x0 + {:d}".format(idx, idx))
+        unused = deque(range(n_leaves))
+        while len(lines) < n_assignments:
+            operands = [unused.popleft() for _ in range(min(FAN_IN_WIDTH, len(unused)))]
+            unused.append(len(lines))
+            lines.append("x{:d} = {}".format(len(lines), 
+                                             " + ".join("x{:d}".format(op) for op in operands)))
+    else:
+        for idx in range(1, n_assignments):
+            if topology == 'chain':
+                operands = [idx - 1]
+            elif topology == 'fan_out':
+                operands = [0]
+            else:
+                operands = sorted(set(rng.randrange(idx) for _ in range(3)))
+            lines.append("x{:d} = {} + {:d}".format(
+                idx, " + ".join("x{:d}".format(op) for op in operands), idx))
+    return "\n".join(lines)
+
+
+def benchmark_phases(code, n_repeats=3):
+    """ Times the phases of the compilation and execution of the calculation separately.
+    
+        The compile phase includes building the graph and sorting. Each repetition compiles
+        a new calculation with an empty compile cache. Returns a dictionary that maps the 
+        PHASES to the best wall time in seconds.
+    """
+    result = {}
+    result['parse'] = time_function(lambda: get_statements_from_code(code), n_repeats)
+    statements = get_statements_from_code(code)
+    
+    result['assignments'] = time_function(
+        lambda: [Assignment(statement) for statement in statements], n_repeats)
+    
+    # The assignments cache their analysis, so each repetition starts from new ones.
+    result['symbol_graph'] = time_function(
+        lambda calc: calc._get_symbol_graph(calc.assignments), n_repeats, 
+        setup=lambda: Calculation(code))
+    calculation = Calculation(code)
+    graph = calculation._get_symbol_graph(calculation.assignments)
+    result['linearize'] = time_function(graph.linearize, n_repeats)
+    
+    def new_calculation():
+        " Returns a new calculation with an empty compile cache "
+        COMPILE_CACHE.clear()
+        return Calculation(code)
+    
+    result['compile'] = time_function(Calculation.compile, n_repeats, setup=new_calculation)
+    calculation.compile()
+    result['execute'] = time_function(calculation.execute, n_repeats)
+    return result
+
+
+def run_benchmarks(topologies=TOPOLOGIES, kinds=KINDS, sizes=(10, 100, 1000, 10000), 
+                   array_size=1000, n_repeats=3):
+    """ Runs benchmark_phases for each combination of topology, kind and size.
+    
+        Returns a dictionary with the metadata of the run and a list of results.
+    """
+    results = []
+    for topology in topologies:
+        for kind in kinds:
+            for n_assignments in sizes:
+                code = make_calculation_code(topology, n_assignments, kind=kind, 
+                                             array_size=array_size)
+                phases = benchmark_phases(code, n_repeats=n_repeats)
+                logger.info("{:8s} {:6s} {:8d}: {}".format(
+                    topology, kind, n_assignments, 
+                    ", ".join("{} {:.4f} s".format(phase, phases[phase]) for phase in PHASES)))
+                results.append({'topology': topology, 'kind': kind, 
+                                'n_assignments': n_assignments, 'phases': phases})
+    
+    metadata = {'python': platform.python_version(), 'numpy': np.__version__, 
+                'platform': platform.platform(), 'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+                'array_size': array_size, 'n_repeats': n_repeats}
+    return {'metadata': metadata, 'results': results}
+
+
+def is_regression(baseline_time, duration, threshold=0.1, min_time=1e-4):
+    """ Returns True if duration is more than a fraction threshold longer than baseline_time.
+        Returns False if both times are less than min_time seconds.
+    """
+    if max(baseline_time, duration) < min_time:
+        return False
+    return duration > baseline_time * (1 + threshold)
+
+
+def compare_to_baseline(benchmark, baseline, threshold=0.1, min_time=1e-4):
+    """ Compares the results of two runs of run_benchmarks.
+    
+        Returns a list of (topology, kind, n_assignments, phase, baseline_time, time) tuples 
+        of the phases that are more than a fraction threshold slower than in the baseline. 
+        Phases that take less than min_time seconds in both runs are ignored, as are the 
+        results that are not in both runs.
+    """
+    def key(result):
+        return (result['topology'], result['kind'], result['n_assignments'])
+    
+    baseline_results = dict((key(result), result) for result in baseline['results'])
+    regressions = []
+    for result in benchmark['results']:
+        baseline_result = baseline_results.get(key(result))
+        if baseline_result is None:
+            continue
+        for phase in PHASES:
+            baseline_time = baseline_result['phases'].get(phase)
+            phase_time = result['phases'].get(phase)
+            if baseline_time is None or phase_time is None:
+                continue
+            if is_regression(baseline_time, phase_time, threshold, min_time):
+                regressions.append(key(result) + (phase, baseline_time, phase_time))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks pepcalk calculations.")
+    parser.add_argument('--topologies', nargs='+', choices=TOPOLOGIES, default=TOPOLOGIES)
+    parser.add_argument('--kinds', nargs='+', choices=KINDS, default=KINDS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10, 100, 1000, 10000],
+                        help="Numbers of assignments. Default: %(default)s")
+    parser.add_argument('--array-size', type=int, default=1000, 
+                        help="Number of elements of the arrays. Default: %(default)s")
+    parser.add_argument('--repeats', type=int, default=3, 
+                        help="The best time of this many repetitions is used.")
+    parser.add_argument('-o', '--output', help="Writes the results to this JSON file.")
+    parser.add_argument('-b', '--baseline', 
+                        help="Compares the results with this JSON file of a previous run. "
+                        "The exit code is 1 if there are regressions.")
+    parser.add_argument('--threshold', type=float, default=0.1, 
+                        help="Relative slowdown that is a regression. Default: %(default)s")
+    parser.add_argument('--graph-sort', action='store_true', 
+                        help="Only benchmarks sorting graphs of 10^5 and 10^6 nodes.")
+    args = parser.parse_args()
+    
+    logging_basic_config("INFO")
+    if args.graph_sort:
+        benchmark_sort()
+        return 0
+    
+    benchmark = run_benchmarks(topologies=args.topologies, kinds=args.kinds, 
+                               sizes=args.sizes, array_size=args.array_size, 
+                               n_repeats=args.repeats)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(benchmark, output_file, indent=2, sort_keys=True)
+        logger.info("Results written to {}".format(args.output))
+        
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare_to_baseline(benchmark, baseline, threshold=args.threshold)
+        for topology, kind, n_assignments, phase, baseline_time, phase_time in regressions:
+            logger.warning("Regression {} {} {:d} {}: {:.4f} s -> {:.4f} s ({:+.0%})"
+                           .format(topology, kind, n_assignments, phase, baseline_time, 
+                                   phase_time, phase_time / baseline_time - 1))
+        logger.info("{:d} regressions compared to {}".format(len(regressions), args.baseline))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+""" Tests for the benchmark module.
+"""
+
+from __future__ import absolute_import
+import unittest
+
+from pepcalk.benchmark import (PHASES, TOPOLOGIES, benchmark_phases, compare_to_baseline, 
+                               make_calculation_code, time_function)
+from pepcalk.calculation import Calculation
+
+
+class BenchmarkCase(unittest.TestCase):
+    """A test class for the benchmark suite"""
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+
+    def test_make_calculation_code(self):
+        
+        for topology in TOPOLOGIES:
+            for kind in ['scalar', 'array']:
+                code = make_calculation_code(topology, 25, kind=kind, array_size=3)
+                calc = Calculation(code)
+                self.assertEqual(len(calc), 25)
+                calc.compile().execute()
+                
+        calc = Calculation(make_calculation_code('fan_in', 100))
+        # x99 is the sum of the 90 leaves: x0 = 1 and xi = x0 + i
+        self.assertEqual(calc.compile().execute()['x99'], 1 + sum(1 + i for i in range(1, 90)))
+        self.assertEqual(len(make_calculation_code('fan_in', 10**5).splitlines()), 10**5)
+        self.assertRaises(ValueError, make_calculation_code, 'star', 10)
+        
+        
+    def test_time_function(self):
+        
+        # Each repetition is passed a new object that is created by the setup
+        calls = []
+        duration = time_function(calls.append, n_repeats=3, setup=object)
+        self.assertTrue(duration >= 0)
+        self.assertEqual(len(set(id(obj) for obj in calls)), 3)
+        
+        
+    def test_compare_to_baseline(self):
+        
+        phases = benchmark_phases(make_calculation_code('chain', 10), n_repeats=1)
+        self.assertEqual(sorted(phases.keys()), sorted(PHASES))
+        
+        def run(execute_time):
+            phases = dict.fromkeys(PHASES, 1.0)
+            phases['execute'] = execute_time
+            return {'results': [{'topology': 'chain', 'kind': 'scalar', 'n_assignments': 10, 
+                                 'phases': phases}]}
+            
+        self.assertEqual(compare_to_baseline(run(1.05), run(1.0)), [])
+        self.assertEqual(compare_to_baseline(run(1.5), run(1.0)), 
+                         [('chain', 'scalar', 10, 'execute', 1.0, 1.5)])
+        self.assertEqual(compare_to_baseline(run(1.5), {'results': []}), [])
+        
+
+if __name__ == '__main__':
+    unittest.main()
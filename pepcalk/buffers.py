@@ -0,0 +1,125 @@
+""" Static type inference and preallocated output arrays for fused assignments.
+
+    When a calculation is executed repeatedly with inputs of the same shapes and dtypes, the
+    values of its fused assignments (see pepcalk.fused) have the same shapes and dtypes every
+    time. Their types are inferred once, before execution, and the values are written into
+    arrays that are allocated once and then reused.
+"""
+from __future__ import absolute_import, division
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def infer_array_types(assignments, global_vars, local_vars):
+    """ Infers the shapes and dtypes of the values of fused assignments.
+
+        Only the shapes and dtypes of the input arrays in local_vars are used, together with
+        the values of the input scalars, which NumPy's casting rules depend on. Assignments
+        that are not fused, and assignments that depend on them, are not inferred.
+
+        :param assignments: compiled assignments in execution order.
+        Returns a dictionary that maps targets to (shape, dtype) tuples.
+    """
+    type_vars = dict(local_vars)
+    array_types = {}
+    for assignment in assignments:
+        type_vars.pop(assignment.target, None)
+        if assignment.fused_expression is None:
+            continue
+        array_type = assignment.fused_expression.infer_type(global_vars, type_vars)
+        if array_type is not None:
+            shape, dtype = array_type
+            array_types[assignment.target] = array_type
+            # A read-only array of the right type that doesn't use any memory.
+            type_vars[assignment.target] = np.broadcast_to(np.empty((), dtype=dtype), shape)
+    return array_types
+
+
+def _type_signature(assignments, local_vars):
+    """ Returns a tuple that changes when the inferred types of the assignments could change.
+    """
+    signature = []
+    for symbol, value in sorted(local_vars.iteritems()):
+        if isinstance(value, np.ndarray) and value.ndim > 0:
+            signature.append((symbol, type(value), value.shape, value.dtype.str))
+        elif isinstance(value, (bool, int, long, float, complex, np.generic)):
+            signature.append((symbol, type(value), np.min_scalar_type(value).str))
+        else:
+            signature.append((symbol, type(value)))
+    for assignment in assignments:
+        fused_expr = assignment.fused_expression
+        signature.append((assignment.target, assignment.cache_key,
+                          None if fused_expr is None else fused_expr.block_size))
+    return tuple(signature)
+
+
+class BufferPool(object):
+    """ Output arrays of fused assignments that are reused across executions.
+
+        The types of the values are inferred again only if the types of the input values
+        or the assignments have changed. An array is allocated again only if its type changes.
+
+        Note that the value of an assignment is stored in the same array at each execution,
+        so the values of a previous execution are overwritten. Copy them if they are needed
+        after the next execution.
+    """
+    def __init__(self):
+        """ Constructor
+        """
+        self._buffers = {} # target -> array
+        self._signature = None
+        self._array_types = {}
+        self.n_inferences = 0
+        self.n_allocations = 0
+        self.n_reuses = 0
+
+    def __len__(self):
+        "Number of arrays in the pool"
+        return len(self._buffers)
+
+    def __str__(self):
+        return ("<BufferPool: {:d} arrays, {:d} bytes, {:d} allocations, {:d} reuses>"
+                .format(len(self._buffers), self.n_bytes, self.n_allocations, self.n_reuses))
+
+    @property
+    def n_bytes(self):
+        "The total size of the arrays in the pool"
+        return sum(buffer.nbytes for buffer in self._buffers.itervalues())
+
+    def clear(self):
+        """ Removes all arrays and resets the counters.
+        """
+        self._buffers.clear()
+        self._signature = None
+        self._array_types = {}
+        self.n_inferences = 0
+        self.n_allocations = 0
+        self.n_reuses = 0
+
+    def get_buffers(self, assignments, global_vars, local_vars):
+        """ Returns a dictionary that maps the targets of fused assignments to output arrays.
+
+            :param assignments: compiled assignments in execution order.
+            :param local_vars: the variables before execution, i.e. the input values.
+        """
+        signature = _type_signature(assignments, local_vars)
+        if signature != self._signature:
+            self._array_types = infer_array_types(assignments, global_vars, local_vars)
+            self._signature = signature
+            self.n_inferences += 1
+
+        buffers = {}
+        for target, (shape, dtype) in self._array_types.iteritems():
+            buffer = self._buffers.get(target)
+            if buffer is not None and buffer.shape == shape and buffer.dtype == dtype:
+                self.n_reuses += 1
+            else:
+                buffer = np.empty(shape, dtype=dtype)
+                self._buffers[target] = buffer
+                self.n_allocations += 1
+            buffers[target] = buffer
+        return buffers
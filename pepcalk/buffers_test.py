@@ -0,0 +1,70 @@
+""" Tests for the buffers module.
+"""
+
+from __future__ import absolute_import, division
+import unittest
+import numpy as np
+
+from pepcalk.buffers import BufferPool, infer_array_types
+from pepcalk.calculation import Calculation
+
+
+class BuffersCase(unittest.TestCase):
+    """A test class for type inference and preallocated output arrays"""
+
+    def setUp(self):
+        self.calc = Calculation("b = a * 2 + k\nc = b / a + b\nd = _np.sum(c)\ne = d * b")
+        self.calc.fused_block_size = 16
+        self.calc.execution_local_vars['a'] = np.arange(1, 101, dtype=np.int32).reshape(4, 25)
+        self.calc.execution_local_vars['k'] = 1
+        self.calc.compile()
+
+    def tearDown(self):
+        pass
+
+
+    def test_infer_array_types(self):
+        
+        assignments = sorted(self.calc.assignments, key=lambda assignment: assignment.order)
+        global_vars = {'_np': np}
+        array_types = infer_array_types(assignments, global_vars, 
+                                        self.calc.execution_local_vars)
+        # d is not fused, so e is not inferred either.
+        self.assertEqual(sorted(array_types.keys()), ['b', 'c'])
+        self.assertEqual(array_types['b'], ((4, 25), np.dtype(np.int32)))
+        self.assertEqual(array_types['c'], ((4, 25), np.dtype(np.float64)))
+        
+        # The value of a scalar influences the type
+        array_types = infer_array_types(assignments, global_vars, 
+                                        {'a': np.empty((4, 25), dtype=np.int8), 'k': 1000})
+        self.assertEqual(array_types['b'], ((4, 25), np.dtype(np.int16)))
+        
+        
+    def test_buffer_pool(self):
+        
+        calc = self.calc
+        calc.buffer_pool = BufferPool()
+        a = calc.execution_local_vars['a']
+        results = calc.execute()
+        np.testing.assert_array_equal(results['c'], (a * 2 + 1) / a + a * 2 + 1)
+        self.assertEqual(calc.buffer_pool.n_allocations, 2)
+        
+        b_value = results['b']
+        calc.execution_local_vars['a'] = a + 1
+        results = calc.execute()
+        self.assertIs(results['b'], b_value) # The previous value is overwritten
+        np.testing.assert_array_equal(results['b'], (a + 1) * 2 + 1)
+        self.assertEqual(calc.buffer_pool.n_allocations, 2)
+        self.assertEqual(calc.buffer_pool.n_reuses, 2)
+        self.assertEqual(calc.buffer_pool.n_inferences, 1)
+        
+        calc.execution_local_vars['a'] = np.arange(200.0)
+        results = calc.execute()
+        self.assertIsNot(results['b'], b_value)
+        self.assertEqual(results['c'].shape, (200, ))
+        self.assertEqual(calc.buffer_pool.n_allocations, 4)
+        self.assertEqual(calc.buffer_pool.n_inferences, 2)
+        
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,7 @@ import logging
 from PySide import QtCore, QtGui 
 from PySide.QtCore import Qt
 
-from pepcalk.utils import class_name
+from pepcalk.utils import class_name, format_duration, format_nbytes
 
 logger = logging.getLogger(__name__)
 
@@ -40,7 +40,9 @@ class CalcTableModel(QtCore.QAbstractTableModel):
     COL_SOURCE = 2
     COL_VALUE = 3
     COL_TYPE = 4
-    N_COLS = 5
+    COL_TIME = 5
+    COL_SIZE = 6
+    N_COLS = 7
     
     HEADERS = [None] * N_COLS 
     HEADERS[COL_ORDER]  = 'Order'
@@ -48,6 +50,8 @@ class CalcTableModel(QtCore.QAbstractTableModel):
     HEADERS[COL_SOURCE] = 'Source'
     HEADERS[COL_VALUE]  = 'Value or Error'
     HEADERS[COL_TYPE]   = 'Type'
+    HEADERS[COL_TIME]   = 'Time'
+    HEADERS[COL_SIZE]   = 'Size'
 
     
     def __init__(self, calculation = None, parent = None):
@@ -85,6 +89,10 @@ class CalcTableModel(QtCore.QAbstractTableModel):
                 return assignment_error_or_value(assignment)
             elif col == self.COL_TYPE:
                 return assignment_class_name(assignment)
+            elif col == self.COL_TIME:
+                return format_duration(assignment.wall_time)
+            elif col == self.COL_SIZE:
+                return format_nbytes(assignment.nbytes)
             else:
                 return None
 
@@ -137,15 +145,14 @@ class CalcTableModel(QtCore.QAbstractTableModel):
         assignment = self._calculation.assignments[index.row()]
         if index.column() == self.COL_TARGET:
             logger.debug("setData target row = {}".format(index.row()))
-            assignment.init_from_code("{} = {}".format(value, assignment.source))
+            code_line = "{} = {}".format(value, assignment.source)
         elif index.column() == self.COL_SOURCE:
             logger.debug("setData source row = {}".format(index.row()))
-            assignment.init_from_code("{} = {}".format(assignment.target, value))
+            code_line = "{} = {}".format(assignment.target, value)
         else:
             return False
 
-        self._calculation.compile()
-        self._calculation.execute()
+        self._calculation.replace_assignment(index.row(), code_line)
         self.emitAllDataChanged()
         return True
         
@@ -172,6 +179,10 @@ class CalcTableModel(QtCore.QAbstractTableModel):
             self._calculation.sort(key = lambda a : a.value, reverse = reverse)
         elif column == self.COL_TYPE:
             self._calculation.sort(key = assignment_class_name, reverse = reverse)
+        elif column == self.COL_TIME:
+            self._calculation.sort(key = lambda a : a.wall_time, reverse = reverse)
+        elif column == self.COL_SIZE:
+            self._calculation.sort(key = lambda a : a.nbytes, reverse = reverse)
         else:
             raise AssertionError("Invalid sort column {}".format(column))
 
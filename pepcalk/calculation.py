@@ -1,11 +1,26 @@
 from __future__ import division
 
-import logging, ast
-from pepcalk.absynt import (CompilationError, ast_to_str, wrap_expression, 
-                            get_statement_from_code, get_statements_from_code, 
-                            expression_symbols, parse_simple_assignment)
-from pepcalk.graph import Node, Graph, CircularDependencyError
-from pepcalk.utils import DEBUGGING
+import logging, ast, time, __builtin__
+from timeit import default_timer
+from pepcalk.absynt import (CompilationError, analyze_expression, ast_to_str, 
+                            copy_tree, get_statement_from_code, get_statement_sources, 
+                            get_statements_from_code, parse_simple_assignment)
+from pepcalk.chunked import DEFAULT_CHUNK_SIZE, execute_chunked, open_memmaps
+from pepcalk.codegen import generate_function_source, make_function
+from pepcalk.compilecache import COMPILE_CACHE, source_key
+from pepcalk.cse import eliminate_common_subexpressions
+from pepcalk.exprprofile import ExpressionProfile
+from pepcalk.fused import fuse_expression
+from pepcalk.graph import Graph, CircularDependencyError
+from pepcalk.liveness import execute_freeing
+from pepcalk.metrics import (COMPILES, COMPILE_SECONDS, EXECUTIONS, EXECUTION_SECONDS, 
+                             get_registry, record_assignment, record_error)
+from pepcalk.parallel import execute_threaded, execute_multiprocess
+from pepcalk.recorder import get_recorder
+from pepcalk.sweep import execute_sweep, make_sweep_inputs
+from pepcalk.tracing import Span, get_tracer
+from pepcalk.utils import DEBUGGING, format_duration, format_nbytes, value_nbytes
+from pepcalk.valuecache import execute_memoized
 
 logger = logging.getLogger(__name__)
 
@@ -18,41 +33,128 @@ def assignment_order(assignment):
 class Assignment(object):
     """ The assignments in the calculation
     """
-    def __init__(self, init = None, order = None):
+    def __init__(self, init = None, order = None, code = None):
+        """ Constructor. The init parameter is a code line or an ast.Assign statement. 
         
+            :param code: the source code of the statement if init is a statement node, 
+                e.g. as it appears in the source code of the calculation.
+        """
+        self._code = None
         self._target = None
         self._expression = None
+        self._evaluated_expr = None
+        self._source = None
+        self._symbols = None
+        self._cache_key = None
         self._compiled_expr = None
+        self._fused_expr = None
+        self._expr_profile = None
         self._value = None
         self._error = None
+        self._wall_time = None
+        self._cpu_time = None
+        self._nbytes = None
         self._order = order
         
         if init is None:
             assert False, "not yet decided on implementation"
         elif isinstance(init, ast.AST):
-            self.init_from_ast(init)
+            self.init_from_ast(init, code=code)
         else:
             self.init_from_code(init)
         
     def __str__(self):
         return "{} = {}".format(self._target, self.source)
     
+    def __reduce__(self):
+        """ Pickles the assignment as its code, or as the source code of the evaluated 
+            expression if that differs from the expression, and its order. 
+        
+            The unpickled assignment must be compiled again. Its value and error are not pickled.
+        """
+        if self._evaluated_expr is None:
+            code_line = self.code
+        else:
+            code_line = "{} = {}".format(self._target, ast_to_str(self._evaluated_expr))
+        return (Assignment, (code_line, self.order))
+    
     @property        
     def target(self):
         return self._target
     
+    @property
+    def code(self):
+        """ The source code from which the assignment was created. This is the canonical 
+            source if it was created from a statement node without code.
+        """
+        return str(self) if self._code is None else self._code
+    
     @property       
     def source(self):
-        return ast_to_str(self._expression)
+        "The canonical source code of the expression. It is rendered only once."
+        if self._source is None:
+            if self._evaluated_expr is None:
+                self._analyze()
+            else:
+                self._source = ast_to_str(self._expression)
+        return self._source
 
     @property       
     def expression(self):
         return self._expression
     
+    @property
+    def evaluated_expression(self):
+        """ The expression that is compiled and evaluated. This is the expression, unless
+            common sub-expressions have been replaced by set_evaluated_expression.
+        """
+        return self._expression if self._evaluated_expr is None else self._evaluated_expr
+    
+    def set_evaluated_expression(self, expression):
+        """ Sets the expression that is evaluated instead of the expression. The source 
+            keeps showing the original expression. It is reset by reset().
+        """
+        self._evaluated_expr = expression
+        self._symbols = None
+        self._cache_key = None
+        
+    def _analyze(self):
+        """ Renders the evaluated expression and collects its symbols in a single traversal.
+            The results are kept until the expression changes.
+        """
+        source, self._symbols = analyze_expression(self.evaluated_expression)
+        self._cache_key = source_key(source)
+        if self._evaluated_expr is None:
+            self._source = source
+    
+    @property
+    def cache_key(self):
+        "The key of the evaluated expression in the compile cache."
+        if self._cache_key is None:
+            self._analyze()
+        return self._cache_key
+    
+    @property       
+    def symbols(self):
+        "The list of symbols that are used in the evaluated expression."
+        if self._symbols is None:
+            self._analyze()
+        return self._symbols
+    
     @property
     def compiled_expression(self):
         return self._compiled_expr
     
+    @property
+    def fused_expression(self):
+        "The FusedExpression, or None if the expression is not evaluated in blocks."
+        return self._fused_expr
+    
+    @property
+    def expression_profile(self):
+        "The ExpressionProfile, or None if the sub-expressions are not profiled."
+        return self._expr_profile
+    
     @property       
     def order(self):
         return self._order
@@ -77,48 +179,125 @@ class Assignment(object):
     @property
     def error(self):
         return self._error
+    
+    @property
+    def wall_time(self):
+        "The wall clock time of the last execution in seconds, or None if not executed."
+        return self._wall_time
+    
+    @property
+    def cpu_time(self):
+        """ The CPU time of the last execution in seconds, or None if not executed.
+            This is the CPU time of the process, so it includes the time of other threads.
+        """
+        return self._cpu_time
+    
+    @property
+    def nbytes(self):
+        "The size of the value in bytes (see value_nbytes), or None if there is no value."
+        return self._nbytes
 
     def reset(self):
-        """ Sets order, value, error and compiled_expr to None
+        """ Sets order, value, error and compiled_expr to None. Removes the evaluated 
+            expression that was set by set_evaluated_expression.
         """
+        if self._evaluated_expr is not None:
+            self.set_evaluated_expression(None)
         self.order = None
         self._compiled_expr = None
+        self._fused_expr = None
+        self._expr_profile = None
+        self.clear_result()
+        
+    def clear_result(self):
+        """ Sets value, error, and the timings and size of the value to None so that the 
+            compiled assignment can be executed again.
+        """
         self._error = None
         self._value = None
+        self._wall_time = None
+        self._cpu_time = None
+        self._nbytes = None
+        
+    def set_result(self, value, error, wall_time=None, cpu_time=None):
+        """ Sets the value and error. Used when the assignment was executed elsewhere, 
+            e.g. in another process.
+        """
+        self._value = value
+        self._error = error
+        self._wall_time = wall_time
+        self._cpu_time = cpu_time
+        self._nbytes = None if error is not None else value_nbytes(value)
+        
+
+    def copy(self):
+        """ Returns an uncompiled copy of the assignment, with a copy of its expression and
+            the same code.
+        """
+        target = ast.copy_location(ast.Name(id=self._target, ctx=ast.Store()), self._expression)
+        statement = ast.Assign(targets=[target], value=copy_tree(self._expression))
+        return Assignment(ast.copy_location(statement, self._expression), code=self._code)
         
 
     def init_from_code(self, code_line):
         """ Initialize an assignment from a string in the form of: target = source
         """
         statement_node = get_statement_from_code(code_line)
-        self.init_from_ast(statement_node)
+        self.init_from_ast(statement_node, code=code_line)
         
     
-    def init_from_ast(self, statement_node):
+    def init_from_ast(self, statement_node, code=None):
         """ Initialize an assignment from an ast.Assign object
+        
+            :param code: the source code of the statement, if known.
         """
         lhs_symbol, expr = parse_simple_assignment(statement_node)
         self.reset()
+        self._code = code
         self._expression = expr
+        self._source = None
+        self._symbols = None
+        self._cache_key = None
         self._target = lhs_symbol.id
 
 
-    def compile(self):
-        """ Compiles the expression
+    def compile(self, fused_block_size=None, profile_expressions=False):
+        """ Compiles the expression. Uses the compile cache if the expression was compiled before.
+        
+            :param fused_block_size: if not None, element-wise expressions are evaluated in
+                blocks of this many elements when they are executed with large arrays.
+                See pepcalk.fused.
+            :param profile_expressions: if True, the time spent in each function call and 
+                binary operation is measured. See pepcalk.exprprofile. The expression is 
+                then never evaluated in blocks.
         """
         try:
-            self._compiled_expr = compile(wrap_expression(self.expression), 
-                                          "<string>", "eval")
+            expression = self.evaluated_expression
+            self._compiled_expr = COMPILE_CACHE.get_code(self.cache_key, expression)
+            if fused_block_size is None or profile_expressions:
+                self._fused_expr = None
+            else:
+                self._fused_expr = fuse_expression(expression, block_size=fused_block_size)
+            if profile_expressions:
+                self._expr_profile = ExpressionProfile(expression)
+            else:
+                self._expr_profile = None
             self._error = None
         except StandardError, ex:
             self._error = ex
+            registry = get_registry()
+            if registry is not None:
+                record_error(registry, ex)
             if DEBUGGING:
                 raise
 
 
-    def execute(self, global_vars, local_vars):
+    def execute(self, global_vars, local_vars, out=None):
         """ Executes the assignments. Returns dictionary with results.
         
+            :param out: optional array in which the value of a fused expression is stored. 
+                Ignored if the expression is not fused or if the array doesn't fit the value.
+        
             Pre: the calculation must be compiled first.
         """
         if self.compiled_expression is None:
@@ -127,15 +306,36 @@ class Assignment(object):
         if self._error is not None:
             raise AssertionError("Pre: _error is not None but: {}".format(self._error))
             
+        tracer = get_tracer()
+        if tracer is not None:
+            tracer.begin(self.target, 'assignment', {'source': self.source})
+            
         # Make sure that "from __future__ import division" is at the top of this module
+        wall_start, cpu_start = default_timer(), time.clock()
         try:
-            self._value = eval(self.compiled_expression, global_vars, local_vars)
+            value = NotImplemented
+            if self._fused_expr is not None:
+                value = self._fused_expr.evaluate(global_vars, local_vars, out=out)
+            if value is NotImplemented and self._expr_profile is not None:
+                value = self._expr_profile.evaluate(global_vars, local_vars)
+            if value is NotImplemented:
+                value = eval(self.compiled_expression, global_vars, local_vars)
+            self._value = value
             self._error = None
             return self._value
         except StandardError, ex:
             self._error = ex
             if DEBUGGING:
                 raise
+        finally:
+            self._wall_time = default_timer() - wall_start
+            self._cpu_time = time.clock() - cpu_start
+            self._nbytes = None if self._error is not None else value_nbytes(self._value)
+            if tracer is not None:
+                tracer.end(self.target, 'assignment')
+            registry = get_registry()
+            if registry is not None:
+                record_assignment(registry, self)
 
 
 class Calculation(object):
@@ -149,6 +349,41 @@ class Calculation(object):
         # as a starting point for the execution.
         self.execution_global_vars = {} # TODO: standard?
         self.execution_local_vars = {}
+        
+        # If set to a ValueCache, the values of the assignments are memoized across executions.
+        self.value_cache = None
+        
+        # If set, element-wise expressions on large arrays are evaluated in blocks of this
+        # many elements, without allocating temporary arrays. See pepcalk.fused.
+        self.fused_block_size = None
+        
+        # If True, sub-expressions that occur more than once in the assignments are evaluated 
+        # only once, by hidden shared assignments. See pepcalk.cse and shared_assignments.
+        self.share_subexpressions = False
+        
+        # If True, the time spent in the sub-expressions of each assignment is measured.
+        # See Assignment.expression_profile and expression_profile_report().
+        self.profile_expressions = False
+        
+        # If set to a BufferPool, the values of fused expressions are stored in arrays that are
+        # reused across serial executions. The values of the previous execution are then 
+        # overwritten, so copy them if you need them later.
+        self.buffer_pool = None
+        
+        # The MemoryReport of the last execution with free_intermediates or a memory_budget.
+        self.memory_report = None
+        
+        # The symbol graph and the variables of the last execution. They are kept so that 
+        # replace_assignment() only has to re-execute the assignments that have changed.
+        self._graph = None
+        self._global_vars = None
+        self._local_vars = None
+        
+        # The assignments that were not evaluated by the last execution.
+        self._skipped_assignments = []
+        
+        # The hidden assignments of the common sub-expressions, if share_subexpressions is set.
+        self._shared_assignments = []
 
     def __len__(self):
         "Number of assignment in the calculation"
@@ -158,10 +393,31 @@ class Calculation(object):
     def assignments(self):
         return self._assignments
     
+    @property
+    def skipped_assignments(self):
+        "The list of assignments that were not evaluated by the last execute() call."
+        return self._skipped_assignments
+    
+    @property
+    def shared_assignments(self):
+        """ The hidden assignments that evaluate the common sub-expressions of the assignments.
+            Empty unless the calculation is compiled with share_subexpressions set.
+        """
+        return self._shared_assignments
+    
+    def _all_assignments(self):
+        """ Returns the assignments followed by the shared assignments.
+        """
+        return self._assignments + self._shared_assignments
+    
     
     def reset(self):
-        """ Resets all assignments
+        """ Resets all assignments and removes the shared assignments.
         """
+        self._graph = None
+        self._global_vars = None
+        self._local_vars = None
+        self._shared_assignments = []
         for assignment in self.assignments:
             assignment.reset()
             
@@ -175,13 +431,53 @@ class Calculation(object):
                            .format(asgn.order_str, asgn.value, str(asgn), ))
         return "\n".join(strings)
     
+    
+    def profile_report(self, n_rows=None):
+        """ Returns a multiline string with the wall time, CPU time and value size of the 
+            executed assignments, sorted by decreasing wall time.
+            
+            :param n_rows: the maximum number of assignments in the report. If None, all 
+                executed assignments are included.
+        """
+        executed = sorted([asgn for asgn in self._assignments if asgn.wall_time is not None], 
+                          key=lambda asgn: asgn.wall_time, reverse=True)
+        strings = ["{:>5s} {:>12s} {:>12s} {:>10s}  {}"
+                   .format('Order', 'Wall time', 'CPU time', 'Size', 'Assignment')]
+        for asgn in executed[:n_rows]:
+            strings.append("{:>5s} {:>12s} {:>12s} {:>10s}  {}"
+                           .format(asgn.order_str, format_duration(asgn.wall_time), 
+                                   format_duration(asgn.cpu_time), format_nbytes(asgn.nbytes),
+                                   str(asgn)))
+        strings.append("Total: {} wall time, {} CPU time in {:d} executed assignments"
+                       .format(format_duration(sum(asgn.wall_time for asgn in executed)),
+                               format_duration(sum(asgn.cpu_time for asgn in executed)),
+                               len(executed)))
+        return "\n".join(strings)
+    
+    
+    def expression_profile_report(self, target):
+        """ Returns a multiline string with the time spent in the sub-expressions of the 
+            assignment of the target, accumulated over all executions since compilation.
+            
+            Pre: the calculation must be compiled with profile_expressions set to True.
+        """
+        for assignment in self._assignments:
+            if assignment.target == target:
+                if assignment.expression_profile is None:
+                    raise AssertionError("Pre: sub-expressions are not profiled: {}"
+                                         .format(assignment))
+                return "{}\n{}".format(assignment, assignment.expression_profile.report())
+        raise ValueError("Unknown target: {!r}".format(target))
+    
             
     def import_from_source_code(self, code):
         """ Sets the code of the
         """
-        self._assignments = []
-        for stat in get_statements_from_code(code):
-            self._assignments.append(Assignment(stat))
+        with Span('parse', 'compile'):
+            self._assignments = []
+            statements = get_statements_from_code(code)
+            for stat, stat_code in zip(statements, get_statement_sources(code, statements)):
+                self._assignments.append(Assignment(stat, code=stat_code))
     
         
     def export_to_source_code(self):
@@ -193,49 +489,68 @@ class Calculation(object):
     def _get_symbol_graph(self, assignments):
         """ Create a graph with the dependencies of all symbols
         """
-        def get_or_add_node(graph, symbol):
-            """ Gets the graph node for the symbol. Adds a node if it doesn't exist yet
-            """
-            if graph.contains(symbol):
-                return graph.get(symbol)
-            else:
-                return graph.add(Node(symbol))
-            
         graph = Graph()
         for assignment in assignments:
-            expr_symbols = expression_symbols(assignment.expression)
-            target_node = get_or_add_node(graph, assignment.target)
-            for expr_sym in expr_symbols:
-                expr_node = get_or_add_node(graph, expr_sym)
-                target_node.connect(expr_node)
+            target_node = graph.get_or_add(assignment.target)
+            for expr_sym in assignment.symbols:
+                target_node.connect(graph.get_or_add(expr_sym))
         return graph
+    
+    
+    def _patch_symbol_graph(self, old_assignment, new_assignment):
+        """ Updates the symbol graph after old_assignment has been replaced by new_assignment.
+        
+            Nodes that are no longer used by any assignment are removed from the graph.
+        """
+        graph = self._graph
+        targets = set([assignment.target for assignment in self.assignments])
+        
+        unused_nodes = set()
+        if old_assignment.target != new_assignment.target:
+            unused_nodes.update(graph.replace_edges(old_assignment.target, []))
+            unused_nodes.add(graph.get(old_assignment.target))
+            
+        graph.get_or_add(new_assignment.target)
+        unused_nodes.update(graph.replace_edges(new_assignment.target, new_assignment.symbols))
+        for node in unused_nodes:
+            if not node.dependents and node.id not in targets:
+                graph.remove(node.id)
 
 
+    def _set_sort_error(self, assignment, error):
+        """ Stores an error that was found while sorting in the assignment, and counts it.
+        """
+        assignment._error = error
+        registry = get_registry()
+        if registry is not None:
+            record_error(registry, error)
+            
+            
     def _sort_assignments(self):
         """ Analyses the dependencies in the assignments and returns a list of targets
         """
         # Create assignment index by target
         assignment_dict = dict()
-        for assignment in self.assignments:
+        for assignment in self._all_assignments():
             if assignment.target not in assignment_dict:
                 assignment_dict[assignment.target] = assignment
             else:
                 ex = CompilationError("Duplicate target symbol: {}"
                                       .format(assignment.target))
-                assignment._error = ex
+                self._set_sort_error(assignment, ex)
                 raise ex 
 
-        graph = self._get_symbol_graph(self._assignments)
         try:
-            ordered_nodes = graph.linearize()
+            with Span('linearize', 'compile'):
+                ordered_nodes = self._graph.linearize()
         except CircularDependencyError, ex:
-            assignment_dict[ex.node_id]._error = ex
-            raise 
+            self._set_sort_error(assignment_dict[ex.node_id], ex)
+            raise CompilationError(str(ex))
         
         lhs_symbols = [node.id for node in ordered_nodes]
 
         # Set all orders to None.
-        for assignment in self.assignments:
+        for assignment in self._all_assignments():
             assignment.order = None
 
         # Add the order for all defined variables.              
@@ -245,7 +560,7 @@ class Calculation(object):
                 assignment_dict[lhs_sym].order = order
                 
         # Sanity check: all assignments must have an order
-        for assignment in self.assignments:
+        for assignment in self._all_assignments():
             if assignment.order is None:
                 raise AssertionError("Unordered assignment: {}".format(assignment))                
 
@@ -255,30 +570,403 @@ class Calculation(object):
         
             Returns self so that you can use it in a chain: calc.compile().execute()
         """
-        self.reset()
-        self._sort_assignments()
-        for assignment in self.assignments:
-            assignment.compile()
+        start_time = default_timer()
+        with Span('Calculation.compile', 'compile'):
+            self.reset()
+            if self.share_subexpressions:
+                with Span('share_subexpressions', 'compile'):
+                    self._shared_assignments = [
+                        Assignment(statement) for statement 
+                        in eliminate_common_subexpressions(self._assignments)]
+            with Span('build_graph', 'compile'):
+                self._graph = self._get_symbol_graph(self._all_assignments())
+            self._sort_assignments()
+            with Span('compile_assignments', 'compile'):
+                for assignment in self._all_assignments():
+                    self._compile_assignment(assignment)
+                    
+        compile_time = default_timer() - start_time
+        registry = get_registry()
+        if registry is not None:
+            registry.counter(COMPILES).inc()
+            registry.histogram(COMPILE_SECONDS).observe(compile_time)
+        recorder = get_recorder()
+        if recorder is not None:
+            recorder.record_compile(self, compile_time)
         return self
             
+    
+    def _compile_assignment(self, assignment):
+        """ Compiles an assignment with the settings of the calculation.
+        """
+        assignment.compile(fused_block_size=self.fused_block_size, 
+                           profile_expressions=self.profile_expressions)
+        
+        
+    def _create_global_vars(self):
+        """ Returns a copy of the execution_global_vars to which numpy is added as _np
+        """
+        global_vars = dict(self.execution_global_vars)
+        exec "_np = __import__('numpy')" in global_vars
+        return global_vars
+    
+    
+    def input_symbols(self):
+        """ Returns the list of symbols that are used by the assignments but not assigned. 
+            Built-ins and global variables are not included.
+        
+            Pre: the calculation must be compiled first.
+        """
+        if self._graph is None:
+            raise AssertionError("Pre: calculation is not compiled")
+        
+        global_vars = self._create_global_vars()
+        targets = set([assignment.target for assignment in self._all_assignments()])
+        return [symbol for symbol in self._graph.nodes 
+                if symbol not in targets and symbol not in global_vars 
+                and not hasattr(__builtin__, symbol)]
+    
+    
+    def compile_function(self, outputs=None, inputs=None, function_name='calculation'):
+        """ Generates a Python function that executes the complete calculation.
+        
+            The assignments become assignments to local variables of the function, which 
+            avoids the dictionary lookups and the overhead of calling eval for each 
+            assignment. Use this to execute the same calculation many times. The function 
+            raises exceptions instead of storing them in the assignments.
+            
+            :param outputs: list of symbols of which the function returns the values as a 
+                tuple. Only the assignments that are needed for the outputs are included. 
+                If None, all targets are returned in execution order.
+            :param inputs: list of symbols that are the parameters of the function. If None, 
+                the input_symbols() are used.
+            :param function_name: the name of the generated function.
+            
+            The function has a source attribute with its source code.
+            Pre: the calculation must be compiled first.
+        """
+        if outputs is None:
+            assignments = sorted(self._all_assignments(), key=assignment_order)
+            shared = set(self._shared_assignments)
+            outputs = [assignment.target for assignment in assignments 
+                       if assignment not in shared]
+        else:
+            assignments = self._get_required_assignments(outputs)
+        inputs = self.input_symbols() if inputs is None else list(inputs)
+
+        source = generate_function_source(function_name, assignments, inputs, outputs)
+        logger.debug("Generated function:\n{}".format(source))
+        return make_function(function_name, source, self._create_global_vars())
+    
+    
+    def _get_required_assignments(self, targets):
+        """ Returns the assignments that are needed to calculate the targets, in execution order.
         
-    def execute(self):
+            Raises a ValueError if a target is not a symbol of the calculation.
+        """
+        for target in targets:
+            if not self._graph.contains(target) and target not in self.execution_local_vars:
+                raise ValueError("Unknown target: {!r}".format(target))
+            
+        required_symbols = self.required_symbols(targets)
+        return [assignment for assignment in sorted(self._all_assignments(), 
+                                                    key=assignment_order) 
+                if assignment.target in required_symbols]
+    
+    
+    def execute(self, targets=None, n_threads=None, n_processes=None, 
+                free_intermediates=False, memory_budget=None):
         """ Executes the assignments. Returns dictionary with results.
         
+            If targets is a list of symbols, only the assignments that are needed to 
+            calculate these symbols are executed. The assignments that are not evaluated 
+            are available in skipped_assignments afterwards; their values are set to None.
+        
+            If n_threads is given, the assignments are executed on a pool of n_threads 
+            threads where independent assignments can run concurrently. If n_processes is 
+            given, they are executed on a pool of n_processes processes instead. In that 
+            case the execution_global_vars must be picklable.
+            
+            If the value_cache is set and the assignments are executed serially, assignments 
+            whose source and input values are unchanged since a previous execution are not 
+            calculated again. Changes in execution_global_vars are not detected. Otherwise, if
+            the buffer_pool is set, the values of fused expressions are stored in its arrays.
+            
+            If free_intermediates is True, the assignments are executed serially and the value
+            of an assignment whose target is not in targets is freed as soon as the last 
+            assignment that uses it has been executed. The peak memory usage is reported in 
+            memory_report. The value_cache and buffer_pool are not used in that case.
+            
+            If the calculation was compiled with share_subexpressions set, the values of the
+            shared_assignments are included in the results.
+            
+            If memory_budget is set, intermediates are freed as with free_intermediates. In 
+            addition, when the values in memory exceed memory_budget bytes, the large arrays 
+            that are needed last are spilled to temporary files and memory-mapped back when 
+            they are used. The numbers of spilled and reloaded values are in memory_report.
+        
             Pre: the calculation must be compiled first.
         """
-        for assignment in self.assignments:
+        if n_threads is not None and n_processes is not None:
+            raise ValueError("n_threads and n_processes cannot both be set.")
+        if memory_budget is not None:
+            free_intermediates = True
+        if free_intermediates and (n_threads is not None or n_processes is not None):
+            raise ValueError("free_intermediates and memory_budget require serial execution.")
+        
+        start_time = default_timer()
+        with Span('Calculation.execute', 'execute'):
+            # Make sure that "from __future__ import division" is at the top of this module
+            assignments = self._select_assignments(targets)
+            global_vars = self._create_global_vars()
+            local_vars = dict(self.execution_local_vars)
+            self.memory_report = None
+            if n_threads is not None:
+                execute_threaded(assignments, global_vars, local_vars, n_threads=n_threads)
+            elif n_processes is not None:
+                execute_multiprocess(assignments, self.execution_global_vars, local_vars, 
+                                     n_processes=n_processes)
+            elif free_intermediates:
+                outputs = [assignment.target for assignment in self.assignments] \
+                    if targets is None else targets
+                self.memory_report = execute_freeing(assignments, global_vars, local_vars, outputs,
+                                                     memory_budget=memory_budget)
+            elif self.value_cache is not None:
+                execute_memoized(assignments, global_vars, local_vars, self.value_cache)
+            else:
+                if self.buffer_pool is None:
+                    buffers = {}
+                else:
+                    buffers = self.buffer_pool.get_buffers(assignments, global_vars, local_vars)
+                for assignment in assignments:
+                    local_vars[assignment.target] = assignment.execute(
+                        global_vars, local_vars, out=buffers.get(assignment.target))
+                    
+        execute_time = default_timer() - start_time
+        registry = get_registry()
+        if registry is not None:
+            registry.counter(EXECUTIONS).inc()
+            registry.histogram(EXECUTION_SECONDS).observe(execute_time)
+        recorder = get_recorder()
+        if recorder is not None:
+            recorder.record_execute(self, execute_time, 
+                                    {'targets': targets, 'n_threads': n_threads, 
+                                     'n_processes': n_processes, 
+                                     'free_intermediates': free_intermediates, 
+                                     'memory_budget': memory_budget})
+        self._global_vars = global_vars
+        # Incremental updates need the values of all assignments.
+        if self._skipped_assignments or free_intermediates:
+            self._local_vars = None
+        else:
+            self._local_vars = local_vars
+        return local_vars
+    
+    
+    def sweep(self, inputs, grid=False, targets=None):
+        """ Executes the calculation once for arrays of input values. Returns dictionary with 
+            results. 
+            
+            The assignments are evaluated with the arrays using NumPy broadcasting. 
+            Assignments that cannot be evaluated this way are evaluated once per element. 
+            Assignments that don't depend on the swept inputs are evaluated only once.
+            
+            :param inputs: dictionary or list of (symbol, values) pairs. These values take 
+                precedence over the execution_local_vars. 
+            :param grid: if True, the 1-D values are combined to a grid with one dimension 
+                per input, in the order of the list or sorted by symbol. If False, the 
+                values are broadcast against each other.
+            :param targets: if given, only the assignments needed for these symbols are 
+                evaluated, like in execute().
+            
+            Pre: the calculation must be compiled first.
+        """
+        assignments = self._select_assignments(targets)
+        sweep_inputs = make_sweep_inputs(inputs, grid=grid)
+        global_vars = self._create_global_vars()
+        local_vars = dict(self.execution_local_vars)
+        local_vars.update(sweep_inputs)
+        execute_sweep(assignments, global_vars, local_vars, sweep_inputs.keys())
+        
+        self._global_vars = global_vars
+        self._local_vars = None # The values don't correspond to the execution_local_vars.
+        return local_vars
+    
+    
+    def execute_chunked(self, input_files, output_files, chunk_size=DEFAULT_CHUNK_SIZE):
+        """ Executes the calculation on input arrays that are larger than memory.
+        
+            The inputs are .npy files that are opened as memory maps. The assignments that 
+            depend on them are executed in chunks of chunk_size elements along the first 
+            axis, so they must be element-wise along that axis. The outputs are written to 
+            memory-mapped .npy files. Only the assignments needed for the outputs are executed.
+            
+            :param input_files: dictionary that maps input symbols to .npy file names.
+            :param output_files: dictionary that maps output symbols to .npy file names.
+            
+            Returns a dictionary that maps the output symbols to read-only memory maps. The 
+            values of the chunked assignments are not kept.
+            
+            Pre: the calculation must be compiled first.
+        """
+        assignments = self._select_assignments(output_files.keys())
+        global_vars = self._create_global_vars()
+        local_vars = dict(self.execution_local_vars)
+        outputs = execute_chunked(assignments, global_vars, local_vars, 
+                                  open_memmaps(input_files), output_files, chunk_size=chunk_size)
+        self._global_vars = global_vars
+        self._local_vars = None # The values of the chunked assignments are not kept.
+        return outputs
+    
+    
+    def _select_assignments(self, targets):
+        """ Returns the assignments that must be executed to calculate the targets in 
+            execution order, or all assignments if targets is None. Sets skipped_assignments.
+        """
+        all_assignments = self._all_assignments()
+        for assignment in all_assignments:
             if assignment.compiled_expression is None:
                 raise AssertionError("Pre: assignment is not compiled: {}".format(assignment))
             
-        # Make sure that "from __future__ import division" is at the top of this module
-        global_vars = {}
-        local_vars = {}
-        exec "_np = __import__('numpy')" in global_vars, local_vars
-        for assignment in sorted(self.assignments, key=assignment_order):
+        if targets is None:
+            self._skipped_assignments = []
+            return sorted(all_assignments, key=assignment_order)
+        
+        if self._graph is None:
+            raise AssertionError("Pre: calculation is not compiled")
+        assignments = self._get_required_assignments(targets)
+        required = set(assignments)
+        self._skipped_assignments = [assignment for assignment in self.assignments 
+                                     if assignment not in required]
+        for assignment in all_assignments:
+            if assignment not in required:
+                assignment.clear_result()
+        return assignments
+    
+    
+    def required_symbols(self, symbols):
+        """ Returns the set of symbols that the symbols depend on, directly or indirectly.
+            The symbols themselves are included in the result.
+            
+            Pre: the calculation must be compiled first.
+        """
+        result = set(symbols)
+        stack = [self._graph.get(symbol) for symbol in symbols if self._graph.contains(symbol)]
+        while stack:
+            for dep_node in stack.pop().edges:
+                if dep_node.id not in result:
+                    result.add(dep_node.id)
+                    stack.append(dep_node)
+        return result
+    
+    
+    def dependent_symbols(self, symbols):
+        """ Returns the set of symbols that depend, directly or indirectly, on the symbols.
+            The symbols themselves are included in the result.
+            
+            Pre: the calculation must be compiled first.
+        """
+        result = set(symbols)
+        stack = [self._graph.get(symbol) for symbol in symbols if self._graph.contains(symbol)]
+        while stack:
+            for dependent in stack.pop().dependents:
+                if dependent.id not in result:
+                    result.add(dependent.id)
+                    stack.append(dependent)
+        return result
+    
+    
+    def replace_assignment(self, idx, code_line):
+        """ Replaces the assignment at position idx with an assignment created from code_line.
+        
+            Only the new assignment is compiled and only the assignments that depend on its 
+            (old or new) target are executed again. The values of the other assignments are 
+            reused from the previous execution. If the calculation has not been executed yet, 
+            or if share_subexpressions is set, the complete calculation is compiled and executed.
+            
+            Returns the list of executed assignments in execution order.
+        """
+        old_assignment = self._assignments[idx]
+        new_assignment = Assignment(code_line)
+        self._assignments[idx] = new_assignment
+        
+        if self._local_vars is None or self.share_subexpressions:
+            self.compile()
+            self.execute()
+            return sorted(self.assignments, key=assignment_order)
+        
+        global_vars, local_vars = self._global_vars, self._local_vars
+        self._local_vars = None  # Forces a complete execution next time if an error occurs.
+        dirty_targets = self.dependent_symbols([old_assignment.target])
+        self._patch_symbol_graph(old_assignment, new_assignment)
+        self._sort_assignments()
+        self._compile_assignment(new_assignment)
+        
+        if old_assignment.target != new_assignment.target:
+            if old_assignment.target in self.execution_local_vars:
+                local_vars[old_assignment.target] = \
+                    self.execution_local_vars[old_assignment.target]
+            else:
+                local_vars.pop(old_assignment.target, None)
+                
+        dirty_targets.update(self.dependent_symbols([new_assignment.target]))
+        dirty_assignments = sorted([assignment for assignment in self.assignments 
+                                    if assignment.target in dirty_targets], 
+                                   key=assignment_order)
+        for assignment in dirty_assignments:
+            assignment.clear_result()
             local_vars[assignment.target] = assignment.execute(global_vars, local_vars)
             
-        return local_vars
+        self._local_vars = local_vars
+        return dirty_assignments
+    
+    
+    def specialize(self, known):
+        """ Returns a compiled residual calculation for the case that the values of some inputs
+            are fixed.
+        
+            The assignments whose inputs are all known, or that only use literals, built-ins 
+            and global variables, are evaluated once. Their values are added, together with 
+            the known values, to the execution_local_vars of the residual calculation. The 
+            residual calculation only contains the assignments that depend on the remaining 
+            inputs, so executing it returns the same values as executing this calculation 
+            with the known values would.
+            
+            :param known: dictionary that maps input symbols to their values. 
+            
+            Pre: the calculation must be compiled first.
+        """
+        if self._graph is None:
+            raise AssertionError("Pre: calculation is not compiled")
+        
+        known_targets = sorted(set(known).intersection(
+            assignment.target for assignment in self.assignments))
+        if known_targets:
+            raise ValueError("Targets cannot be known: {}".format(", ".join(known_targets)))
+        
+        free_symbols = [symbol for symbol in self.input_symbols() if symbol not in known]
+        residual_targets = self.dependent_symbols(free_symbols)
+        
+        global_vars = self._create_global_vars()
+        local_vars = dict(known)
+        for assignment in sorted(self.assignments, key=assignment_order):
+            if assignment.target not in residual_targets:
+                folded = assignment.copy()
+                self._compile_assignment(folded)
+                local_vars[assignment.target] = folded.execute(global_vars, local_vars)
+        
+        residual = Calculation()
+        residual._assignments = [assignment.copy() for assignment in self.assignments 
+                                 if assignment.target in residual_targets]
+        residual.execution_global_vars = dict(self.execution_global_vars)
+        residual.execution_local_vars = dict(self.execution_local_vars)
+        residual.execution_local_vars.update(local_vars)
+        residual.fused_block_size = self.fused_block_size
+        residual.profile_expressions = self.profile_expressions
+        residual.share_subexpressions = self.share_subexpressions
+        logger.debug("Specialized calculation: {:d} of {:d} assignments folded"
+                     .format(len(self) - len(residual), len(self)))
+        return residual.compile()
         
         
     def sort(self, key, reverse=False):
@@ -3,6 +3,8 @@
 
 from __future__ import absolute_import
 import unittest
+import numpy as np
+
 from pepcalk.absynt import CompilationError
 from pepcalk.calculation import Calculation
 
@@ -69,6 +71,210 @@ class Case(unittest.TestCase):
         result = Calculation("b = int('10', base=2)" ).compile().execute()
         self.assertEqual(result['b'], 2)
 
+
+    def test_execute_targets(self):
+        
+        calc = Calculation("a = x + 1; b = a * 2; c = b + a; d = _np.ones(10**6); e = d.sum()")
+        calc.execution_local_vars['x'] = 1
+        calc.compile()
+        
+        result = calc.execute(targets=['c', 'x'])
+        self.assertEqual(sorted(result.keys()), ['a', 'b', 'c', 'x'])
+        self.assertEqual(result['c'], 6)
+        self.assertEqual([assignment.target for assignment in calc.skipped_assignments], 
+                         ['d', 'e'])
+        self.assertTrue(calc.assignments[3].value is None)
+        
+        result = calc.execute(targets=['a'], n_threads=2)
+        self.assertEqual(sorted(result.keys()), ['a', 'x'])
+        
+        self.assertRaises(ValueError, calc.execute, targets=['y'])
+        
+        result = calc.execute()
+        self.assertEqual(calc.skipped_assignments, [])
+        self.assertEqual(result['e'], 10**6)
+        
+        
+    def test_execute_threaded(self):
+        
+        code = "a = 4; b = a * 2; c = a + 1; d = b * c; e = _np.arange(d).sum()"
+        expected = Calculation(code).compile().execute()
+        for n_threads in [1, 4]:
+            result = Calculation(code).compile().execute(n_threads=n_threads)
+            self.assertEqual(result, expected)
+        
+        # Errors are raised as in the serial case
+        calc = Calculation("b = a * 2; a = c; d = 5" ).compile()
+        self.assertRaises(NameError, calc.execute, n_threads=2)
+        self.assertTrue(isinstance(calc.assignments[1].error, NameError))
+        
+        
+    def test_execute_multiprocess(self):
+        
+        code = "a = 4; b = a * 2; c = a + 1; d = b * c; e = _np.arange(d).sum()"
+        expected = Calculation(code).compile().execute()
+        result = Calculation(code).compile().execute(n_processes=2)
+        self.assertEqual(result, expected)
+        
+        # Large arrays are passed via memory-mapped files
+        calc = Calculation("b = a * 2; c = b.sum()")
+        calc.execution_local_vars['a'] = np.arange(500000)
+        result = calc.compile().execute(n_processes=2)
+        self.assertTrue(np.array_equal(result['b'], np.arange(500000) * 2))
+        self.assertEqual(result['c'], 249999500000)
+        self.assertTrue(np.array_equal(calc.assignments[0].value, result['b']))
+        
+        # Errors are raised as in the serial case
+        calc = Calculation("b = a * 2; a = c; d = 5" ).compile()
+        self.assertRaises(NameError, calc.execute, n_processes=2)
+        self.assertTrue(isinstance(calc.assignments[1].error, NameError))
+
+        # Assignments are pickled as their code
+        calc = Calculation("b = (-a) ** 2; c = (not a) + 1; a = 3").compile()
+        self.assertEqual(calc.assignments[0].code, "b = (-a) ** 2")
+        result = calc.execute(n_processes=2)
+        self.assertEqual((result['b'], result['c']), (9, 1))
+
+        # A worker that dies raises an error instead of waiting forever
+        calc = Calculation("a = __import__('os')._exit(3); b = a + 1").compile()
+        self.assertRaises(RuntimeError, calc.execute, n_processes=2)
+        
+        
+    def test_compile_function(self):
+        
+        calc = Calculation("c = b / y; b = x * 2; d = _np.sqrt(c) + abs(x)").compile()
+        self.assertEqual(calc.input_symbols(), ['y', 'x'])
+        
+        function = calc.compile_function()
+        self.assertEqual(function(2, 4), (8, 4.0, 6.0)) # y=2, x=4
+        
+        function = calc.compile_function(outputs=['c'], inputs=['x', 'y'], function_name='f')
+        self.assertTrue('d =' not in function.source)
+        self.assertEqual(function.__name__, 'f')
+        self.assertEqual(function(5, 4), (2.5, ))
+        self.assertRaises(ZeroDivisionError, function, 5, 0)
+        
+        self.assertEqual(Calculation("").compile().compile_function()(), ())
+        
+        # Unary operands of operators with a higher precedence
+        calc = Calculation("b = (-a) ** 2; c = (not a) + 1; d = -a ** 2").compile()
+        self.assertEqual(calc.compile_function(inputs=['a'])(3), (9, 1, -9))
+
+
+    def test_deep_expression(self):
+
+        terms = ["x{:d}".format(idx) for idx in range(5000)]
+        calc = Calculation("a = " + " + ".join(terms))
+        calc.execution_local_vars.update((term, 1) for term in terms)
+        self.assertEqual(calc.compile().execute()['a'], 5000)
+        assignment = calc.assignments[0]
+        self.assertIs(assignment.source, assignment.source) # rendered only once
+
+        self.assertEqual(calc.compile_function(inputs=terms)(*([2] * 5000)), (10000, ))
+        self.assertEqual(calc.execute(n_processes=2)['a'], 5000)
+
+        exported = Calculation(calc.export_to_source_code())
+        self.assertEqual(exported.assignments[0].source, assignment.source)
+
+
+    def test_replace_assignment(self):
+        
+        calc = Calculation("a = 1; b = a * 2; c = 10; d = c + 1")
+        result = calc.compile().execute()
+        
+        # Only the assignment and its dependents are executed
+        executed = calc.replace_assignment(0, "a = 5")
+        self.assertEqual([assignment.target for assignment in executed], ['a', 'b'])
+        self.assertEqual(result['b'], 10)
+        self.assertEqual(result['d'], 11)
+        
+        # Changing the source of an assignment that is used elsewhere
+        executed = calc.replace_assignment(2, "c = a + b")
+        self.assertEqual([assignment.target for assignment in executed], ['c', 'd'])
+        self.assertEqual(result['d'], 16)
+        
+        # Changing the target removes the old target from the results
+        executed = calc.replace_assignment(3, "e = c + 2")
+        self.assertEqual([assignment.target for assignment in executed], ['e'])
+        self.assertEqual(result['e'], 17)
+        self.assertTrue('d' not in result)
+        
+        # Dependents of the old target are executed as well
+        self.assertRaises(NameError, calc.replace_assignment, 0, "f = 5") # b uses a
+        
+        # Symbols that are no longer used are removed from the graph
+        calc = Calculation("a = 1; b = a * x")
+        calc.execution_local_vars.update(x=3, y=4)
+        calc.compile().execute()
+        calc.replace_assignment(1, "c = a * y")
+        self.assertEqual(sorted(calc._graph.nodes.keys()), ['a', 'c', 'y'])
+        
+        # Not executed yet: compiles and executes the complete calculation
+        calc = Calculation("a = 1; b = a * 2")
+        executed = calc.replace_assignment(0, "a = 3")
+        self.assertEqual(len(executed), 2)
+        self.assertEqual(calc.assignments[1].value, 6)
+
+        
+    def test_profile(self):
+        
+        calc = Calculation("a = _np.ones(1000); b = a.sum(); c = b + 1")
+        self.assertIsNone(calc.assignments[0].wall_time)
+        calc.compile().execute(targets=['b'])
+        
+        a, b, c = calc.assignments
+        self.assertEqual(a.nbytes, 8000)
+        self.assertTrue(a.wall_time >= 0)
+        self.assertTrue(b.cpu_time >= 0)
+        self.assertIsNone(c.wall_time)
+        self.assertIsNone(c.nbytes)
+        
+        report = calc.profile_report().splitlines()
+        self.assertEqual(len(report), 4)
+        self.assertIn("7.812 kB", report[1] + report[2])
+        self.assertIn("2 executed assignments", report[-1])
+        self.assertEqual(len(calc.profile_report(n_rows=1).splitlines()), 3)
+        
+        calc.execute(n_processes=2)
+        self.assertEqual(c.nbytes, 8) # numpy.float64
+        self.assertTrue(c.wall_time >= 0)
+        
+        
+    def test_specialize(self):
+        
+        calc = Calculation("price = tariff * usage; fee = tariff * 10; "
+                           "total = price + fee + vat; vat = 0.2 * fee; n = abs(-3)")
+        calc.execution_local_vars['usage'] = 1.0
+        calc.compile()
+        
+        residual = calc.specialize({'tariff': 2.0})
+        self.assertEqual([assignment.target for assignment in residual.assignments], 
+                         ['price', 'total'])
+        self.assertEqual(residual.execution_local_vars['fee'], 20.0)
+        self.assertEqual(residual.execution_local_vars['n'], 3)
+        
+        residual.execution_local_vars['usage'] = 5.0
+        result = residual.execute()
+        self.assertEqual(result['total'], 34.0)
+        
+        calc.execution_local_vars.update({'tariff': 2.0, 'usage': 5.0})
+        expected = calc.execute()
+        self.assertEqual(sorted(result.keys()), sorted(expected.keys()))
+        for key, value in expected.items():
+            self.assertEqual(result[key], value)
+        
+        self.assertEqual(len(calc.specialize({'tariff': 2.0, 'usage': 1.0})), 0)
+        self.assertRaises(ValueError, calc.specialize, {'fee': 1.0})
+        self.assertRaises(AssertionError, Calculation("a = 1").specialize, {})
+        
+        # Unary operands keep their parentheses
+        calc = Calculation("b = (-k) ** 2; d = (-x) ** 2 + b").compile()
+        residual = calc.specialize({'k': 3})
+        self.assertEqual(residual.execution_local_vars['b'], 9)
+        self.assertEqual(residual.assignments[0].code, "d = (-x) ** 2 + b")
+        residual.execution_local_vars['x'] = 2
+        self.assertEqual(residual.execute()['d'], 13)
+        
         
 if __name__ == '__main__':
     unittest.main()
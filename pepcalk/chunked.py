@@ -0,0 +1,128 @@
+""" Out-of-core execution of calculations on arrays that are stored in .npy files.
+"""
+from __future__ import absolute_import, division
+
+import logging
+
+import numpy as np
+
+from pepcalk.fused import is_elementwise
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 2**18
+
+
+def open_memmaps(file_names):
+    """ Opens .npy files as read-only memory maps.
+
+        :param file_names: dictionary that maps symbols to file names.
+        Returns a dictionary that maps the symbols to numpy.memmap objects.
+    """
+    return dict([(symbol, np.load(file_name, mmap_mode='r'))
+                 for symbol, file_name in file_names.iteritems()])
+
+
+def _check_rows(symbol, value, n_rows):
+    """ Raises a ValueError if the value does not have n_rows elements along the first axis.
+    """
+    shape = np.shape(value)
+    if len(shape) == 0 or shape[0] != n_rows:
+        raise ValueError("Value of {!r} is not element-wise: length {} for a chunk of {}"
+                         .format(symbol, shape[0] if shape else 0, n_rows))
+
+
+def _check_operands(assignment, chunk_vars, chunked):
+    """ Raises a ValueError if the assignment uses an array that is not chunked, but that
+        has as many dimensions as a chunked operand. Its first axis would then be combined
+        with the rows of the chunk. Arrays with fewer dimensions, e.g. weights per column, 
+        are broadcast along the rows.
+    """
+    symbols = set(assignment.symbols)
+    n_dims = min([np.ndim(chunk_vars[symbol]) for symbol in symbols if symbol in chunked])
+    for symbol in symbols:
+        value = chunk_vars.get(symbol)
+        if (symbol not in chunked and isinstance(value, (np.ndarray, list, tuple)) and 
+                np.ndim(value) >= n_dims):
+            raise ValueError("Assignment {!r} combines the chunked rows with array {!r}, "
+                             "which is not chunked.".format(assignment.target, symbol))
+
+
+def execute_chunked(assignments, global_vars, local_vars, input_arrays, output_files,
+                    chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Executes the assignments in chunks along the first axis of the input arrays.
+
+        The assignments that depend on the input arrays are executed once per chunk, with
+        the input symbols bound to slices of the input arrays. They must be element-wise (see
+        fused.is_elementwise), so e.g. a / a.sum() raises a ValueError, because it would 
+        divide by the sum of each chunk. Arrays that are not chunked may only be used if 
+        they have fewer dimensions than the chunked operands. The assignments that don't depend on the inputs are executed
+        once and their values are stored in local_vars. The values of the output symbols are
+        written to memory-mapped .npy files, which are created when the first chunk has been
+        calculated. So only one chunk of each intermediate value is kept in memory. If the 
+        input arrays are empty, the assignments are executed once with empty chunks so that
+        the output files are created with the right data type and shape.
+
+        :param assignments: compiled assignments in execution order.
+        :param input_arrays: dictionary that maps symbols to arrays, e.g. numpy.memmap
+            objects. The arrays must have the same length.
+        :param output_files: dictionary that maps output symbols to file names.
+        :param chunk_size: the number of elements along the first axis in a chunk.
+
+        Returns a dictionary that maps the output symbols to read-only memory maps.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size should be at least 1. Got: {}".format(chunk_size))
+
+    lengths = set([len(array) for array in input_arrays.itervalues()])
+    if len(lengths) != 1:
+        raise ValueError("Input arrays should have the same length. Got: {}"
+                         .format(sorted(lengths)))
+    n_rows = lengths.pop()
+
+    chunked = set(input_arrays)
+    chunk_assignments = []
+    for assignment in assignments:
+        if chunked.intersection(assignment.symbols):
+            if not is_elementwise(assignment.evaluated_expression):
+                raise ValueError("Assignment {!r} is not element-wise, so it cannot be "
+                                 "executed in chunks: {}".format(assignment.target, assignment))
+            chunked.add(assignment.target)
+            chunk_assignments.append(assignment)
+    chunk_set = set(chunk_assignments)
+    for assignment in assignments:
+        if assignment not in chunk_set:
+            local_vars[assignment.target] = assignment.execute(global_vars, local_vars)
+
+    for symbol in output_files:
+        if symbol not in chunked:
+            raise ValueError("Output {!r} does not depend on the input arrays.".format(symbol))
+
+    output_arrays = {}
+    for start in range(0, max(n_rows, 1), chunk_size):
+        stop = min(start + chunk_size, n_rows)
+        chunk_vars = dict(local_vars)
+        for symbol, array in input_arrays.iteritems():
+            chunk_vars[symbol] = array[start:stop]
+        for assignment in chunk_assignments:
+            if start == 0:
+                _check_operands(assignment, chunk_vars, chunked)
+            value = assignment.execute(global_vars, chunk_vars)
+            _check_rows(assignment.target, value, stop - start)
+            chunk_vars[assignment.target] = value
+
+        for symbol, file_name in output_files.iteritems():
+            value = np.asarray(chunk_vars[symbol])
+            if symbol not in output_arrays:
+                output_arrays[symbol] = np.lib.format.open_memmap(
+                    file_name, mode='w+', dtype=value.dtype, shape=(n_rows, ) + value.shape[1:])
+            output_arrays[symbol][start:stop] = value
+        logger.debug("Executed chunk {}:{} of {}".format(start, stop, n_rows))
+
+    # The values of the chunked assignments would only contain the last chunk.
+    for assignment in chunk_assignments:
+        assignment.clear_result()
+
+    for array in output_arrays.itervalues():
+        array.flush()
+    return open_memmaps(output_files)
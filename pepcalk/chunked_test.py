@@ -0,0 +1,80 @@
+""" Tests for the chunked module.
+"""
+
+from __future__ import absolute_import
+import unittest, os, shutil, tempfile
+import numpy as np
+
+from pepcalk.calculation import Calculation
+
+
+class ChunkedCase(unittest.TestCase):
+    """A test class for out-of-core execution"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        
+    def file_name(self, name):
+        " Returns the full path of a file in the temporary directory "
+        return os.path.join(self.directory, name)
+
+
+    def test_execute_chunked(self):
+        
+        a = np.arange(50.0)
+        b = np.arange(100).reshape(50, 2)
+        np.save(self.file_name('a.npy'), a)
+        np.save(self.file_name('b.npy'), b)
+        
+        calc = Calculation("c = a * 2 + k; d = _np.sqrt(c); e = b * k; k = 3; f = k + 1")
+        calc.compile()
+        outputs = calc.execute_chunked({'a': self.file_name('a.npy'), 
+                                        'b': self.file_name('b.npy')}, 
+                                       {'d': self.file_name('d.npy'), 
+                                        'e': self.file_name('e.npy')}, chunk_size=7)
+        self.assertTrue(isinstance(outputs['d'], np.memmap))
+        self.assertTrue(np.allclose(outputs['d'], np.sqrt(a * 2 + 3)))
+        self.assertTrue(np.array_equal(np.load(self.file_name('e.npy')), b * 3))
+        self.assertEqual(calc.assignments[3].value, 3)
+        self.assertTrue(calc.assignments[0].value is None)
+        self.assertEqual([assignment.target for assignment in calc.skipped_assignments], ['f'])
+        
+        # Outputs must depend on the inputs and be element-wise
+        self.assertRaises(ValueError, calc.execute_chunked, {'a': self.file_name('a.npy')}, 
+                          {'k': self.file_name('k.npy')})
+        calc = Calculation("c = a.sum()").compile()
+        self.assertRaises(ValueError, calc.execute_chunked, {'a': self.file_name('a.npy')}, 
+                          {'c': self.file_name('c.npy')})
+        
+        # Intermediate values and sub-expressions must be element-wise as well
+        for code in ["m = a.sum(); c = a / m", "c = a / a.sum()"]:
+            calc = Calculation(code).compile()
+            self.assertRaises(ValueError, calc.execute_chunked, 
+                              {'a': self.file_name('a.npy')}, {'c': self.file_name('c.npy')},
+                              chunk_size=5)
+        
+        # Arrays that are not chunked must not be combined with the rows
+        calc = Calculation("c = a * w").compile()
+        calc.execution_local_vars['w'] = np.ones(5)
+        self.assertRaises(ValueError, calc.execute_chunked, {'a': self.file_name('a.npy')}, 
+                          {'c': self.file_name('c.npy')}, chunk_size=5)
+        calc = Calculation("e = b * w").compile()
+        calc.execution_local_vars['w'] = np.array([1, 10])
+        outputs = calc.execute_chunked({'b': self.file_name('b.npy')}, 
+                                       {'e': self.file_name('e.npy')}, chunk_size=7)
+        self.assertTrue(np.array_equal(outputs['e'], b * [1, 10]))
+        
+        # Empty inputs result in empty outputs
+        np.save(self.file_name('empty.npy'), np.zeros((0, 2), dtype=np.int32))
+        calc = Calculation("c = a * 2.0").compile()
+        outputs = calc.execute_chunked({'a': self.file_name('empty.npy')}, 
+                                       {'c': self.file_name('c.npy')})
+        self.assertEqual(outputs['c'].shape, (0, 2))
+        self.assertEqual(outputs['c'].dtype, np.float64)
+        
+
+if __name__ == '__main__':
+    unittest.main()
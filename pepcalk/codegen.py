@@ -0,0 +1,46 @@
+""" Generates Python functions from calculations.
+"""
+from __future__ import absolute_import, division
+
+import logging
+
+from pepcalk.absynt import CompilationError, ast_to_str
+from pepcalk.utils import check_class
+
+logger = logging.getLogger(__name__)
+
+INDENT = "    "
+
+
+def generate_function_source(function_name, assignments, input_symbols, output_symbols):
+    """ Returns the source code of a function that executes the assignments.
+
+        The input symbols are the parameters of the function. The assignments become
+        assignments to local variables and should be given in execution order. The function
+        returns a tuple with the values of the output symbols.
+    """
+    lines = ["def {}({}):".format(function_name, ', '.join(input_symbols))]
+    for assignment in assignments:
+        lines.append("{}{} = {}".format(INDENT, assignment.target,
+                                        ast_to_str(assignment.evaluated_expression)))
+    lines.append("{}return ({}{})".format(INDENT, ', '.join(output_symbols),
+                                          ',' if len(output_symbols) == 1 else ''))
+    return '\n'.join(lines) + '\n'
+
+
+def make_function(function_name, source, global_vars):
+    """ Compiles the source of a function definition and returns the function.
+
+        The global_vars dictionary is used as the globals of the function.
+        Make sure that "from __future__ import division" is at the top of this module.
+    """
+    check_class(source, basestring)
+    namespace = {}
+    try:
+        code = compile(source, "<pepcalk {}>".format(function_name), "exec")
+    except SyntaxError, ex:
+        raise CompilationError("Unable to compile generated function: {}".format(ex))
+    exec code in global_vars, namespace
+    function = namespace[function_name]
+    function.source = source
+    return function
@@ -0,0 +1,73 @@
+""" Process-wide cache of compiled expressions.
+
+    Expressions are identified by a hash of their canonical source code (as rendered by
+    ast_to_str), so equal expressions share one code object, even between calculations.
+"""
+from __future__ import absolute_import, division
+
+import logging, hashlib
+from collections import OrderedDict
+
+from pepcalk.absynt import wrap_expression
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 100000
+
+
+def source_key(source):
+    """ Returns the key of an expression in the cache, given its canonical source code.
+    """
+    if isinstance(source, unicode):
+        source = source.encode('utf-8')
+    return hashlib.sha1(source).digest()
+
+
+class CompileCache(object):
+    """ Least recently used (LRU) cache that contains the code objects of expressions.
+
+        A miss is a request for an expression that was not compiled yet.
+    """
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        """ Constructor
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # key -> code object
+        self.n_hits = 0
+        self.n_misses = 0
+        self.n_compiles = 0
+
+    def __len__(self):
+        "Number of expressions in the cache"
+        return len(self._entries)
+
+    def __str__(self):
+        return "<CompileCache: {:d} entries, {:d} hits, {:d} misses, {:d} compiles>".format(
+            len(self._entries), self.n_hits, self.n_misses, self.n_compiles)
+
+    def clear(self):
+        """ Removes all entries and resets the counters.
+        """
+        self._entries.clear()
+        self.n_hits = 0
+        self.n_misses = 0
+        self.n_compiles = 0
+
+    def get_code(self, key, expression):
+        """ Returns the code object of the expression. Compiles the expression if needed.
+        """
+        code = self._entries.pop(key, None)
+        if code is None:
+            self.n_misses += 1
+            # Make sure that "from __future__ import division" is at the top of this module
+            code = compile(wrap_expression(expression), "<string>", "eval")
+            self.n_compiles += 1
+            while len(self._entries) >= self.max_entries:
+                self._entries.popitem(last=False)
+        else:
+            self.n_hits += 1
+        self._entries[key] = code # (Re)insert as most recently used entry.
+        return code
+
+
+COMPILE_CACHE = CompileCache()
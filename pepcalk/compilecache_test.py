@@ -0,0 +1,58 @@
+""" Tests for the compilecache module.
+"""
+
+from __future__ import absolute_import
+import unittest
+
+from pepcalk.calculation import Assignment, Calculation
+from pepcalk.compilecache import CompileCache, COMPILE_CACHE
+
+
+class CompileCacheCase(unittest.TestCase):
+    """A test class for the CompileCache class"""
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+
+    def test_cache_key(self):
+        
+        self.assertEqual(Assignment("a = b+1").cache_key, Assignment("c = (b + 1)").cache_key)
+        self.assertNotEqual(Assignment("a = b + 1").cache_key, 
+                            Assignment("a = b + 2").cache_key)
+        
+        
+    def test_cache(self):
+        
+        cache = CompileCache(max_entries=2)
+        assignment = Assignment("a = b * c + b")
+        key, expr = assignment.cache_key, assignment.expression
+        code = cache.get_code(key, expr)
+        self.assertTrue(cache.get_code(key, expr) is code)
+        self.assertEqual((cache.n_hits, cache.n_misses, cache.n_compiles), (1, 1, 1))
+        
+        # Least recently used entries are removed
+        for code_line in ["a = 1", "a = 2", "a = 3"]:
+            other = Assignment(code_line)
+            cache.get_code(other.cache_key, other.expression)
+        self.assertEqual(len(cache), 2)
+        cache.get_code(key, expr)
+        self.assertEqual(cache.n_compiles, 5)
+        
+        
+    def test_recompile_calculation(self):
+        
+        calc = Calculation("a = 1.5; b = a * 2; c = b + a")
+        calc.compile()
+        n_compiles = COMPILE_CACHE.n_compiles
+        calc.replace_assignment(1, "b = a * 3.25 - 0.875") # not used by other tests
+        calc.compile()
+        self.assertEqual(COMPILE_CACHE.n_compiles, n_compiles + 1)
+        self.assertEqual(calc.execute()["c"], 5.5)
+        
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,243 @@
+""" Elimination of common sub-expressions across the assignments of a calculation.
+
+    Sub-expressions are identified by a structural key, which is equal for equal sub-trees.
+    A sub-expression that occurs more than once is evaluated by a single shared assignment
+    and its occurrences are replaced by the target of that assignment. Only pure
+    sub-expressions are shared: operators, attribute lookups and calls of the functions in
+    PURE_FUNCTIONS. The operands of 'and' and 'or' after the first one are only evaluated
+    conditionally, so they are left alone.
+"""
+from __future__ import absolute_import, division
+
+import logging, ast
+from collections import OrderedDict
+
+from pepcalk.absynt import ast_to_str, copy_tree
+from pepcalk.fused import FUSABLE_FUNCTIONS
+
+logger = logging.getLogger(__name__)
+
+SHARED_PREFIX = '_cse'
+
+_PURE_BUILTINS = ['abs', 'bool', 'complex', 'divmod', 'float', 'int', 'len', 'long', 'max',
+                  'min', 'pow', 'round']
+
+_PURE_NUMPY_FUNCTIONS = list(FUSABLE_FUNCTIONS) + [
+    'all', 'amax', 'amin', 'any', 'arange', 'argmax', 'argmin', 'clip', 'cumprod', 'cumsum',
+    'diff', 'dot', 'linspace', 'max', 'mean', 'median', 'min', 'ones', 'prod', 'std', 'sum',
+    'var', 'where', 'zeros']
+
+# The functions whose calls can be shared, because they have no side effects.
+PURE_FUNCTIONS = frozenset(_PURE_BUILTINS + ['_np.' + name for name in _PURE_NUMPY_FUNCTIONS])
+
+# The types of the sub-expressions that are shared. Attribute lookups are only shared as 
+# part of a call, e.g. a.sum() but not a.sum.
+_SHAREABLE_TYPES = (ast.UnaryOp, ast.BinOp, ast.BoolOp, ast.Call)
+
+
+class _Entry(object):
+    """ The target and the (rewritten) expression of an assignment.
+    """
+    def __init__(self, target, expression, assignment=None):
+        """ Constructor. The assignment is None for shared assignments.
+        """
+        self.target = target
+        self.expression = expression
+        self.assignment = assignment
+        self.rewritten = False
+
+
+def _is_pure_function(func, targets):
+    """ Returns True if func, the function node of an ast.Call, is in PURE_FUNCTIONS and is not
+        redefined by one of the targets.
+    """
+    if isinstance(func, ast.Name):
+        return func.id in PURE_FUNCTIONS and func.id not in targets
+    elif isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name):
+        return (func.value.id not in targets and
+                "{}.{}".format(func.value.id, func.attr) in PURE_FUNCTIONS)
+    else:
+        return False
+
+
+def _get_children(node):
+    """ Returns a list of (field, index, child, shareable) tuples of the child nodes of node. 
+        The index is None unless the field is a list. Shareable is False for operands that 
+        are evaluated conditionally.
+    """
+    node_type = type(node)
+    if node_type == ast.UnaryOp:
+        return [('operand', None, node.operand, True)]
+    elif node_type == ast.BinOp:
+        return [('left', None, node.left, True), ('right', None, node.right, True)]
+    elif node_type == ast.BoolOp:
+        return [('values', idx, value, idx == 0) for idx, value in enumerate(node.values)]
+    elif node_type in (ast.Attribute, ast.keyword):
+        return [('value', None, node.value, True)]
+    elif node_type == ast.Call:
+        return ([('func', None, node.func, True)] +
+                [('args', idx, arg, True) for idx, arg in enumerate(node.args)] +
+                [('keywords', idx, keyword, True) for idx, keyword in enumerate(node.keywords)])
+    else:
+        return []
+
+
+def _node_key(node, child_keys):
+    """ Returns the structural key of a node, given the key ids of its children. Nodes have
+        equal keys if and only if they are equal sub-trees.
+    """
+    node_type = type(node)
+    if node_type == ast.Name:
+        return (node_type, node.id)
+    elif node_type == ast.Num:
+        return (node_type, repr(node.n)) # 1 and 1.0 are equal but are different sub-trees
+    elif node_type == ast.Str:
+        return (node_type, type(node.s), node.s)
+    elif node_type in (ast.UnaryOp, ast.BinOp, ast.BoolOp):
+        return (node_type, type(node.op), child_keys)
+    elif node_type == ast.Attribute:
+        return (node_type, node.attr, child_keys)
+    elif node_type == ast.keyword:
+        return (node_type, node.arg, child_keys)
+    elif node_type == ast.Call:
+        return (node_type, child_keys)
+    else:
+        return (node_type, id(node)) # Never shared
+
+
+def _collect(entries, targets):
+    """ Returns an OrderedDict that maps the structural keys of the pure, shareable 
+        sub-expressions to the list of their (node, location) occurrences, and a dictionary 
+        that maps the id() of these nodes to their key.
+        
+        A location is an (entry, parent, field, index) tuple, where parent is None if the
+        node is the expression of the entry. The trees are traversed without recursion.
+    """
+    key_ids = {} # Interned keys, so that the key of a node has a size independent of depth 
+    node_info = {} # id(node) -> (key_id, pure)
+    occurrences = OrderedDict()
+    node_keys = {}
+    for entry in entries:
+        # Pre-order traversal. In reverse order all children are visited before their parent.
+        visited = []
+        stack = [(entry.expression, (entry, None, None, None), True)]
+        while stack:
+            node, location, shareable = stack.pop()
+            children = _get_children(node)
+            visited.append((node, location, shareable, children))
+            stack.extend([(child, (entry, node, field, index), shareable and child_shareable)
+                          for field, index, child, child_shareable in reversed(children)])
+            
+        for node, location, shareable, children in reversed(visited):
+            child_info = [node_info[id(child)] for _, _, child, _ in children]
+            key = _node_key(node, tuple([key_id for key_id, _ in child_info]))
+            key_id = key_ids.setdefault(key, len(key_ids))
+            node_type = type(node)
+            if node_type in (ast.Name, ast.Num, ast.Str):
+                pure = True
+            elif node_type in (ast.UnaryOp, ast.BinOp, ast.BoolOp, ast.Attribute, ast.keyword):
+                pure = all([child_pure for _, child_pure in child_info])
+            elif node_type == ast.Call:
+                pure = (all([child_pure for _, child_pure in child_info]) and 
+                        _is_pure_function(node.func, targets))
+            else:
+                pure = False
+            node_info[id(node)] = (key_id, pure)
+        
+        for node, location, shareable, _ in visited:
+            key_id, pure = node_info[id(node)]
+            if pure and shareable and type(node) in _SHAREABLE_TYPES:
+                occurrences.setdefault(key_id, []).append((node, location))
+                node_keys[id(node)] = key_id
+    return occurrences, node_keys
+
+
+def _find_common(entries, occurrences, node_keys):
+    """ Returns the list of keys of the common sub-expressions that are not part of a larger
+        common sub-expression, in order of appearance. 
+    """
+    common = OrderedDict()
+    for entry in entries:
+        stack = [entry.expression]
+        while stack:
+            node = stack.pop()
+            key_id = node_keys.get(id(node))
+            if key_id is not None and len(occurrences[key_id]) > 1:
+                common[key_id] = True
+            else:
+                stack.extend([child for _, _, child, _ in reversed(_get_children(node))])
+    return list(common)
+
+
+def _replace(location, node):
+    """ Replaces the node at the location by another node.
+    """
+    entry, parent, field, index = location
+    if parent is None:
+        entry.expression = node
+    elif index is None:
+        setattr(parent, field, node)
+    else:
+        getattr(parent, field)[index] = node
+    entry.rewritten = True
+
+
+def eliminate_common_subexpressions(assignments):
+    """ Replaces the common sub-expressions of the assignments by the targets of shared
+        assignments.
+
+        The expressions of the assignments are not changed; the rewritten expressions are set
+        with Assignment.set_evaluated_expression. If a common sub-expression is the complete
+        expression of an assignment, its target is used instead of a shared assignment.
+        
+        The largest common sub-expressions are shared first. Each round shares all common
+        sub-expressions that are not part of a larger one in a single pass over the trees.
+        Another round follows as long as the shared assignments have common sub-expressions 
+        with the others, e.g. x ** 2 in r = _np.sqrt(x ** 2 + 1); s = _np.sqrt(x ** 2 + 1); 
+        t = x ** 2.
+
+        Returns the list of ast.Assign statements of the shared assignments, whose targets
+        start with SHARED_PREFIX.
+    """
+    targets = set(assignment.target for assignment in assignments)
+    used_symbols = set(targets)
+    for assignment in assignments:
+        used_symbols.update(assignment.symbols)
+
+    entries = [_Entry(assignment.target, copy_tree(assignment.expression), assignment)
+               for assignment in assignments]
+    while True:
+        occurrences, node_keys = _collect(entries, targets)
+        common = _find_common(entries, occurrences, node_keys)
+        if not common:
+            break
+        
+        for key_id in common:
+            nodes = occurrences[key_id]
+            owners = [location[0] for _, location in nodes if location[1] is None]
+            if owners:
+                owner = owners[0]
+            else:
+                shared_target = SHARED_PREFIX + str(len(entries) - len(assignments))
+                while shared_target in used_symbols:
+                    shared_target += '_'
+                owner = _Entry(shared_target, nodes[0][0])
+                entries.append(owner)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Sharing {} as {} ({:d} occurrences)"
+                             .format(ast_to_str(nodes[0][0]), owner.target, len(nodes)))
+            
+            for node, location in nodes:
+                if location[1] is not None or location[0] is not owner:
+                    _replace(location, ast.copy_location(
+                        ast.Name(id=owner.target, ctx=ast.Load()), node))
+
+    statements = []
+    for entry in entries:
+        if entry.assignment is None:
+            statement = ast.Assign(targets=[ast.Name(id=entry.target, ctx=ast.Store())],
+                                   value=entry.expression)
+            statements.append(ast.copy_location(statement, entry.expression))
+        elif entry.rewritten:
+            entry.assignment.set_evaluated_expression(entry.expression)
+    return statements
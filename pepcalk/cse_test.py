@@ -0,0 +1,124 @@
+""" Tests for the cse module.
+"""
+
+from __future__ import absolute_import
+import unittest
+
+import numpy as np
+
+from pepcalk.absynt import ast_to_str
+from pepcalk.calculation import Calculation
+
+
+class CseCase(unittest.TestCase):
+    """A test class for the elimination of common sub-expressions"""
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+
+    def check_results(self, calc):
+        """ Checks that the results with and without sharing sub-expressions are equal.
+        """
+        calc.share_subexpressions = False
+        expected = calc.compile().execute()
+        calc.share_subexpressions = True
+        result = calc.compile().execute()
+        for key, value in expected.items():
+            np.testing.assert_array_equal(result[key], value)
+        
+        
+    def test_shared_assignments(self):
+        
+        calc = Calculation("r = _np.sqrt(x**2 + y**2) * 2; s = 1 + _np.sqrt(x**2 + y**2); "
+                           "t = x**2 - 1")
+        calc.execution_local_vars.update({'x': np.arange(4.0), 'y': 3.0})
+        calc.share_subexpressions = True
+        calc.compile()
+        
+        # The largest common sub-expression is shared, x**2 is shared with t.
+        self.assertEqual([str(assignment) for assignment in calc.shared_assignments],
+                         ["_cse0 = _np.sqrt(_cse1 + y ** 2)", "_cse1 = x ** 2"])
+        r, s, t = calc.assignments
+        self.assertEqual(r.source, "_np.sqrt(x ** 2 + y ** 2) * 2")
+        self.assertEqual(ast_to_str(r.evaluated_expression), "_cse0 * 2")
+        self.assertEqual(ast_to_str(t.evaluated_expression), "_cse1 - 1")
+        self.assertEqual(sorted(calc.input_symbols()), ['x', 'y'])
+        self.check_results(calc)
+        
+        calc.share_subexpressions = True
+        calc.compile()
+        result = calc.execute(targets=['s'])
+        self.assertEqual(result['s'][1], 1 + np.sqrt(10.0))
+        self.assertEqual(calc.skipped_assignments, [r, t])
+        self.assertEqual(calc.compile_function(inputs=["x", "y"])(np.arange(4.0), 3.0)[2][1], 0.0)
+        
+        calc.share_subexpressions = False
+        calc.compile()
+        self.assertEqual(calc.shared_assignments, [])
+        self.assertIs(r.evaluated_expression, r.expression)
+        
+        
+    def test_reuse_target(self):
+        
+        calc = Calculation("a = abs(x - 1); b = abs(x - 1) + 1; c = abs(x - 1)")
+        calc.execution_local_vars['x'] = -2
+        calc.share_subexpressions = True
+        calc.compile()
+        self.assertEqual(calc.shared_assignments, [])
+        a, b, c = calc.assignments
+        self.assertEqual(ast_to_str(b.evaluated_expression), "a + 1")
+        self.assertEqual(ast_to_str(c.evaluated_expression), "a")
+        self.assertEqual(calc.execute(n_processes=2)['b'], 4)
+        
+        
+    def test_impure(self):
+        
+        calc = Calculation("a = f(x) + 1; b = f(x) + 2; c = (x or g(x + 1)) + (x + 1); "
+                           "d = abs(y + 1) + abs(y + 1); abs = 3; e = a.sum() + a.sum()")
+        calc.share_subexpressions = True
+        calc.compile()
+        sources = [str(assignment) for assignment in calc.shared_assignments]
+        # Calls of unknown functions, and of redefined ones, are not shared. Sub-expressions
+        # that are evaluated conditionally are not shared either.
+        self.assertEqual(sources, ["_cse0 = y + 1"])
+        
+        
+    def test_results(self):
+        
+        self.check_results(Calculation("a = 3; b = (a + 1) * 2; c = (a + 1) * 2 + (a + 1); "
+                                       "d = -(a + 1) / (b - c); e = _np.arange(a + 1).sum()"))
+
+        # Rewritten assignments are pickled with parentheses around unary operands
+        calc = Calculation("a = 3; b = (-a) ** 2 + 1; c = (-a) ** 2 + 2")
+        calc.share_subexpressions = True
+        self.assertEqual(calc.compile().execute(n_processes=2)['b'], 10)
+
+
+    def test_large(self):
+
+        # Many common sub-expressions are shared in a single round
+        code = "; ".join(["p{0} = (x + {0}) * 2; q{0} = (x + {0}) * 3".format(idx)
+                          for idx in range(1000)])
+        calc = Calculation(code)
+        calc.execution_local_vars['x'] = 1
+        calc.share_subexpressions = True
+        calc.compile()
+        self.assertEqual(len(calc.shared_assignments), 1000)
+        self.assertEqual(calc.execute()['q999'], 3000)
+
+        # Deeply nested expressions
+        terms = ["x{:d}".format(idx) for idx in range(5000)]
+        calc = Calculation("a = {0}; b = ({0}) * 2".format(" + ".join(terms)))
+        calc.execution_local_vars.update((term, 1) for term in terms)
+        calc.share_subexpressions = True
+        calc.compile()
+        self.assertEqual(ast_to_str(calc.assignments[1].evaluated_expression), "a * 2")
+        self.assertEqual(calc.execute()['b'], 10000)
+        
+        
+if __name__ == '__main__':
+    unittest.main()
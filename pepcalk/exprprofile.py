@@ -0,0 +1,143 @@
+""" Profiling of the sub-expressions of an assignment.
+
+    The expression is instrumented before it is compiled: each function call and binary
+    operation is wrapped as _profile_exit(idx, _profile_enter(idx), <node>), so that the time
+    between entering and leaving the node is measured. The functions are added to the global
+    variables when the expression is evaluated.
+"""
+from __future__ import absolute_import, division
+
+import logging, ast
+from timeit import default_timer
+
+from pepcalk.absynt import analyze_expression, copy_tree, wrap_expression
+
+logger = logging.getLogger(__name__)
+
+ENTER_FUNCTION = '_profile_enter'
+EXIT_FUNCTION = '_profile_exit'
+INSTRUMENTED_TYPES = (ast.Call, ast.BinOp)
+
+
+def _wrap_node(node, idx):
+    """ Returns the node wrapped as _profile_exit(idx, _profile_enter(idx), node). The new
+        nodes get the location of the node.
+    """
+    def located(new_node):
+        " Returns the new node with the location of the node "
+        return ast.copy_location(new_node, node)
+    
+    enter_call = located(ast.Call(func=located(ast.Name(id=ENTER_FUNCTION, ctx=ast.Load())),
+                                  args=[located(ast.Num(n=idx))], 
+                                  keywords=[], starargs=None, kwargs=None))
+    return located(ast.Call(func=located(ast.Name(id=EXIT_FUNCTION, ctx=ast.Load())),
+                            args=[located(ast.Num(n=idx)), enter_call, node],
+                            keywords=[], starargs=None, kwargs=None))
+
+
+def _instrument(expression):
+    """ Returns an (instrumented, sources, parents) tuple. The instrumented expression is a 
+        copy of the expression in which the ast.Call and ast.BinOp nodes are wrapped with 
+        the profile functions. Sources contains the source of each instrumented node, and
+        parents the index of its enclosing instrumented node, or None.
+        
+        The tree is traversed in pre-order without recursion, so that deeply nested 
+        expressions can be instrumented.
+    """
+    root = ast.Expression(body=copy_tree(expression))
+    node_sources = {}
+    analyze_expression(root.body, node_sources) # renders all sub-trees in one pass
+    sources = []
+    parents = []
+    stack = [(root, 'body', None, None)] # (parent, field, index, enclosing instrumented idx)
+    while stack:
+        parent, field, index, enclosing = stack.pop()
+        node = getattr(parent, field) if index is None else getattr(parent, field)[index]
+        if type(node) in INSTRUMENTED_TYPES:
+            idx = len(sources)
+            sources.append(node_sources[id(node)])
+            parents.append(enclosing)
+            if index is None:
+                setattr(parent, field, _wrap_node(node, idx))
+            else:
+                getattr(parent, field)[index] = _wrap_node(node, idx)
+            enclosing = idx
+            
+        children = []
+        for name, value in ast.iter_fields(node):
+            if isinstance(value, list):
+                children.extend([(node, name, item_idx, enclosing) 
+                                 for item_idx, item in enumerate(value) 
+                                 if isinstance(item, ast.AST)])
+            elif isinstance(value, ast.AST):
+                children.append((node, name, None, enclosing))
+        stack.extend(reversed(children))
+    return root.body, sources, parents
+
+
+class ExpressionProfile(object):
+    """ Evaluates an instrumented expression and accumulates the time spent in each function
+        call and binary operation.
+
+        The inclusive time of a node is the time between entering and leaving it; its self
+        time excludes the inclusive time of the instrumented nodes within it. The times
+        include the overhead of the instrumentation, which is roughly a microsecond per node.
+    """
+    def __init__(self, expression):
+        """ Constructor. Instruments and compiles a copy of the expression (an ast.expr node).
+        """
+        instrumented, self.sources, self.parents = _instrument(expression)
+        # Make sure that "from __future__ import division" is at the top of this module
+        self._code = compile(wrap_expression(instrumented), "<profiled>", "eval")
+        self.n_calls = [0] * len(self.sources)
+        self.inclusive_times = [0.0] * len(self.sources)
+
+    def __len__(self):
+        "Number of instrumented nodes"
+        return len(self.sources)
+
+    def clear(self):
+        """ Sets the times and the number of calls to zero.
+        """
+        self.n_calls = [0] * len(self.sources)
+        self.inclusive_times = [0.0] * len(self.sources)
+
+    @property
+    def self_times(self):
+        "The inclusive times minus the inclusive times of the nodes directly within them."
+        result = list(self.inclusive_times)
+        for idx, parent in enumerate(self.parents):
+            if parent is not None:
+                result[parent] -= self.inclusive_times[idx]
+        return result
+
+    def _enter(self, _idx):
+        " Called when a node is entered. Returns the start time. "
+        return default_timer()
+
+    def _exit(self, idx, start_time, value):
+        " Called when a node has been evaluated. Returns its value. "
+        self.inclusive_times[idx] += default_timer() - start_time
+        self.n_calls[idx] += 1
+        return value
+
+    def evaluate(self, global_vars, local_vars):
+        """ Evaluates the instrumented expression. The times are added to the previous times.
+        """
+        profile_vars = dict(global_vars)
+        profile_vars[ENTER_FUNCTION] = self._enter
+        profile_vars[EXIT_FUNCTION] = self._exit
+        return eval(self._code, profile_vars, local_vars)
+
+    def report(self):
+        """ Returns a multiline string with the cost of each node, sorted by decreasing self
+            time.
+        """
+        self_times = self.self_times
+        strings = ["{:>12s} {:>12s} {:>8s}  {}".format('Self', 'Inclusive', 'Calls', 'Source')]
+        for idx in sorted(range(len(self.sources)), key=lambda idx: self_times[idx],
+                          reverse=True):
+            strings.append("{:>9.3f} ms {:>9.3f} ms {:>8d}  {}"
+                           .format(self_times[idx] * 1000, self.inclusive_times[idx] * 1000,
+                                   self.n_calls[idx], self.sources[idx]))
+        return "\n".join(strings)
@@ -0,0 +1,74 @@
+""" Tests for the exprprofile module.
+"""
+
+from __future__ import absolute_import, division
+import unittest
+import numpy as np
+
+from pepcalk.absynt import ast_to_str, get_statement_from_code
+from pepcalk.calculation import Calculation
+from pepcalk.exprprofile import ExpressionProfile
+
+
+class ExpressionProfileCase(unittest.TestCase):
+    """A test class for the sub-expression profiler"""
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+
+    def test_profile(self):
+        
+        expression = get_statement_from_code("x = _np.sqrt(a * 2) + f(a / 4)").value
+        profile = ExpressionProfile(expression)
+        self.assertEqual(profile.sources, 
+                         ['_np.sqrt(a * 2) + f(a / 4)', '_np.sqrt(a * 2)', 'a * 2', 'f(a / 4)', 
+                          'a / 4'])
+        self.assertEqual(profile.parents, [None, 0, 1, 0, 3])
+        
+        global_vars = {'_np': np, 'f': lambda x: x + 1}
+        self.assertEqual(profile.evaluate(global_vars, {'a': 8}), 4 + 3) # True division
+        profile.evaluate(global_vars, {'a': 2})
+        self.assertEqual(profile.n_calls, [2] * 5)
+        
+        self_times = profile.self_times
+        self.assertAlmostEqual(self_times[0] + self_times[1] + self_times[3], 
+                               profile.inclusive_times[0] - profile.inclusive_times[2] - 
+                               profile.inclusive_times[4])
+        self.assertEqual(len(profile.report().splitlines()), 6)
+        self.assertNotIn('_profile_enter', global_vars)
+        
+        # The original expression is not changed
+        self.assertEqual(ast_to_str(expression), profile.sources[0])
+        
+        
+    def test_deep_expression(self):
+        
+        terms = ["x{:d}".format(idx) for idx in range(5000)]
+        profile = ExpressionProfile(get_statement_from_code("a = " + " + ".join(terms)).value)
+        self.assertEqual(len(profile), 4999)
+        self.assertEqual(profile.sources[0], " + ".join(terms))
+        self.assertEqual(profile.sources[-1], "x0 + x1")
+        self.assertEqual(profile.parents[:3], [None, 0, 1])
+        self.assertEqual(profile.evaluate({}, dict((term, 1) for term in terms)), 5000)
+        self.assertEqual(profile.n_calls, [1] * 4999)
+        
+        
+    def test_calculation(self):
+        
+        calc = Calculation("a = _np.arange(100); b = _np.sum(a * a) + 1; c = b")
+        calc.profile_expressions = True
+        calc.compile().execute()
+        self.assertEqual(calc.assignments[1].value, 328351)
+        self.assertEqual(len(calc.assignments[1].expression_profile), 3)
+        self.assertEqual(len(calc.assignments[2].expression_profile), 0)
+        self.assertIn('_np.sum(a * a)', calc.expression_profile_report('b'))
+        self.assertEqual(str(calc.assignments[1]), "b = _np.sum(a * a) + 1")
+        self.assertRaises(ValueError, calc.expression_profile_report, 'd')
+        
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,282 @@
+""" Blocked evaluation of element-wise array expressions.
+
+    NumPy evaluates an expression such as (a * 2 + b) ** 2 - a / b one operation at a time, and
+    allocates a temporary array for each intermediate result. For large arrays this is limited
+    by memory bandwidth. A FusedExpression evaluates the complete expression on one block of
+    elements at a time, storing the intermediate results in small scratch buffers that are
+    reused for every block and that fit in the CPU cache.
+"""
+from __future__ import absolute_import, division
+
+import logging, ast, __builtin__
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BLOCK_SIZE = 2**14
+
+_BINARY_UFUNCS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide, # pepcalk uses "from __future__ import division"
+    ast.FloorDiv: np.floor_divide,
+    ast.Mod: np.remainder,
+    ast.Pow: np.power,
+}
+
+_UNARY_UFUNCS = {
+    ast.USub: np.negative,
+    ast.UAdd: np.positive,
+}
+
+# Functions of the _np module that can be called within a fused expression.
+FUSABLE_FUNCTIONS = frozenset([
+    'abs', 'absolute', 'add', 'arccos', 'arcsin', 'arctan', 'arctan2', 'ceil', 'cos', 'cosh',
+    'divide', 'exp', 'exp2', 'expm1', 'floor', 'fmax', 'fmin', 'hypot', 'log', 'log10',
+    'log1p', 'log2', 'maximum', 'minimum', 'multiply', 'negative', 'power', 'reciprocal',
+    'rint', 'sign', 'sin', 'sinh', 'sqrt', 'square', 'subtract', 'tan', 'tanh', 'true_divide'])
+
+_SCALAR_TYPES = (bool, int, long, float, complex, np.generic)
+
+
+# Only plain arrays are fused. Subclasses such as np.matrix and masked arrays override the
+# operators, so they are left to eval.
+_ARRAY_TYPES = (np.ndarray, np.memmap)
+
+
+def _is_array(value):
+    """ Returns True if the value is a plain array or memory map with at least one dimension.
+    """
+    return type(value) in _ARRAY_TYPES and value.ndim > 0
+
+
+def _node_operation(node):
+    """ Returns (kind, payload, children) tuple for a supported node, or None otherwise.
+
+        kind is 'const' (payload is the value), 'name' (payload is the symbol), 'ufunc'
+        (payload is the ufunc) or 'call' (payload is the function name in the _np module).
+    """
+    node_type = type(node)
+    if node_type == ast.Num:
+        return ('const', node.n, [])
+    elif node_type == ast.Name:
+        return ('name', node.id, [])
+    elif (node_type == ast.BinOp and type(node.op) == ast.Pow and
+          type(node.right) == ast.Num and node.right.n == 2 and
+          isinstance(node.right.n, (int, long))):
+        # NumPy also calculates x ** 2 with the faster square ufunc.
+        return ('ufunc', np.square, [node.left])
+    elif node_type == ast.BinOp and type(node.op) in _BINARY_UFUNCS:
+        return ('ufunc', _BINARY_UFUNCS[type(node.op)], [node.left, node.right])
+    elif node_type == ast.UnaryOp and type(node.op) in _UNARY_UFUNCS:
+        return ('ufunc', _UNARY_UFUNCS[type(node.op)], [node.operand])
+    elif (node_type == ast.Call and not node.keywords and node.starargs is None and
+          node.kwargs is None and isinstance(node.func, ast.Attribute) and
+          isinstance(node.func.value, ast.Name) and node.func.value.id == '_np' and
+          node.func.attr in FUSABLE_FUNCTIONS):
+        return ('call', node.func.attr, node.args)
+    else:
+        return None
+
+
+def fuse_expression(expression, block_size=DEFAULT_BLOCK_SIZE):
+    """ Returns a FusedExpression for the expression.
+
+        Returns None if the expression contains nodes that cannot be fused or if it doesn't
+        contain any operation.
+    """
+    leaves = []       # list of (kind, payload) tuples
+    instructions = [] # list of (kind, payload, operands) tuples
+    value_stack = []  # operands: ('leaf', index) or ('register', index) tuples
+    stack = [(expression, False)]
+    while stack:
+        node, expanded = stack.pop()
+        operation = _node_operation(node)
+        if operation is None:
+            return None
+        kind, payload, children = operation
+        if children and not expanded:
+            stack.append((node, True))
+            stack.extend([(child, False) for child in reversed(children)])
+        elif not children and kind in ('const', 'name'):
+            leaves.append((kind, payload))
+            value_stack.append(('leaf', len(leaves) - 1))
+        else:
+            operands = value_stack[len(value_stack) - len(children):]
+            del value_stack[len(value_stack) - len(children):]
+            instructions.append((kind, payload, operands))
+            value_stack.append(('register', len(instructions) - 1))
+
+    if not instructions:
+        return None
+    return FusedExpression(leaves, instructions, block_size)
+
+
+def is_elementwise(expression):
+    """ Returns True if the expression only consists of names, numbers, arithmetic operators 
+        and calls of the FUSABLE_FUNCTIONS of _np. With array operands each element of the 
+        result then only depends on the corresponding elements of the (broadcast) operands,
+        unlike e.g. a - a.mean().
+    """
+    stack = [expression]
+    while stack:
+        operation = _node_operation(stack.pop())
+        if operation is None:
+            return False
+        stack.extend(operation[2])
+    return True
+
+
+def _lookup(symbol, global_vars, local_vars):
+    """ Returns (found, value) tuple. Looks in the local, global and built-in variables.
+    """
+    for namespace in (local_vars, global_vars):
+        if symbol in namespace:
+            return True, namespace[symbol]
+    if hasattr(__builtin__, symbol):
+        return True, getattr(__builtin__, symbol)
+    return False, None
+
+
+class FusedExpression(object):
+    """ An element-wise expression that is evaluated in blocks. Create with fuse_expression.
+    """
+    def __init__(self, leaves, instructions, block_size):
+        """ Constructor. The instructions are in evaluation order; the last one is the result.
+        """
+        self._leaves = leaves
+        self._instructions = instructions
+        self.block_size = block_size
+
+    def __str__(self):
+        return "<FusedExpression: {:d} leaves, {:d} operations>".format(
+            len(self._leaves), len(self._instructions))
+
+    def _resolve_leaves(self, global_vars, local_vars):
+        """ Returns (values, shape) tuple or None if the expression cannot be fused for these
+            values. All arrays must have the same shape; other values must be scalars.
+        """
+        values = []
+        shape = None
+        for kind, payload in self._leaves:
+            if kind == 'const':
+                values.append(payload)
+                continue
+            found, value = _lookup(payload, global_vars, local_vars)
+            if not found:
+                return None # Let eval raise the NameError
+            if _is_array(value):
+                if value.dtype.hasobject or (shape is not None and value.shape != shape):
+                    return None
+                shape = value.shape
+            elif not isinstance(value, _SCALAR_TYPES):
+                return None
+            values.append(value)
+        return values, shape
+
+    def _resolve_ufuncs(self, global_vars, local_vars):
+        """ Returns the list of ufuncs of the instructions, or None if a called function is
+            not a ufunc with one output.
+        """
+        ufuncs = []
+        for kind, payload, operands in self._instructions:
+            if kind == 'call':
+                _found, module = _lookup('_np', global_vars, local_vars)
+                ufunc = getattr(module, payload, None)
+                if not (isinstance(ufunc, np.ufunc) and ufunc.nin == len(operands) and
+                        ufunc.nout == 1):
+                    return None
+                ufuncs.append(ufunc)
+            else:
+                ufuncs.append(payload)
+        return ufuncs
+
+    def _run(self, ufuncs, leaf_values, outputs=None):
+        """ Executes the instructions. Returns the list with the value of each instruction.
+
+            If outputs is given, the result of instruction i is stored in outputs[i].
+        """
+        results = []
+        for idx, (ufunc, (_kind, _payload, operands)) in enumerate(zip(ufuncs,
+                                                                        self._instructions)):
+            args = [leaf_values[index] if operand_kind == 'leaf' else results[index]
+                    for operand_kind, index in operands]
+            if outputs is None:
+                results.append(ufunc(*args))
+            else:
+                results.append(ufunc(*args, out=outputs[idx]))
+        return results
+
+    def _prepare(self, global_vars, local_vars):
+        """ Returns (leaf_values, shape, ufuncs, dtypes) tuple, where dtypes contains the data
+            type of each instruction. Returns None if the expression cannot be fused for these
+            values, e.g. if there are no arrays with at least block_size elements.
+
+            The data types are determined by applying the ufuncs to empty arrays, so that
+            NumPy's casting rules are followed without reading the contents of the arrays.
+        """
+        resolved = self._resolve_leaves(global_vars, local_vars)
+        if resolved is None or resolved[1] is None:
+            return None
+        leaf_values, shape = resolved
+        if int(np.prod(shape)) < self.block_size:
+            return None
+        ufuncs = self._resolve_ufuncs(global_vars, local_vars)
+        if ufuncs is None:
+            return None
+
+        prototypes = [np.empty(0, dtype=value.dtype) if _is_array(value) else value
+                      for value in leaf_values]
+        with np.errstate(all='ignore'):
+            dtypes = [result.dtype for result in self._run(ufuncs, prototypes)]
+        return leaf_values, shape, ufuncs, dtypes
+
+    def infer_type(self, global_vars, local_vars):
+        """ Returns the (shape, dtype) tuple of the result, or None if the expression cannot be
+            fused for these values. Only the shapes and dtypes of the arrays are used.
+        """
+        try:
+            prepared = self._prepare(global_vars, local_vars)
+        except StandardError, ex:
+            logger.debug("Unable to infer type of {}: {}".format(self, ex))
+            return None
+        return None if prepared is None else (prepared[1], prepared[3][-1])
+
+    def evaluate(self, global_vars, local_vars, out=None):
+        """ Evaluates the expression. Returns NotImplemented if the expression cannot be fused
+            for these values, e.g. if there are no arrays with at least block_size elements.
+
+            :param out: optional array in which the result is stored. It is only used if it
+                is a writable, C-contiguous array with the shape and dtype of the result that
+                doesn't share memory with the operands. Otherwise a new array is allocated.
+        """
+        prepared = self._prepare(global_vars, local_vars)
+        if prepared is None:
+            return NotImplemented
+        leaf_values, shape, ufuncs, dtypes = prepared
+
+        is_array = [_is_array(value) for value in leaf_values]
+        if (out is not None and out.shape == shape and out.dtype == dtypes[-1] and
+                out.flags.c_contiguous and out.flags.writeable and
+                not any(np.may_share_memory(out, value)
+                        for value, array in zip(leaf_values, is_array) if array)):
+            result = out.reshape(-1)
+        else:
+            out = None
+            result = np.empty(int(np.prod(shape)), dtype=dtypes[-1])
+
+        n_elements = len(result)
+        leaf_values = [value.reshape(-1) if array else value
+                       for value, array in zip(leaf_values, is_array)]
+        scratch_buffers = [np.empty(self.block_size, dtype=dtype) for dtype in dtypes[:-1]]
+
+        for start in xrange(0, n_elements, self.block_size):
+            stop = min(start + self.block_size, n_elements)
+            block_values = [value[start:stop] if array else value
+                            for value, array in zip(leaf_values, is_array)]
+            outputs = [scratch[:stop - start] for scratch in scratch_buffers]
+            outputs.append(result[start:stop])
+            self._run(ufuncs, block_values, outputs)
+        return result.reshape(shape) if out is None else out
@@ -0,0 +1,127 @@
+""" Tests for the fused module.
+"""
+
+from __future__ import absolute_import, division
+import unittest
+import numpy as np
+
+from pepcalk.absynt import get_statement_from_code
+from pepcalk.calculation import Calculation
+from pepcalk.fused import fuse_expression
+
+
+def fuse(code_line, block_size=7):
+    return fuse_expression(get_statement_from_code(code_line).value, block_size=block_size)
+
+
+class FusedCase(unittest.TestCase):
+    """A test class for blocked evaluation"""
+
+    def setUp(self):
+        self.global_vars = {'_np': np}
+        self.local_vars = {'a': np.arange(1, 101, dtype=np.float64),
+                           'b': np.linspace(-3, 3, 100).reshape(10, 10).ravel(),
+                           'i': np.arange(100),
+                           'k': 3}
+
+    def tearDown(self):
+        pass
+
+
+    def test_unsupported(self):
+
+        self.assertIsNone(fuse("x = a"))
+        self.assertIsNone(fuse("x = 5"))
+        self.assertIsNone(fuse("x = a[0] + 1"))
+        self.assertIsNone(fuse("x = _np.sum(a) + 1"))
+        self.assertIsNone(fuse("x = _np.sqrt(a, out=b)"))
+        self.assertIsNone(fuse("x = len(a) + 1"))
+        self.assertIsNotNone(fuse("x = -_np.sqrt(a) + 1"))
+
+
+    def test_evaluate(self):
+
+        for code_line in ["x = (a * 2 + b) ** 2 - a / b",
+                          "x = -_np.sqrt(a) + _np.maximum(b, 0.5) * k",
+                          "x = i / k + i // k - i % 4",
+                          "x = i * k + 1 + i ** 2 + i ** 2.0",
+                          "x = _np.arctan2(b, a) + _np.abs(b)"]:
+            expected = eval(code_line.split('=', 1)[1], self.global_vars, self.local_vars)
+            actual = fuse(code_line).evaluate(self.global_vars, self.local_vars)
+            self.assertEqual(actual.dtype, expected.dtype, code_line)
+            np.testing.assert_array_equal(actual, expected, code_line)
+
+
+    def test_infer_type(self):
+
+        self.assertEqual(fuse("x = i / k").infer_type(self.global_vars, self.local_vars),
+                         ((100, ), np.dtype(np.float64)))
+        self.assertEqual(fuse("x = i * k").infer_type(self.global_vars, self.local_vars),
+                         ((100, ), self.local_vars['i'].dtype))
+        self.assertIsNone(fuse("x = i * c").infer_type(self.global_vars, self.local_vars))
+
+        out = np.empty(100)
+        fused = fuse("x = a * 2 + b")
+        self.assertIs(fused.evaluate(self.global_vars, self.local_vars, out=out), out)
+        np.testing.assert_array_equal(out, self.local_vars['a'] * 2 + self.local_vars['b'])
+        self.assertIsNot(fused.evaluate(self.global_vars, self.local_vars,
+                                        out=self.local_vars['a']), self.local_vars['a'])
+
+
+    def test_not_fusable_values(self):
+
+        fused = fuse("x = a + c")
+        self.assertIs(fused.evaluate(self.global_vars, self.local_vars), NotImplemented)
+        self.local_vars['c'] = np.arange(3)
+        self.assertIs(fused.evaluate(self.global_vars, self.local_vars), NotImplemented)
+        self.local_vars['c'] = [1] * 100
+        self.assertIs(fused.evaluate(self.global_vars, self.local_vars), NotImplemented)
+        self.local_vars['c'] = 2
+        self.assertEqual(fused.evaluate(self.global_vars, self.local_vars).shape, (100, ))
+
+        fused = fuse("x = a + 1", block_size=1000)  # Arrays smaller than a block
+        self.assertIs(fused.evaluate(self.global_vars, self.local_vars), NotImplemented)
+
+        # Array subclasses are left to eval
+        fused = fuse("x = a * b")
+        self.local_vars['a'] = np.matrix(np.arange(100.0).reshape(10, 10))
+        self.local_vars['b'] = np.matrix(np.ones((10, 10)))
+        self.assertIs(fused.evaluate(self.global_vars, self.local_vars), NotImplemented)
+        self.local_vars['a'] = np.ma.masked_less(np.arange(100.0), 50)
+        self.local_vars['b'] = 2
+        self.assertIs(fused.evaluate(self.global_vars, self.local_vars), NotImplemented)
+
+
+    def test_calculation(self):
+
+        calc = Calculation("b = a * 2 + 1\nc = _np.sqrt(b) - b / 3\nd = _np.sum(c)")
+        calc.fused_block_size = 16
+        calc.execution_local_vars['a'] = np.arange(1000).reshape(10, 100)
+        calc.compile().execute()
+        a = np.arange(1000).reshape(10, 100)
+        expected = np.sqrt(a * 2 + 1) - (a * 2 + 1) / 3
+        np.testing.assert_allclose(calc.assignments[1].value, expected)
+        self.assertAlmostEqual(calc.assignments[2].value, expected.sum())
+
+        calc.replace_assignment(1, "c = b * b")
+        np.testing.assert_array_equal(calc.assignments[1].value, (a * 2 + 1) ** 2)
+
+
+    def test_array_subclasses(self):
+
+        a = np.matrix(np.arange(128 * 128.0).reshape(128, 128))
+        calc = Calculation("c = a * b")
+        calc.fused_block_size = 2**14
+        calc.execution_local_vars.update(a=a, b=np.matrix(np.eye(128)))
+        np.testing.assert_array_equal(calc.compile().execute()['c'], a * np.eye(128))
+
+        calc = Calculation("c = a + 1")
+        calc.fused_block_size = 16
+        calc.execution_local_vars['a'] = np.ma.masked_less(np.arange(100.0), 50)
+        c = calc.compile().execute()['c']
+        self.assertTrue(isinstance(c, np.ma.MaskedArray))
+        self.assertEqual(c.count(), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
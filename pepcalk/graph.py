@@ -1,4 +1,5 @@
-import logging
+import logging, heapq
+from collections import OrderedDict
 from pepcalk.utils import check_class
 
 class CircularDependencyError(ValueError):
@@ -13,13 +14,20 @@ logger = logging.getLogger(__name__)
 
 class Node(object):
     """ Node 
+    
+        Keeps the set of nodes it connects to (its edges) as well as the set of nodes that 
+        connect to it (its dependents) so that it can be disconnected cheaply.
     """
     
     def __init__(self, ident, edges = None):
         """ 
         """
         self._id = ident
-        self._edges = edges if edges is not None else set([])
+        self._edges = set([])
+        self._dependents = set([])
+        if edges is not None:
+            for other in edges:
+                self.connect(other)
 
     @property
     def id(self):
@@ -28,9 +36,14 @@ class Node(object):
     
     @property
     def edges(self):
-        "Returns the list of edges"
+        "Returns the set of nodes that this node connects to"
         return self._edges
     
+    @property
+    def dependents(self):
+        "Returns the set of nodes that connect to this node"
+        return self._dependents
+    
     def __str__(self):
         return "<Node: {} ({:d} edges)>".format(self.id, len(self._edges))
         
@@ -43,19 +56,37 @@ class Node(object):
         """
         check_class(other, Node)
         self._edges.add(other)
+        other._dependents.add(self)
         
         
-       
+    def disconnect(self, other):
+        """ Removes the connection from self to other. Raises a KeyError if it doesn't exist.
+        """
+        check_class(other, Node)
+        self._edges.remove(other)
+        other._dependents.remove(self)
+        
+        
+    def disconnect_all(self):
+        """ Removes all connections from and to this node.
+        """
+        for other in self._edges:
+            other._dependents.remove(self)
+        for other in self._dependents:
+            other._edges.remove(self)
+        self._edges.clear()
+        self._dependents.clear()
+        
                 
 class Graph(object):
     """ A directed graph.
     
-        Contains an id->Node dictionary.
+        Contains an id->Node dictionary that remembers the order in which nodes were added.
     """
     def __init__(self, nodes = None):
         """ Constructor
         """
-        self._nodes = dict()
+        self._nodes = OrderedDict()
         if nodes is not None:
             for node in nodes:
                 self.add(node)
@@ -83,19 +114,37 @@ class Graph(object):
         return self.nodes[ident]
 
     
-    # TODO: implement remove? This is expensive because all edges that contain
-    # the node must be removed.
     def add(self, node):
         """ Adds a Node to the graph. 
         """
         check_class(node, Node)
         if node.id in self._nodes:
-            raise KeyError("Node with id {!r} already exists in graph.")
+            raise KeyError("Node with id {!r} already exists in graph.".format(node.id))
         
         self._nodes[node.id] = node
         return node
 
     
+    def get_or_add(self, ident):
+        """ Returns the node having the identifier ident. Adds a new node if it doesn't exist.
+        """
+        if ident in self._nodes:
+            return self._nodes[ident]
+        else:
+            return self.add(Node(ident))
+        
+    
+    def remove(self, ident):
+        """ Removes the node having the identifier ident, together with all its connections.
+            
+            Takes time proportional to the number of connections of the node.
+            Returns the removed node.
+        """
+        node = self._nodes.pop(ident)
+        node.disconnect_all()
+        return node
+    
+    
     def connect(self, source_id, target_id):
         """ Makes a connection from the source node to the target node
         """
@@ -103,49 +152,118 @@ class Graph(object):
         target = self._nodes[target_id]
         source.connect(target)
         
+    
+    def disconnect(self, source_id, target_id):
+        """ Removes the connection from the source node to the target node
+        """
+        source = self._nodes[source_id]
+        target = self._nodes[target_id]
+        source.disconnect(target)
+        
+        
+    def replace_edges(self, source_id, target_ids):
+        """ Replaces the connections of the source node with connections to the target nodes.
+            Target nodes that don't exist yet are added to the graph.
+            
+            Returns the set of nodes that the source node no longer connects to.
+        """
+        source = self._nodes[source_id]
+        new_targets = set([self.get_or_add(target_id) for target_id in target_ids])
+        old_targets = source.edges - new_targets
+        for target in old_targets:
+            source.disconnect(target)
+        for target in new_targets - source.edges:
+            source.connect(target)
+        return old_targets
+        
+       
+    def _init_topological_sort(self):
+        """ Returns (index, n_deps, ready) tuple for a topological sort with Kahn's algorithm.
+        
+            index maps each node to its position in the graph. n_deps maps each node to its 
+            number of edges. ready is the list of (index, node) tuples of nodes without edges.
+        """
+        index = {}
+        n_deps = {}
+        ready = []
+        for idx, node in enumerate(self._nodes.itervalues()):
+            index[node] = idx
+            n_edges = n_deps[node] = len(node._edges)
+            if n_edges == 0:
+                ready.append((idx, node))
+        return index, n_deps, ready
+    
+    
+    def _raise_circular_dependency(self, n_deps):
+        """ Raises a CircularDependencyError for a node that is part of a cycle.
+        
+            n_deps should map the nodes that could not be sorted to a positive number. 
+            Each of these nodes connects to at least one other node that could not be sorted.
+        """
+        node = next(node for node in self._nodes.itervalues() if n_deps[node] > 0)
+        visited = set()
+        while node not in visited:
+            visited.add(node)
+            node = min((dep_node for dep_node in node.edges if n_deps[dep_node] > 0), 
+                       key=lambda dep_node: dep_node.id)
+            
+        raise CircularDependencyError("Circular dependency for: {}".format(node.id), node.id)
+    
        
     def linearize(self):
-        """ Executes a topological sort of the graph using a depth first search (as described by Corman)
+        """ Executes a topological sort of the graph using Kahn's algorithm.
         
             Returns a list where for all combination of nodes A & B the following invariant holds:
                 if A has a vertex to B, B will occur in the list before A
                 
+            The result is deterministic: if more than one node can be added next, the node that 
+            was added to the graph first is chosen. The sort is not recursive so it can handle 
+            long chains of dependencies.
+                
             For more info see: 
                 http://en.wikipedia.org/w/index.php?title=Topological_sorting&oldid=559164289
         """
+        index, n_deps, ready = self._init_topological_sort() # ready is sorted, so a valid heap
         result = []
-        unmarked_nodes = set(self._nodes.itervalues())
-        temp_marked_nodes = set()
-        perm_marked_nodes = set()
-
-        def visit(node):
-            """ Visits nodes recursively and adds them to the result.
-                Marks nodes to prevent duplicates.
-            """
-            if node in temp_marked_nodes:
-                raise CircularDependencyError("Circular dependency for: {}".format(node.id), 
-                                              node.id)
-            
-            if node not in perm_marked_nodes: 
-                
-                # Node is unmarked (so has not been visited yet)
-                unmarked_nodes.remove(node)
-                temp_marked_nodes.add(node)
-                for dep_node in node.edges:
-                    visit(dep_node)
+        heappop, heappush = heapq.heappop, heapq.heappush # local names for speed
+        while ready:
+            _idx, node = heappop(ready)
+            result.append(node)
+            for dependent in node._dependents:
+                n_deps[dependent] -= 1
+                if n_deps[dependent] == 0:
+                    heappush(ready, (index[dependent], dependent))
                     
-                temp_marked_nodes.remove(node)
-                perm_marked_nodes.add(node)
-                result.append(node) 
-            # end of visit() function
-            
-        while len(unmarked_nodes) > 0:
-            # Select a random node without removing it
-            node = unmarked_nodes.pop()
-            unmarked_nodes.add(node)
-            visit(node)
-            
+        if len(result) < len(self._nodes):
+            self._raise_circular_dependency(n_deps)
         return result
     
     
-        
\ No newline at end of file
+    def levels(self):
+        """ Returns the nodes grouped in a list of levels. 
+        
+            The first level contains the nodes without edges. Each next level contains the 
+            nodes whose edges all point to nodes in previous levels. Therefore the nodes within
+            one level are mutually independent. Within a level the nodes are ordered in the 
+            order in which they were added to the graph.
+        """
+        index, n_deps, ready = self._init_topological_sort()
+        result = []
+        n_sorted = 0
+        level = [node for _idx, node in ready]
+        while level:
+            result.append(level)
+            n_sorted += len(level)
+            next_level = []
+            for node in level:
+                for dependent in node._dependents:
+                    n_deps[dependent] -= 1
+                    if n_deps[dependent] == 0:
+                        next_level.append((index[dependent], dependent))
+            next_level.sort()
+            level = [node for _idx, node in next_level]
+            
+        if n_sorted < len(self._nodes):
+            self._raise_circular_dependency(n_deps)
+        return result
+    
@@ -0,0 +1,107 @@
+""" Tests for the graph module.
+"""
+
+from __future__ import absolute_import
+import unittest
+
+from pepcalk.graph import Node, Graph, CircularDependencyError
+
+
+class GraphCase(unittest.TestCase):
+    """A test class for the Graph and Node classes"""
+
+    def setUp(self):
+        self.graph = Graph([Node(ident) for ident in ['a', 'b', 'c', 'd']])
+        self.graph.connect('a', 'b')
+        self.graph.connect('a', 'c')
+        self.graph.connect('b', 'c')
+        self.graph.connect('d', 'c')
+
+    def tearDown(self):
+        pass
+
+
+    def test_dependents(self):
+        
+        graph = self.graph
+        self.assertEqual(graph.get('c').dependents, 
+                         set([graph.get('a'), graph.get('b'), graph.get('d')]))
+        self.assertEqual(graph.get('a').dependents, set())
+        
+        node = Node('e', edges=[graph.get('a')])
+        self.assertEqual(graph.get('a').dependents, set([node]))
+        
+        
+    def test_disconnect(self):
+        
+        graph = self.graph
+        graph.disconnect('a', 'c')
+        self.assertEqual(graph.get('a').edges, set([graph.get('b')]))
+        self.assertEqual(graph.get('c').dependents, set([graph.get('b'), graph.get('d')]))
+        self.assertRaises(KeyError, graph.disconnect, 'a', 'c')
+        
+        
+    def test_remove(self):
+        
+        graph = self.graph
+        node_c = graph.remove('c')
+        self.assertFalse(graph.contains('c'))
+        self.assertEqual(node_c.edges, set())
+        self.assertEqual(node_c.dependents, set())
+        self.assertEqual(graph.get('a').edges, set([graph.get('b')]))
+        self.assertEqual(graph.get('d').edges, set())
+        self.assertRaises(KeyError, graph.remove, 'c')
+        
+        
+    def test_replace_edges(self):
+        
+        graph = self.graph
+        removed = graph.replace_edges('a', ['c', 'e'])
+        self.assertEqual(removed, set([graph.get('b')]))
+        self.assertEqual(graph.get('a').edges, set([graph.get('c'), graph.get('e')]))
+        self.assertEqual(graph.get('b').dependents, set())
+        self.assertEqual(graph.get('e').dependents, set([graph.get('a')]))
+        
+        
+    def test_linearize(self):
+        
+        graph = self.graph
+        self.assertEqual([node.id for node in graph.linearize()], ['c', 'b', 'a', 'd'])
+        
+        # Long chains don't exceed the recursion limit
+        n_nodes = 20000
+        graph = Graph([Node(idx) for idx in range(n_nodes)])
+        for idx in range(1, n_nodes):
+            graph.connect(idx - 1, idx)
+        self.assertEqual([node.id for node in graph.linearize()], range(n_nodes - 1, -1, -1))
+        
+        
+    def test_levels(self):
+        
+        levels = self.graph.levels()
+        self.assertEqual([[node.id for node in level] for level in levels], 
+                         [['c'], ['b', 'd'], ['a']])
+        self.assertEqual(Graph().levels(), [])
+        
+        
+    def test_circular_dependency(self):
+        
+        graph = self.graph
+        graph.add(Node('e'))
+        graph.connect('c', 'e')
+        graph.connect('e', 'a')
+        for sort_function in (graph.linearize, graph.levels):
+            try:
+                sort_function()
+            except CircularDependencyError, ex:
+                self.assertTrue(ex.node_id in ['a', 'c', 'e'])
+            else:
+                self.fail("CircularDependencyError not raised")
+                
+        graph = Graph([Node('a')])
+        graph.connect('a', 'a')
+        self.assertRaises(CircularDependencyError, graph.linearize)
+        
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+""" Liveness analysis: freeing intermediate values as soon as they are no longer needed, and
+    spilling values to disk that are not needed soon.
+"""
+from __future__ import absolute_import, division
+
+import logging
+from bisect import bisect_right
+
+from pepcalk.spill import DEFAULT_MIN_SPILL_BYTES, SpillStore, is_spillable
+from pepcalk.utils import value_nbytes
+
+logger = logging.getLogger(__name__)
+
+
+def use_indices(assignments):
+    """ Returns a dictionary that maps symbols to the ascending list of indices of the
+        assignments that use them. Symbols that are not used are not included.
+
+        :param assignments: assignments in execution order.
+    """
+    result = {}
+    for idx, assignment in enumerate(assignments):
+        for symbol in set(assignment.symbols):
+            result.setdefault(symbol, []).append(idx)
+    return result
+
+
+def last_uses(assignments):
+    """ Returns a dictionary that maps symbols to the index of the last assignment that uses
+        them. Symbols that are not used by any of the assignments are not included.
+
+        :param assignments: assignments in execution order.
+    """
+    return dict((symbol, indices[-1])
+                for symbol, indices in use_indices(assignments).iteritems())
+
+
+def _next_use(indices, idx, never):
+    """ Returns the first index in the sorted indices that is larger than idx, or never.
+    """
+    pos = bisect_right(indices, idx)
+    return indices[pos] if pos < len(indices) else never
+
+
+class MemoryReport(object):
+    """ The memory usage of an execution.
+
+        The sizes of the values are determined with value_nbytes, so a value that is a view
+        of another array is counted as if it has its own data. The input values and the
+        memory maps of spilled values are not included.
+    """
+    def __init__(self):
+        """ Constructor
+        """
+        self.peak_bytes = 0                 # Peak size of the values that are kept in memory.
+        self.peak_bytes_without_freeing = 0 # Peak size if no value would have been freed.
+        self.n_freed = 0
+        self.freed_bytes = 0
+        self.n_spilled = 0
+        self.spilled_bytes = 0
+        self.n_reloaded = 0
+        self.reloaded_bytes = 0
+
+    def __str__(self):
+        return ("<MemoryReport: peak {:d} bytes ({:d} bytes without freeing), "
+                "{:d} values freed ({:d} bytes), {:d} spilled ({:d} bytes), "
+                "{:d} reloaded ({:d} bytes)>"
+                .format(self.peak_bytes, self.peak_bytes_without_freeing,
+                        self.n_freed, self.freed_bytes, self.n_spilled, self.spilled_bytes,
+                        self.n_reloaded, self.reloaded_bytes))
+
+
+def execute_freeing(assignments, global_vars, local_vars, outputs, memory_budget=None,
+                    min_spill_bytes=DEFAULT_MIN_SPILL_BYTES, spill_directory=None):
+    """ Executes the assignments and stores the results in local_vars. The value of an
+        assignment is removed from local_vars, and from the assignment, directly after the
+        last assignment that uses it has been executed, unless its target is in outputs.
+        Values that are not used at all are removed directly after they are calculated.
+
+        If memory_budget is set and the values in memory are larger than memory_budget bytes
+        after an assignment has been executed, arrays of at least min_spill_bytes are spilled
+        to temporary .npy files, starting with the ones that are needed last. A spilled
+        value is memory-mapped again when an assignment uses it. The budget can be exceeded
+        during the execution of an assignment, or if there are no arrays left to spill.
+        Spilled outputs are returned as read-only memory maps.
+
+        :param assignments: compiled assignments in execution order.
+        :param outputs: the symbols whose values are kept.
+        :param spill_directory: directory in which the temporary files are created.
+        Returns a MemoryReport.
+    """
+    outputs = set(outputs)
+    assignment_by_target = dict((assignment.target, assignment) for assignment in assignments)
+    uses = use_indices(assignments)
+    freed_after = {} # index -> assignments whose values can be freed after that index
+    for idx, assignment in enumerate(assignments):
+        if assignment.target not in outputs:
+            last_idx = max([idx] + uses.get(assignment.target, []))
+            freed_after.setdefault(last_idx, []).append(assignment)
+
+    report = MemoryReport()
+    live_bytes = 0
+    total_bytes = 0
+    value_sizes = {} # target -> nbytes of the values in memory
+    spilled = {}     # target -> (file name, nbytes) of the values on disk
+    spill_store = None
+    try:
+        for idx, assignment in enumerate(assignments):
+            for symbol in set(assignment.symbols):
+                if symbol in spilled and symbol not in local_vars:
+                    local_vars[symbol] = spill_store.load(spilled[symbol][0])
+                    report.n_reloaded += 1
+                    report.reloaded_bytes += spilled[symbol][1]
+
+            local_vars[assignment.target] = assignment.execute(global_vars, local_vars)
+            nbytes = value_nbytes(assignment.value)
+            value_sizes[assignment.target] = nbytes
+            live_bytes += nbytes
+            total_bytes += nbytes
+            report.peak_bytes = max(report.peak_bytes, live_bytes)
+            report.peak_bytes_without_freeing = max(report.peak_bytes_without_freeing,
+                                                    total_bytes)
+
+            for dead_assignment in freed_after.get(idx, []):
+                nbytes = value_sizes.pop(dead_assignment.target, 0)
+                live_bytes -= nbytes
+                spilled.pop(dead_assignment.target, None)
+                report.n_freed += 1
+                report.freed_bytes += nbytes
+                local_vars.pop(dead_assignment.target, None)
+                dead_assignment.clear_result()
+
+            while memory_budget is not None and live_bytes > memory_budget:
+                candidates = [target for target in value_sizes
+                              if is_spillable(local_vars[target], min_spill_bytes)]
+                if not candidates:
+                    break
+                target = max(candidates, key=lambda target: (
+                    _next_use(uses.get(target, []), idx, len(assignments)), value_sizes[target]))
+                if spill_store is None:
+                    spill_store = SpillStore(spill_directory)
+                nbytes = value_sizes.pop(target)
+                spilled[target] = (spill_store.spill(local_vars.pop(target)), nbytes)
+                assignment_by_target[target].clear_result()
+                live_bytes -= nbytes
+                report.n_spilled += 1
+                report.spilled_bytes += nbytes
+                logger.debug("Spilled {!r} ({:d} bytes)".format(target, nbytes))
+
+        for assignment in assignments:
+            if assignment.target in spilled:
+                if assignment.target not in local_vars:
+                    local_vars[assignment.target] = \
+                        spill_store.load(spilled[assignment.target][0])
+                assignment.set_result(local_vars[assignment.target], None)
+    finally:
+        if spill_store is not None:
+            spill_store.close()
+
+    logger.debug("Executed with freeing: {}".format(report))
+    return report
@@ -0,0 +1,81 @@
+""" Tests for the liveness module.
+"""
+
+from __future__ import absolute_import
+import unittest
+import numpy as np
+
+from pepcalk.calculation import Calculation, Assignment
+from pepcalk.liveness import last_uses
+
+
+class LivenessCase(unittest.TestCase):
+    """A test class for freeing intermediate values"""
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+
+    def test_last_uses(self):
+        
+        assignments = [Assignment("b = a + 1"), Assignment("c = b * a"), Assignment("d = c")]
+        self.assertEqual(last_uses(assignments), {'a': 1, 'b': 1, 'c': 2})
+        
+        
+    def test_execute_freeing(self):
+        
+        calc = Calculation("a = _np.ones(1000); b = a * 2; c = b + 1; u = a * 3; d = c.sum()")
+        calc.compile()
+        result = calc.execute(targets=['c', 'd'], free_intermediates=True)
+        self.assertEqual(sorted(result.keys()), ['c', 'd'])
+        self.assertEqual(result['d'], 3000)
+        self.assertEqual(calc.assignments[1].value, None)
+        
+        # u is not needed and therefore not executed
+        report = calc.memory_report
+        self.assertEqual(report.n_freed, 2)
+        self.assertEqual(report.freed_bytes, 16000)
+        self.assertEqual(report.peak_bytes, 16000) # a is freed after b is calculated
+        self.assertEqual(report.peak_bytes_without_freeing, 24008)
+        
+        # Without targets all values are kept.
+        result = calc.execute(free_intermediates=True)
+        self.assertEqual(calc.memory_report.n_freed, 0)
+        self.assertEqual(len(result), 5)
+        
+        result = calc.execute()
+        self.assertIsNone(calc.memory_report)
+        self.assertRaises(ValueError, calc.execute, free_intermediates=True, n_threads=2)
+        
+    def test_memory_budget(self):
+        
+        mb = 2**20 # Arrays of 2**17 floats are 1 MB, the default minimum size of spilled arrays.
+        code = "a = _np.arange(2.0**17); b = a + 1; c = a * 2; d = b * 3; e = c + d"
+        calc = Calculation(code)
+        calc.compile()
+        expected = calc.execute()['e']
+        
+        result = calc.execute(targets=['b', 'e'], memory_budget=2.5 * mb)
+        np.testing.assert_array_equal(result['e'], expected)
+        np.testing.assert_array_equal(result['b'], np.arange(2.0**17) + 1)
+        report = calc.memory_report
+        self.assertTrue(report.n_spilled > 0)
+        self.assertEqual(report.spilled_bytes, report.n_spilled * mb)
+        self.assertEqual(report.reloaded_bytes, report.n_reloaded * mb)
+        self.assertTrue(report.peak_bytes <= 3.5 * mb)
+        
+        # b is an output that is not needed until the end, so it is spilled first.
+        self.assertIsInstance(result['b'], np.memmap)
+        self.assertIsInstance(calc.assignments[1].value, np.memmap)
+        
+        # Small arrays are not spilled
+        calc = Calculation(code.replace('2.0**17', '1000.0'))
+        calc.compile().execute(targets=['e'], memory_budget=0)
+        self.assertEqual(calc.memory_report.n_spilled, 0)
+        
+
+if __name__ == '__main__':
+    unittest.main()
@@ -89,6 +89,8 @@ class MainWindow(QtGui.QMainWindow):
         self.col_settings[CalcTableModel.COL_SOURCE] = ColumnSettings(visible=True)
         self.col_settings[CalcTableModel.COL_VALUE]  = ColumnSettings(visible=True, width=300)
         self.col_settings[CalcTableModel.COL_TYPE]   = ColumnSettings(visible=True)
+        self.col_settings[CalcTableModel.COL_TIME]   = ColumnSettings(visible=False, width=100)
+        self.col_settings[CalcTableModel.COL_SIZE]   = ColumnSettings(visible=False, width=100)
         for idx, header in enumerate(CalcTableModel.HEADERS):
             self.col_settings[idx].name = header
             
@@ -0,0 +1,312 @@
+""" Counters and latency histograms of compilations and executions.
+
+    Metrics are only collected after enable_metrics() has been called. They can be read with
+    MetricsRegistry.snapshot() or in the Prometheus text exposition format, for instance via
+    the HTTP server of start_http_server().
+"""
+from __future__ import absolute_import, division
+
+import logging, threading, BaseHTTPServer
+from bisect import bisect_left
+from collections import OrderedDict
+
+from pepcalk.compilecache import COMPILE_CACHE
+from pepcalk.utils import class_name
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets in seconds.
+DEFAULT_LATENCY_BUCKETS = (1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 0.1, 1.0, 10.0)
+
+COMPILES = 'pepcalk_compiles_total'
+COMPILE_SECONDS = 'pepcalk_compile_seconds'
+EXECUTIONS = 'pepcalk_executions_total'
+EXECUTION_SECONDS = 'pepcalk_execution_seconds'
+ASSIGNMENT_SECONDS = 'pepcalk_assignment_seconds'
+ASSIGNMENT_ERRORS = 'pepcalk_assignment_errors_total'
+VALUE_CACHE_HITS = 'pepcalk_value_cache_hits_total'
+VALUE_CACHE_MISSES = 'pepcalk_value_cache_misses_total'
+
+DESCRIPTIONS = {
+    COMPILES: "Number of compiled calculations.",
+    COMPILE_SECONDS: "Duration of the compilation of a calculation.",
+    EXECUTIONS: "Number of executed calculations.",
+    EXECUTION_SECONDS: "Duration of the execution of a calculation.",
+    ASSIGNMENT_SECONDS: "Duration of the execution of an assignment.",
+    ASSIGNMENT_ERRORS: "Number of errors stored in assignments, by exception class.",
+    VALUE_CACHE_HITS: "Number of values found in a value cache.",
+    VALUE_CACHE_MISSES: "Number of values not found in a value cache.",
+}
+
+
+def _label_key(labels):
+    """ Returns a hashable key for a dictionary of labels.
+    """
+    return tuple(sorted(labels.iteritems()))
+
+
+def _format_labels(items):
+    """ Returns (name, value) items in the exposition format, e.g. {error="ValueError"}
+    """
+    if not items:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                                            .replace('"', '\\"'))
+                          for name, value in items) + "}"
+
+
+class Counter(object):
+    """ A value that only increases, optionally for different combinations of labels.
+    """
+    metric_type = 'counter'
+
+    def __init__(self, name, description):
+        """ Constructor
+        """
+        self.name = name
+        self.description = description
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """ Increases the counter of the labels by amount.
+        """
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        """ Returns a list of (labels, value) tuples, where labels is a dictionary.
+        """
+        with self._lock:
+            return [(dict(key), value) for key, value in sorted(self._values.iteritems())]
+
+    def exposition_lines(self):
+        """ Returns the values in the text exposition format.
+        """
+        return ["{}{} {}".format(self.name, _format_labels(sorted(labels.iteritems())), value)
+                for labels, value in self.snapshot()]
+
+
+class FunctionCounter(Counter):
+    """ A counter whose value is determined by calling a function, e.g. to read the counter
+        of an existing object.
+    """
+    def __init__(self, name, description, function):
+        """ Constructor
+        """
+        super(FunctionCounter, self).__init__(name, description)
+        self._function = function
+
+    def inc(self, amount=1, **labels):
+        raise TypeError("The value of {} cannot be increased.".format(self.name))
+
+    def snapshot(self):
+        return [({}, self._function())]
+
+
+class Histogram(object):
+    """ Counts the observed values per bucket, e.g. to determine latency percentiles.
+    """
+    metric_type = 'histogram'
+
+    def __init__(self, name, description, buckets=DEFAULT_LATENCY_BUCKETS):
+        """ Constructor.
+
+            :param buckets: the ascending upper bounds of the buckets. A bucket for values
+                above the last bound is added.
+        """
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """ Adds a value.
+        """
+        idx = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[idx] += 1
+            self._sum += value
+
+    def snapshot(self):
+        """ Returns a dictionary with the cumulative counts per upper bound, the number of
+            values and their sum.
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = []
+        n_values = 0
+        for bound, count in zip(self.buckets + (float('inf'), ), counts):
+            n_values += count
+            cumulative.append((bound, n_values))
+        return {'buckets': cumulative, 'count': n_values, 'sum': total}
+
+    def exposition_lines(self):
+        """ Returns the values in the text exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = ['{}_bucket{{le="{}"}} {}'.format(self.name, '+Inf' if bound == float('inf')
+                                                   else repr(bound), count)
+                 for bound, count in snapshot['buckets']]
+        lines.append("{}_sum {!r}".format(self.name, snapshot['sum']))
+        lines.append("{}_count {}".format(self.name, snapshot['count']))
+        return lines
+
+
+class MetricsRegistry(object):
+    """ A collection of metrics by name.
+    """
+    def __init__(self):
+        """ Constructor
+        """
+        self._metrics = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        "Number of metrics"
+        return len(self._metrics)
+
+    def _get_or_add(self, name, metric_class, *args):
+        """ Returns the metric with the name. Creates it if it doesn't exist.
+        """
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = metric_class(name, DESCRIPTIONS.get(name, ""), *args)
+                    self._metrics[name] = metric
+        if not isinstance(metric, metric_class):
+            raise TypeError("Metric {} is a {}, not a {}"
+                            .format(name, class_name(metric), metric_class.__name__))
+        return metric
+
+    def counter(self, name):
+        """ Returns the counter with the name. Creates it if it doesn't exist.
+        """
+        return self._get_or_add(name, Counter)
+
+    def histogram(self, name, buckets=DEFAULT_LATENCY_BUCKETS):
+        """ Returns the histogram with the name. Creates it if it doesn't exist.
+        """
+        return self._get_or_add(name, Histogram, buckets)
+
+    def add_function_counter(self, name, description, function):
+        """ Adds a counter whose value is determined by calling function.
+        """
+        with self._lock:
+            self._metrics[name] = FunctionCounter(name, description, function)
+
+    def clear(self):
+        """ Removes all metrics.
+        """
+        with self._lock:
+            self._metrics.clear()
+
+    def snapshot(self):
+        """ Returns a dictionary that maps the metric names to their current values.
+            See the snapshot methods of Counter and Histogram.
+        """
+        return OrderedDict((name, metric.snapshot())
+                           for name, metric in self._metrics.items())
+
+    def exposition(self):
+        """ Returns the metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        for name, metric in self._metrics.items():
+            if metric.description:
+                lines.append("# HELP {} {}".format(name, metric.description))
+            lines.append("# TYPE {} {}".format(name, metric.metric_type))
+            lines.extend(metric.exposition_lines())
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+_registry = None
+
+
+def get_registry():
+    """ Returns the registry in which the metrics are collected, or None if disabled.
+    """
+    return _registry
+
+
+def enable_metrics(registry=METRICS):
+    """ Starts collecting metrics in the registry. The counters of the process-wide compile
+        cache are added to it. Returns the registry.
+    """
+    global _registry
+    registry.add_function_counter('pepcalk_compile_cache_hits_total',
+                                  "Number of code objects found in the compile cache.",
+                                  lambda: COMPILE_CACHE.n_hits)
+    registry.add_function_counter('pepcalk_compile_cache_misses_total',
+                                  "Number of expressions that were not compiled yet.",
+                                  lambda: COMPILE_CACHE.n_misses)
+    _registry = registry
+    return registry
+
+
+def disable_metrics():
+    """ Stops collecting metrics. The metrics that were collected are kept.
+    """
+    global _registry
+    _registry = None
+
+
+def record_assignment(registry, assignment):
+    """ Records the duration and error of an executed assignment. The duration is unknown,
+        and not recorded, if the assignment could not be executed in a worker process.
+    """
+    if assignment.wall_time is not None:
+        registry.histogram(ASSIGNMENT_SECONDS).observe(assignment.wall_time)
+    if assignment.error is not None:
+        record_error(registry, assignment.error)
+
+
+def record_error(registry, error):
+    """ Counts an error that is stored in an assignment.
+    """
+    registry.counter(ASSIGNMENT_ERRORS).inc(error=class_name(error))
+
+
+class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Responds to GET requests with the metrics in the text exposition format.
+    """
+    registry = METRICS
+
+    def do_GET(self):
+        """ Handles a GET request for any path.
+        """
+        body = self.registry.exposition()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, msg_format, *args):
+        logger.debug("Metrics request: " + msg_format % args)
+
+
+def start_http_server(port, address='127.0.0.1', registry=METRICS):
+    """ Serves the metrics of the registry over HTTP in a daemon thread.
+
+        Returns the server; call its shutdown method to stop it. If port is 0, a free port
+        is chosen, which is available as server.server_address[1].
+    """
+    class MetricsHandler(_MetricsHandler):
+        " Handler for the metrics of the registry "
+    MetricsHandler.registry = registry
+
+    server = BaseHTTPServer.HTTPServer((address, port), MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name='pepcalk-metrics')
+    thread.daemon = True
+    thread.start()
+    logger.info("Serving metrics on http://{}:{:d}/".format(*server.server_address))
+    return server
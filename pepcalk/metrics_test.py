@@ -0,0 +1,111 @@
+""" Tests for the metrics module.
+"""
+
+from __future__ import absolute_import
+import unittest, urllib2
+
+from pepcalk.absynt import CompilationError
+from pepcalk.calculation import Calculation
+from pepcalk.metrics import (Counter, Histogram, MetricsRegistry, disable_metrics, 
+                             enable_metrics, get_registry, start_http_server)
+from pepcalk.utils import DEBUGGING
+from pepcalk.valuecache import ValueCache
+
+
+class MetricsCase(unittest.TestCase):
+    """A test class for the metrics registry"""
+
+    def setUp(self):
+        self.registry = enable_metrics(MetricsRegistry())
+
+    def tearDown(self):
+        disable_metrics()
+
+
+    def test_metrics(self):
+        
+        counter = Counter('errors_total', "Errors")
+        counter.inc(error='ValueError')
+        counter.inc(2, error='ValueError')
+        counter.inc()
+        self.assertEqual(counter.snapshot(), [({}, 1), ({'error': 'ValueError'}, 3)])
+        self.assertEqual(counter.exposition_lines(), 
+                         ['errors_total 1', 'errors_total{error="ValueError"} 3'])
+        
+        histogram = Histogram('seconds', "Duration", buckets=[0.1, 1.0])
+        for value in [0.05, 0.1, 0.5, 3.0]:
+            histogram.observe(value)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['buckets'], [(0.1, 2), (1.0, 3), (float('inf'), 4)])
+        self.assertEqual(snapshot['count'], 4)
+        self.assertAlmostEqual(snapshot['sum'], 3.65)
+        self.assertEqual(histogram.exposition_lines()[2], 'seconds_bucket{le="+Inf"} 4')
+        
+        self.assertRaises(TypeError, self.registry.histogram, 'pepcalk_compile_cache_hits_total')
+        
+        
+    def test_calculation(self):
+        
+        calc = Calculation("a = 1; b = a * 2; c = b / x")
+        calc.execution_local_vars['x'] = 0
+        calc.value_cache = ValueCache()
+        calc.compile()
+        if DEBUGGING:
+            self.assertRaises(ZeroDivisionError, calc.execute)
+        else:
+            calc.execute()
+        calc.execution_local_vars['x'] = 1
+        calc.compile() # Clears the error
+        for _ in range(2):
+            calc.execute()
+            
+        snapshot = get_registry().snapshot()
+        self.assertEqual(snapshot['pepcalk_compiles_total'], [({}, 2)])
+        self.assertEqual(snapshot['pepcalk_executions_total'], [({}, 2 if DEBUGGING else 3)])
+        self.assertEqual(snapshot['pepcalk_assignment_seconds']['count'], 3 + 1)
+        self.assertEqual(snapshot['pepcalk_assignment_errors_total'], 
+                         [({'error': 'ZeroDivisionError'}, 1)])
+        self.assertEqual(snapshot['pepcalk_value_cache_hits_total'], [({}, 2 + 3)])
+        self.assertEqual(snapshot['pepcalk_value_cache_misses_total'], [({}, 3 + 1)])
+        
+        exposition = self.registry.exposition()
+        self.assertIn("# TYPE pepcalk_compile_seconds histogram\n", exposition)
+        self.assertIn('pepcalk_assignment_errors_total{error="ZeroDivisionError"} 1\n', 
+                      exposition)
+        
+        server = start_http_server(0, registry=self.registry)
+        try:
+            url = "http://127.0.0.1:{:d}/metrics".format(server.server_address[1])
+            self.assertIn("pepcalk_compiles_total 2", urllib2.urlopen(url).read())
+        finally:
+            server.shutdown()
+            server.server_close()
+        
+        disable_metrics()
+        calc.compile()
+        self.assertEqual(self.registry.snapshot()['pepcalk_compiles_total'], [({}, 2)])
+        
+        
+    def test_multiprocess(self):
+        
+        # The results of the worker processes are recorded in this process
+        calc = Calculation("a = 1; b = a * 2; c = b / x")
+        calc.execution_local_vars['x'] = 0
+        self.assertRaises(ZeroDivisionError, calc.compile().execute, n_processes=2)
+        snapshot = self.registry.snapshot()
+        self.assertEqual(snapshot['pepcalk_assignment_seconds']['count'], 3)
+        self.assertEqual(snapshot['pepcalk_assignment_errors_total'], 
+                         [({'error': 'ZeroDivisionError'}, 1)])
+        
+        
+    def test_sort_errors(self):
+        
+        for code in ["a = 5; a = 2", "a = b; b = a"]:
+            self.assertRaises(CompilationError, Calculation(code).compile)
+        self.assertEqual(self.registry.snapshot()['pepcalk_assignment_errors_total'], 
+                         [({'error': 'CircularDependencyError'}, 1), 
+                          ({'error': 'CompilationError'}, 1)])
+        
+
+if __name__ == '__main__':
+    unittest.main()
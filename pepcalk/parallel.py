@@ -0,0 +1,277 @@
+""" Parallel execution of the assignments of a calculation.
+"""
+from __future__ import absolute_import, division
+
+import logging, os, shutil, sys, tempfile, Queue
+import cPickle as pickle
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from pepcalk.metrics import get_registry, record_assignment
+
+logger = logging.getLogger(__name__)
+
+# Arrays of at least this size are passed between processes via memory-mapped files.
+SHARED_ARRAY_MIN_BYTES = 2**20
+
+# Directory for the memory-mapped files. On Linux /dev/shm is backed by shared memory.
+SHARED_ARRAY_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Interval in seconds at which execute_multiprocess checks that the workers are alive.
+WORKER_CHECK_INTERVAL = 0.5
+
+
+def get_assignment_dependencies(assignments):
+    """ Returns (n_deps, dependents) tuple.
+
+        n_deps maps each assignment to the number of assignments in the list it depends on.
+        dependents maps each assignment to the list of assignments that depend on it.
+        Symbols that are not a target of one of the assignments are ignored.
+    """
+    assignment_dict = dict([(assignment.target, assignment) for assignment in assignments])
+    n_deps = {}
+    dependents = dict([(assignment, []) for assignment in assignments])
+    for assignment in assignments:
+        dep_symbols = set(assignment.symbols) & set(assignment_dict)
+        n_deps[assignment] = len(dep_symbols)
+        for dep_symbol in dep_symbols:
+            dependents[assignment_dict[dep_symbol]].append(assignment)
+    return n_deps, dependents
+
+
+def _schedule(assignments, local_vars, submit, done_queue, check=None):
+    """ Executes the assignments as soon as all the assignments they depend on are executed.
+
+        submit(assignment) must start the execution of the assignment in the background. When
+        done, an (assignment, value, exc_info) tuple must be put in the done_queue, where
+        exc_info is None if no exception was raised.
+
+        If an assignment raises an exception, no new assignments are submitted and the
+        exception is re-raised after the running assignments have finished.
+
+        :param check: optional function that is called every WORKER_CHECK_INTERVAL seconds
+            while waiting for an assignment. It should raise an exception if the running
+            assignments will never finish, e.g. because a worker process died.
+    """
+    n_deps, dependents = get_assignment_dependencies(assignments)
+    exc_info = None
+    n_running = 0
+    for assignment in assignments:
+        if n_deps[assignment] == 0:
+            submit(assignment)
+            n_running += 1
+
+    while n_running > 0:
+        if check is None:
+            assignment, value, assignment_exc_info = done_queue.get()
+        else:
+            while True:
+                try:
+                    assignment, value, assignment_exc_info = done_queue.get(
+                        timeout=WORKER_CHECK_INTERVAL)
+                    break
+                except Queue.Empty:
+                    check()
+        n_running -= 1
+        if assignment_exc_info is not None:
+            exc_info = exc_info or assignment_exc_info
+            continue
+
+        local_vars[assignment.target] = value
+        if exc_info is None:
+            for dependent in dependents[assignment]:
+                n_deps[dependent] -= 1
+                if n_deps[dependent] == 0:
+                    submit(dependent)
+                    n_running += 1
+
+    if exc_info is not None:
+        raise exc_info[0], exc_info[1], exc_info[2]
+
+
+def _execute_assignment(assignment, global_vars, local_vars, done_queue):
+    """ Executes the assignment and puts an (assignment, value, exc_info) tuple in the queue.
+        exc_info is None if no exception was raised.
+    """
+    try:
+        value = assignment.execute(global_vars, local_vars)
+        done_queue.put((assignment, value, None))
+    except Exception:
+        done_queue.put((assignment, None, sys.exc_info()))
+
+
+def execute_threaded(assignments, global_vars, local_vars, n_threads=None):
+    """ Executes the assignments on a pool of threads and stores the results in local_vars.
+
+        An assignment is scheduled as soon as all the assignments it depends on have been
+        executed, so independent assignments can run concurrently. This only speeds up the
+        calculation if the expressions release the GIL (e.g. most large NumPy operations).
+
+        Errors are stored in the assignments by Assignment.execute. If an assignment raises an
+        exception, no new assignments are scheduled and the exception is re-raised after the
+        running assignments have finished.
+
+        :param assignments: compiled assignments in execution order.
+        :param n_threads: the number of threads. If None, the number of CPUs is used.
+    """
+    done_queue = Queue.Queue()
+    pool = ThreadPool(n_threads)
+
+    def submit(assignment):
+        " Schedules an assignment for execution "
+        pool.apply_async(_execute_assignment,
+                         (assignment, global_vars, local_vars, done_queue))
+    try:
+        _schedule(assignments, local_vars, submit, done_queue)
+    finally:
+        pool.close()
+        pool.join()
+
+
+class SharedArray(object):
+    """ Picklable reference to an array that is stored in a .npy file.
+
+        Processes that load the array memory-map the file, so the array data is not copied
+        into the pickle stream.
+    """
+    def __init__(self, file_name):
+        """ Constructor """
+        self.file_name = file_name
+
+    @classmethod
+    def from_array(cls, array, directory=None):
+        """ Writes the array to a new file in the directory and returns a reference to it.
+        """
+        file_descriptor, file_name = tempfile.mkstemp(suffix='.npy', dir=directory)
+        with os.fdopen(file_descriptor, 'wb') as out_file:
+            np.save(out_file, array)
+        return cls(file_name)
+
+    def load(self):
+        """ Returns the array as a copy-on-write memory map of the file.
+        """
+        return np.load(self.file_name, mmap_mode='c')
+
+
+def _to_shareable(value, directory, min_shared_bytes):
+    """ Returns a SharedArray for large NumPy arrays. Returns other values unchanged.
+    """
+    if (isinstance(value, np.ndarray) and value.dtype != np.object_ and
+            value.nbytes >= min_shared_bytes):
+        return SharedArray.from_array(value, directory)
+    else:
+        return value
+
+
+_worker_global_vars = None
+
+def _init_worker(global_vars):
+    """ Initializes the global variables of a worker process.
+    """
+    global _worker_global_vars
+    _worker_global_vars = dict(global_vars)
+    exec "_np = __import__('numpy')" in _worker_global_vars
+
+
+def _execute_in_worker(pickled_task, directory, min_shared_bytes):
+    """ Executes a pickled (assignment, input_values) tuple in a worker process.
+
+        Returns a pickled (value, error, raised, wall_time, cpu_time) tuple, where raised is
+        the exception that escaped Assignment.execute or None.
+    """
+    try:
+        assignment, input_values = pickle.loads(pickled_task)
+        local_vars = {}
+        for symbol, value in input_values.iteritems():
+            local_vars[symbol] = value.load() if isinstance(value, SharedArray) else value
+
+        raised = None
+        try:
+            assignment.compile()
+            assignment.execute(_worker_global_vars, local_vars)
+        except Exception, ex:
+            raised = ex
+        value = _to_shareable(assignment.value, directory, min_shared_bytes)
+        return pickle.dumps((value, assignment.error, raised, assignment.wall_time,
+                             assignment.cpu_time), pickle.HIGHEST_PROTOCOL)
+    except Exception, ex:
+        error = RuntimeError("Unable to execute in worker process: {!r}".format(ex))
+        return pickle.dumps((None, error, error, None, None), pickle.HIGHEST_PROTOCOL)
+
+
+def execute_multiprocess(assignments, global_vars, local_vars, n_processes=None,
+                         min_shared_bytes=SHARED_ARRAY_MIN_BYTES):
+    """ Executes the assignments on a pool of processes and stores the results in local_vars.
+
+        Assignments are scheduled in the same way as in execute_threaded. They are pickled
+        as their source code and compiled again in the worker processes, together with the
+        values of the symbols they use. NumPy arrays of at least min_shared_bytes are not
+        pickled but passed via memory-mapped files in SHARED_ARRAY_DIR. The resulting
+        arrays in local_vars are copy-on-write memory maps.
+
+        :param assignments: compiled assignments in execution order.
+        :param global_vars: the initial global variables; they are copied to each process
+            once, so they must be picklable.
+        :param n_processes: the number of processes. If None, the number of CPUs is used.
+
+        Raises a RuntimeError if a worker process dies, e.g. because it was killed.
+    """
+    done_queue = Queue.Queue()
+    directory = tempfile.mkdtemp(prefix='pepcalk-', dir=SHARED_ARRAY_DIR)
+    shared_values = {} # symbol -> SharedArray, so that each array is written only once.
+    pool = Pool(n_processes, initializer=_init_worker, initargs=(global_vars, ))
+
+    def submit(assignment):
+        " Schedules an assignment for execution "
+        input_values = {}
+        for symbol in set(assignment.symbols):
+            if symbol in shared_values:
+                input_values[symbol] = shared_values[symbol]
+            elif symbol in local_vars:
+                value = _to_shareable(local_vars[symbol], directory, min_shared_bytes)
+                if isinstance(value, SharedArray):
+                    shared_values[symbol] = value
+                input_values[symbol] = value
+        pickled_task = pickle.dumps((assignment, input_values), pickle.HIGHEST_PROTOCOL)
+
+        def on_done(pickled_result):
+            " Called in the result handler thread of the pool. Must not raise. "
+            try:
+                value, error, raised, wall_time, cpu_time = pickle.loads(pickled_result)
+                if isinstance(value, SharedArray):
+                    shared_values[assignment.target] = value
+                    value = value.load()
+                assignment.set_result(value, error, wall_time, cpu_time)
+                # Metrics that are recorded in the worker process are lost.
+                registry = get_registry()
+                if registry is not None:
+                    record_assignment(registry, assignment)
+                exc_info = None if raised is None else (type(raised), raised, None)
+                done_queue.put((assignment, value, exc_info))
+            except Exception:
+                done_queue.put((assignment, None, sys.exc_info()))
+
+        pool.apply_async(_execute_in_worker, (pickled_task, directory, min_shared_bytes),
+                         callback=on_done)
+    workers = set()
+
+    def check_workers():
+        " Raises a RuntimeError if a worker has exited; its task will never finish. "
+        workers.update(pool._pool) # The pool replaces workers that have exited
+        for worker in workers:
+            if worker.exitcode is not None:
+                raise RuntimeError("Worker process {} exited with code {}"
+                                   .format(worker.pid, worker.exitcode))
+    try:
+        workers.update(pool._pool)
+        _schedule(assignments, local_vars, submit, done_queue, check=check_workers)
+        pool.close()
+    except:
+        pool.terminate() # Closing would wait for the tasks of the dead workers
+        raise
+    finally:
+        pool.join()
+        shutil.rmtree(directory, ignore_errors=True)
+
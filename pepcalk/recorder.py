@@ -0,0 +1,194 @@
+""" Recording of real calculation workloads, so that they can be replayed as benchmarks.
+
+    While a Recorder is set with set_recorder, each executed calculation is written to its
+    archive as a workload: the code of the assignments, the settings, the execution_local_vars and
+    execution_global_vars, the arguments of execute() and the wall times of the compilation,
+    the execution and each executed assignment. The archive is a zip file in which arrays are
+    stored as .npy files and other values are pickled. See pepcalk.replay to replay it.
+    
+    Values that cannot be pickled, e.g. modules, are not stored; their names are listed in 
+    the 'unrecorded' item of the workload instead.
+"""
+from __future__ import absolute_import, division
+
+import logging, json, platform, threading, time, weakref, zipfile
+import cPickle as pickle
+from cStringIO import StringIO
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+METADATA_FILE = 'metadata.json'
+WORKLOAD_FILE = 'workload.json'
+
+_recorder = None
+
+
+def get_recorder():
+    """ Returns the current recorder, or None if recording is disabled.
+    """
+    return _recorder
+
+
+def set_recorder(recorder):
+    """ Sets the recorder that records the executed calculations. Use None to disable
+        recording. Returns the previous recorder.
+    """
+    global _recorder
+    previous, _recorder = _recorder, recorder
+    return previous
+
+
+def _dump_value(value):
+    """ Returns a (format, data) tuple, where format is 'npy' or 'pickle'.
+
+        Raises a pickle.PicklingError or TypeError if the value cannot be pickled.
+    """
+    if isinstance(value, np.ndarray) and not value.dtype.hasobject:
+        string_file = StringIO()
+        np.save(string_file, value, allow_pickle=False)
+        return 'npy', string_file.getvalue()
+    else:
+        return 'pickle', pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def _load_value(value_format, data):
+    """ Returns the value that was stored with _dump_value.
+    """
+    if value_format == 'npy':
+        return np.load(StringIO(data), allow_pickle=False)
+    elif value_format == 'pickle':
+        return pickle.loads(data)
+    else:
+        raise ValueError("Unknown value format: {!r}".format(value_format))
+
+
+class Recorder(object):
+    """ Writes the workloads of the executed calculations to a zip archive.
+
+        Use it as a context manager to record the calculations that are executed within the
+        with-statement: the recorder is set on entering and the archive is closed on exiting.
+        The compile time of a workload is the time of the last Calculation.compile() call of
+        the calculation while recording, or None if it was compiled before.
+
+        The inputs are stored for each execution, so recording many executions with large
+        arrays results in a large archive. The value_cache and buffer_pool are not recorded.
+    """
+    def __init__(self, file_name):
+        """ Constructor. Creates the archive, overwriting an existing file.
+        """
+        self.file_name = file_name
+        self._zip_file = zipfile.ZipFile(file_name, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+        self._compile_times = weakref.WeakKeyDictionary()
+        self._n_workloads = 0
+        self._previous_recorder = None
+        self._lock = threading.Lock()
+
+    def __str__(self):
+        return "<Recorder: {}, {:d} workloads>".format(self.file_name, self._n_workloads)
+
+    def __len__(self):
+        "Number of recorded workloads"
+        return self._n_workloads
+
+    def __enter__(self):
+        self._previous_recorder = set_recorder(self)
+        return self
+
+    def __exit__(self, _exc_type, _exc_value, _traceback):
+        set_recorder(self._previous_recorder)
+        self.close()
+        return False
+
+    def close(self):
+        """ Writes the metadata and closes the archive.
+        """
+        with self._lock:
+            if self._zip_file is None:
+                return
+            metadata = {'python': platform.python_version(), 'numpy': np.__version__,
+                        'platform': platform.platform(),
+                        'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+                        'n_workloads': self._n_workloads}
+            self._zip_file.writestr(METADATA_FILE, json.dumps(metadata, indent=2,
+                                                              sort_keys=True))
+            self._zip_file.close()
+            self._zip_file = None
+        logger.info("Recorded {:d} workloads in {}".format(self._n_workloads, self.file_name))
+
+    def record_compile(self, calculation, compile_time):
+        """ Called after a calculation has been compiled.
+        """
+        self._compile_times[calculation] = compile_time
+
+    def record_execute(self, calculation, execute_time, execute_args):
+        """ Called after a calculation has been executed. Adds a workload to the archive.
+
+            :param execute_args: dictionary with the keyword arguments of execute().
+        """
+        with self._lock:
+            if self._zip_file is None:
+                raise AssertionError("Pre: recorder is closed: {}".format(self))
+            directory = "workloads/{:04d}/".format(self._n_workloads)
+            # The code as written, not the canonical source, so that nothing is lost.
+            source = '\n'.join([assignment.code for assignment in calculation.assignments])
+            workload = {
+                'source': source,
+                'fused_block_size': calculation.fused_block_size,
+                'profile_expressions': calculation.profile_expressions,
+                'share_subexpressions': calculation.share_subexpressions,
+                'execute_args': execute_args,
+                'compile_time': self._compile_times.get(calculation),
+                'execute_time': execute_time,
+                'assignment_times': dict((assignment.target, assignment.wall_time)
+                                         for assignment in calculation.assignments
+                                         if assignment.wall_time is not None),
+                'unrecorded': [],
+            }
+            for key, variables in [('local_vars', calculation.execution_local_vars), 
+                                   ('global_vars', calculation.execution_global_vars)]:
+                workload[key] = self._write_values(directory + key + '/', variables, 
+                                                   workload['unrecorded'])
+            self._zip_file.writestr(directory + WORKLOAD_FILE,
+                                    json.dumps(workload, indent=2, sort_keys=True))
+            self._n_workloads += 1
+
+    def _write_values(self, directory, variables, unrecorded):
+        """ Writes the values of a dictionary of variables to the directory in the archive.
+
+            Returns a dictionary that maps the names to (format, path) pairs. The names of 
+            values that cannot be pickled, e.g. modules, are appended to unrecorded instead.
+        """
+        result = {}
+        for name, value in variables.iteritems():
+            try:
+                value_format, data = _dump_value(value)
+            except (StandardError, pickle.PicklingError), ex:
+                logger.warning("Cannot record {}: {}".format(name, ex))
+                unrecorded.append(name)
+                continue
+            path = "{}{}.{}".format(directory, name, value_format)
+            self._zip_file.writestr(path, data)
+            result[name] = (value_format, path)
+        return result
+
+
+def load_archive(file_name):
+    """ Reads an archive that was written by a Recorder.
+
+        Returns a (metadata, workloads) tuple. The workloads are dictionaries as described in
+        Recorder.record_execute, where the local_vars and global_vars map the names to the
+        recorded values.
+    """
+    with zipfile.ZipFile(file_name, 'r', allowZip64=True) as zip_file:
+        metadata = json.loads(zip_file.read(METADATA_FILE))
+        workloads = []
+        for idx in range(metadata['n_workloads']):
+            directory = "workloads/{:04d}/".format(idx)
+            workload = json.loads(zip_file.read(directory + WORKLOAD_FILE))
+            for key in ('local_vars', 'global_vars'):
+                workload[key] = dict((name, _load_value(value_format, zip_file.read(path)))
+                                     for name, (value_format, path) in workload[key].items())
+            workloads.append(workload)
+    return metadata, workloads
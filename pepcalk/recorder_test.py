@@ -0,0 +1,61 @@
+""" Tests for the recorder module.
+"""
+
+from __future__ import absolute_import
+import unittest, os, shutil, tempfile, math
+
+import numpy as np
+
+from pepcalk.calculation import Calculation
+from pepcalk.recorder import Recorder, get_recorder, load_archive
+
+
+class RecorderCase(unittest.TestCase):
+    """A test class for recording workloads"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'workloads.zip')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def test_record(self):
+        
+        calc = Calculation("b = a * 2; c = (-b) ** 2 + n  # squared")
+        calc.execution_local_vars['a'] = np.arange(5.0)
+        calc.execution_local_vars['n'] = 3
+        calc.execution_global_vars['math'] = math # modules cannot be pickled
+        
+        with Recorder(self.file_name) as recorder:
+            self.assertIs(get_recorder(), recorder)
+            calc.compile().execute()
+            calc.execution_local_vars['n'] = 4
+            calc.execute(targets=['b'])
+        self.assertIsNone(get_recorder())
+        self.assertEqual(len(recorder), 2)
+        
+        calc.execute() # not recorded
+        
+        metadata, workloads = load_archive(self.file_name)
+        self.assertEqual(metadata['n_workloads'], 2)
+        self.assertEqual(len(workloads), 2)
+        
+        first, second = workloads
+        self.assertEqual(first['source'], "b = a * 2\nc = (-b) ** 2 + n  # squared")
+        np.testing.assert_array_equal(first['local_vars']['a'], np.arange(5.0))
+        self.assertEqual(first['local_vars']['n'], 3)
+        self.assertEqual(second['local_vars']['n'], 4)
+        self.assertEqual(first['global_vars'], {})
+        self.assertEqual(first['unrecorded'], ['math'])
+        self.assertEqual(first['execute_args']['targets'], None)
+        self.assertEqual(second['execute_args']['targets'], ['b'])
+        self.assertTrue(first['compile_time'] > 0)
+        self.assertTrue(first['execute_time'] > 0)
+        self.assertEqual(sorted(first['assignment_times'].keys()), ['b', 'c'])
+        self.assertEqual(sorted(second['assignment_times'].keys()), ['b'])
+        
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+""" Replays the workloads that were recorded with pepcalk.recorder.
+
+    Run with: python -m pepcalk.replay <archive> --help
+
+    Each workload is compiled and executed again with the recorded inputs and arguments.
+    The best times of several repetitions are compared with the recorded times of the
+    compilation, the execution and each assignment.
+"""
+from __future__ import absolute_import, division
+
+import logging, argparse, sys
+from timeit import default_timer
+
+from pepcalk.benchmark import is_regression
+from pepcalk.calculation import Calculation
+from pepcalk.recorder import load_archive
+from pepcalk.utils import format_duration, logging_basic_config
+
+logger = logging.getLogger(__name__)
+
+
+def make_calculation(workload):
+    """ Returns the uncompiled calculation of a recorded workload.
+    
+        Raises a ValueError if the calculation uses variables whose values could not be 
+        recorded.
+    """
+    calculation = Calculation(workload['source'])
+    used_symbols = set(symbol for assignment in calculation.assignments 
+                       for symbol in assignment.symbols)
+    missing = sorted(used_symbols.intersection(workload.get('unrecorded', [])))
+    if missing:
+        raise ValueError("The values of {} could not be recorded, so the workload cannot "
+                         "be replayed.".format(", ".join(missing)))
+    calculation.fused_block_size = workload['fused_block_size']
+    calculation.profile_expressions = workload['profile_expressions']
+    calculation.share_subexpressions = workload.get('share_subexpressions', False)
+    calculation.execution_local_vars = dict(workload['local_vars'])
+    calculation.execution_global_vars = dict(workload['global_vars'])
+    return calculation
+
+
+def replay_workload(workload, n_repeats=3):
+    """ Compiles and executes the calculation of the workload n_repeats times.
+
+        Returns a dictionary with the best compile_time, execute_time and the best time
+        of each assignment in assignment_times, like in the recorded workload.
+    """
+    calculation = make_calculation(workload)
+    execute_args = dict((str(key), value) for key, value
+                        in workload['execute_args'].iteritems())
+    result = {'compile_time': None, 'execute_time': None, 'assignment_times': {}}
+
+    def keep_best(times, key, duration):
+        if duration is not None and (times.get(key) is None or duration < times[key]):
+            times[key] = duration
+
+    for _ in range(n_repeats):
+        start_time = default_timer()
+        calculation.compile()
+        keep_best(result, 'compile_time', default_timer() - start_time)
+
+        start_time = default_timer()
+        calculation.execute(**execute_args)
+        keep_best(result, 'execute_time', default_timer() - start_time)
+        for assignment in calculation.assignments:
+            keep_best(result['assignment_times'], assignment.target, assignment.wall_time)
+    return result
+
+
+def compare_to_recording(workload, replayed, threshold=0.1, min_time=1e-4):
+    """ Returns a list of (name, recorded_time, replayed_time) tuples of the phases and
+        assignments that are more than a fraction threshold slower than recorded. The name
+        of the phases is 'compile' or 'execute'; that of assignments is their target.
+    """
+    regressions = []
+    for phase in ('compile', 'execute'):
+        key = phase + '_time'
+        if workload[key] is not None and replayed[key] is not None:
+            if is_regression(workload[key], replayed[key], threshold, min_time):
+                regressions.append((phase, workload[key], replayed[key]))
+
+    recorded_times = workload['assignment_times']
+    for target, replayed_time in sorted(replayed['assignment_times'].iteritems()):
+        recorded_time = recorded_times.get(target)
+        if recorded_time is not None:
+            if is_regression(recorded_time, replayed_time, threshold, min_time):
+                regressions.append((target, recorded_time, replayed_time))
+    return regressions
+
+
+def replay_archive(file_name, n_repeats=3, threshold=0.1, min_time=1e-4):
+    """ Replays all workloads of an archive.
+
+        Returns a list of (workload_idx, name, recorded_time, replayed_time) tuples of the
+        regressions. See compare_to_recording.
+    """
+    metadata, workloads = load_archive(file_name)
+    logger.info("Replaying {:d} workloads that were recorded at {} with Python {}"
+                .format(len(workloads), metadata['time'], metadata['python']))
+    regressions = []
+    for workload_idx, workload in enumerate(workloads):
+        replayed = replay_workload(workload, n_repeats=n_repeats)
+        logger.info("Workload {:d}: compile {} (recorded {}), execute {} (recorded {})"
+                    .format(workload_idx,
+                            format_duration(replayed['compile_time']),
+                            format_duration(workload['compile_time']),
+                            format_duration(replayed['execute_time']),
+                            format_duration(workload['execute_time'])))
+        for regression in compare_to_recording(workload, replayed, threshold=threshold,
+                                                min_time=min_time):
+            regressions.append((workload_idx, ) + regression)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays recorded pepcalk workloads.")
+    parser.add_argument('archive', help="Archive that was written by a pepcalk Recorder.")
+    parser.add_argument('--repeats', type=int, default=3,
+                        help="The best time of this many repetitions is used.")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="Relative slowdown that is a regression. Default: %(default)s")
+    parser.add_argument('--min-time', type=float, default=1e-4,
+                        help="Times below this many seconds are ignored. Default: %(default)s")
+    args = parser.parse_args()
+
+    logging_basic_config("INFO")
+    regressions = replay_archive(args.archive, n_repeats=args.repeats,
+                                 threshold=args.threshold, min_time=args.min_time)
+    for workload_idx, name, recorded_time, replayed_time in regressions:
+        logger.warning("Regression workload {:d} {}: {} -> {} ({:+.0%})"
+                       .format(workload_idx, name, format_duration(recorded_time),
+                               format_duration(replayed_time),
+                               replayed_time / recorded_time - 1))
+    logger.info("{:d} regressions compared to {}".format(len(regressions), args.archive))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+""" Tests for the replay module.
+"""
+
+from __future__ import absolute_import
+import unittest, os, shutil, tempfile, math
+
+import numpy as np
+
+from pepcalk.calculation import Calculation
+from pepcalk.recorder import Recorder, load_archive
+from pepcalk.replay import compare_to_recording, replay_archive, replay_workload
+
+
+class ReplayCase(unittest.TestCase):
+    """A test class for replaying workloads"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'workloads.zip')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+    def test_replay(self):
+        
+        calc = Calculation("b = a * 2; c = b.sum()")
+        calc.execution_local_vars['a'] = np.arange(5.0)
+        with Recorder(self.file_name):
+            calc.compile().execute(targets=['c'])
+            
+        _metadata, workloads = load_archive(self.file_name)
+        replayed = replay_workload(workloads[0], n_repeats=2)
+        self.assertEqual(sorted(replayed['assignment_times'].keys()), ['b', 'c'])
+        self.assertTrue(replayed['compile_time'] > 0)
+        self.assertTrue(replayed['execute_time'] > 0)
+        self.assertEqual(len(replay_archive(self.file_name, n_repeats=1, min_time=1.0)), 0)
+        
+        
+    def test_unrecorded(self):
+        
+        calc = Calculation("b = math.sqrt(a); c = a + 1")
+        calc.execution_local_vars['a'] = 4.0
+        calc.execution_global_vars['math'] = math # modules cannot be pickled
+        with Recorder(self.file_name):
+            calc.compile().execute()
+            
+        _metadata, workloads = load_archive(self.file_name)
+        self.assertRaises(ValueError, replay_workload, workloads[0], n_repeats=1)
+        
+        # Unrecorded variables that are not used don't matter
+        workloads[0]['source'] = "c = a + 1"
+        self.assertEqual(replay_workload(workloads[0], n_repeats=1)['assignment_times'].keys(), 
+                         ['c'])
+        
+        
+    def test_compare_to_recording(self):
+        
+        recorded = {'compile_time': 1.0, 'execute_time': 1.0, 
+                    'assignment_times': {'b': 0.5, 'c': 0.5}}
+        replayed = {'compile_time': None, 'execute_time': 1.05, 
+                    'assignment_times': {'b': 0.5, 'c': 1.0, 'd': 1.0}}
+        self.assertEqual(compare_to_recording(recorded, replayed), [('c', 0.5, 1.0)])
+        replayed['execute_time'] = 2.0
+        self.assertEqual(compare_to_recording(recorded, replayed), 
+                         [('execute', 1.0, 2.0), ('c', 0.5, 1.0)])
+        
+
+if __name__ == '__main__':
+    unittest.main()
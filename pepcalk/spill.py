@@ -0,0 +1,57 @@
+""" Temporary storage of arrays on disk, used to keep execution within a memory budget.
+"""
+from __future__ import absolute_import, division
+
+import logging, os, shutil, tempfile
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MIN_SPILL_BYTES = 2**20
+
+
+def is_spillable(value, min_spill_bytes=DEFAULT_MIN_SPILL_BYTES):
+    """ Returns True if the value is an array of at least min_spill_bytes that is in memory
+        and can be saved in a .npy file without pickling.
+    """
+    return (isinstance(value, np.ndarray) and not isinstance(value, np.memmap) and
+            not value.dtype.hasobject and value.nbytes >= min_spill_bytes)
+
+
+class SpillStore(object):
+    """ A temporary directory in which arrays are saved as .npy files.
+
+        Spilled arrays are loaded as read-only memory maps, so only the parts that are used
+        are read from disk. The directory is removed by close(); on POSIX systems the memory
+        maps remain valid after that.
+    """
+    def __init__(self, directory=None):
+        """ Constructor.
+
+            :param directory: the directory in which the temporary directory is created. If
+                None, the default directory of the tempfile module is used.
+        """
+        self._directory = tempfile.mkdtemp(prefix='pepcalk-spill-', dir=directory)
+        self._n_files = 0
+
+    def __str__(self):
+        return "<SpillStore: {}, {:d} files>".format(self._directory, self._n_files)
+
+    def spill(self, value):
+        """ Saves the array in a new file. Returns the file name.
+        """
+        file_name = os.path.join(self._directory, "{:d}.npy".format(self._n_files))
+        self._n_files += 1
+        np.save(file_name, value)
+        return file_name
+
+    def load(self, file_name):
+        """ Returns a read-only memory map of a spilled array.
+        """
+        return np.load(file_name, mmap_mode='r')
+
+    def close(self):
+        """ Removes the directory with the spilled arrays.
+        """
+        shutil.rmtree(self._directory, ignore_errors=True)
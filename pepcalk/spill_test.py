@@ -0,0 +1,41 @@
+""" Tests for the spill module.
+"""
+
+from __future__ import absolute_import
+import unittest, os
+import numpy as np
+
+from pepcalk.spill import SpillStore, is_spillable
+
+
+class SpillCase(unittest.TestCase):
+    """A test class for spilling arrays to disk"""
+
+    def setUp(self):
+        self.spill_store = SpillStore()
+
+    def tearDown(self):
+        self.spill_store.close()
+
+
+    def test_spill(self):
+        
+        array = np.arange(1000.0)
+        self.assertTrue(is_spillable(array, min_spill_bytes=8000))
+        self.assertFalse(is_spillable(array, min_spill_bytes=8001))
+        self.assertFalse(is_spillable(np.empty(1000, dtype=np.object_), min_spill_bytes=0))
+        self.assertFalse(is_spillable([1.0] * 1000, min_spill_bytes=0))
+        
+        file_name = self.spill_store.spill(array)
+        self.assertNotEqual(file_name, self.spill_store.spill(array))
+        loaded = self.spill_store.load(file_name)
+        np.testing.assert_array_equal(loaded, array)
+        self.assertFalse(is_spillable(loaded, min_spill_bytes=0))
+        
+        self.spill_store.close()
+        self.assertFalse(os.path.exists(file_name))
+        np.testing.assert_array_equal(loaded, array)
+        
+
+if __name__ == '__main__':
+    unittest.main()
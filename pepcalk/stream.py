@@ -0,0 +1,111 @@
+""" Streaming evaluation of a calculation over input records, e.g. the rows of a CSV file.
+"""
+from __future__ import absolute_import, division
+
+import logging, csv
+from itertools import islice
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 4096
+
+
+def iter_batches(iterable, batch_size):
+    """ Yields lists of at most batch_size consecutive items of the iterable.
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size should be at least 1. Got: {}".format(batch_size))
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def convert_csv_column(strings):
+    """ Converts a list of strings to an array of integers, of floats, or of strings;
+        whichever type fits all of them first.
+    """
+    for convert in (int, float):
+        try:
+            return np.array([convert(string) for string in strings])
+        except ValueError:
+            pass
+    return np.array(strings)
+
+
+def stream_records(calculation, records, outputs=None, batch_size=DEFAULT_BATCH_SIZE,
+                   keep_inputs=False, convert_column=np.array):
+    """ Evaluates the calculation for each record and lazily yields the result records.
+
+        The records are dictionaries. Their items whose keys are input symbols of the
+        calculation are bound to these symbols. Other items are ignored. Internally the
+        records are combined in batches of batch_size, which are evaluated at once with
+        Calculation.sweep. Like a sweep, each record is evaluated as if on its own, so its
+        results don't depend on the other records of its batch. Only one batch is kept in 
+        memory. If an input symbol is missing 
+        from some of the records, its value in the execution_local_vars of the calculation 
+        is used for these records; a ValueError is raised if it has no value there.
+
+        :param outputs: list of symbols in the result records. If None, all targets.
+            Only the assignments that are needed for the outputs are evaluated.
+        :param keep_inputs: if True, the result records also contain the input items.
+        :param convert_column: function that converts a list of record values to an array.
+
+        Pre: the calculation must be compiled first.
+    """
+    if outputs is None:
+        outputs = [assignment.target for assignment in calculation.assignments]
+    input_symbols = calculation.input_symbols()
+
+    missing = object()
+    for batch in iter_batches(records, batch_size):
+        columns = {}
+        for symbol in input_symbols:
+            if any([symbol in record for record in batch]):
+                default = calculation.execution_local_vars.get(symbol, missing)
+                column = [record.get(symbol, default) for record in batch]
+                if default is missing and missing in column:
+                    raise ValueError("Input {!r} is missing from some records and has no "
+                                     "value in execution_local_vars.".format(symbol))
+                columns[symbol] = convert_column(column)
+        per_record = calculation.dependent_symbols(columns.keys())
+
+        results = calculation.sweep(columns, targets=outputs)
+        for idx, record in enumerate(batch):
+            result_record = dict(record) if keep_inputs else {}
+            for symbol in outputs:
+                value = results[symbol]
+                if symbol in per_record and np.ndim(value) > 0:
+                    value = value[idx]
+                result_record[symbol] = value
+            yield result_record
+
+
+def stream_csv(calculation, csv_file, outputs=None, batch_size=DEFAULT_BATCH_SIZE,
+               keep_inputs=False, **reader_kwargs):
+    """ Evaluates the calculation for each row of a CSV file and lazily yields the result
+        records. The first row should contain the column names.
+
+        Columns are converted to integers or floats if possible. See stream_records for
+        the other parameters.
+
+        :param csv_file: file name or file object.
+        :param reader_kwargs: passed to csv.DictReader.
+    """
+    if isinstance(csv_file, basestring):
+        with open(csv_file, 'rb') as file_obj:
+            for result_record in stream_csv(calculation, file_obj, outputs=outputs,
+                                            batch_size=batch_size, keep_inputs=keep_inputs,
+                                            **reader_kwargs):
+                yield result_record
+        return
+
+    reader = csv.DictReader(csv_file, **reader_kwargs)
+    for result_record in stream_records(calculation, reader, outputs=outputs,
+                                        batch_size=batch_size, keep_inputs=keep_inputs,
+                                        convert_column=convert_csv_column):
+        yield result_record
@@ -0,0 +1,65 @@
+""" Tests for the stream module.
+"""
+
+from __future__ import absolute_import
+import unittest
+from StringIO import StringIO
+
+from pepcalk.calculation import Calculation
+from pepcalk.stream import iter_batches, stream_records, stream_csv
+
+
+class StreamCase(unittest.TestCase):
+    """A test class for streaming evaluation"""
+
+    def setUp(self):
+        self.calc = Calculation("vat = amount * rate; total = amount + vat; rate = 0.25")
+        self.calc.compile()
+
+    def tearDown(self):
+        pass
+
+
+    def test_iter_batches(self):
+        
+        self.assertEqual(list(iter_batches(xrange(7), 3)), [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(list(iter_batches([], 3)), [])
+        self.assertRaises(ValueError, list, iter_batches([], 0))
+        
+        
+    def test_stream_records(self):
+        
+        records = ({'amount': idx * 4, 'id': idx} for idx in xrange(7))
+        results = stream_records(self.calc, records, outputs=['total', 'rate'], batch_size=3,
+                                 keep_inputs=True)
+        self.assertEqual(next(results), {'amount': 0, 'id': 0, 'total': 0.0, 'rate': 0.25})
+        results = list(results)
+        self.assertEqual(len(results), 6)
+        self.assertEqual(results[-1]['total'], 30.0)
+        self.assertEqual(results[-1]['id'], 6)
+        
+        # Missing inputs get their value from the execution_local_vars
+        calc = Calculation("total = amount * count").compile()
+        records = [{'amount': 4}, {'amount': 8, 'count': 2}]
+        self.assertRaises(ValueError, list, stream_records(calc, records))
+        calc.execution_local_vars['count'] = 1
+        self.assertEqual(list(stream_records(calc, records)), [{'total': 4}, {'total': 16}])
+
+        # The results of a record don't depend on the other records in its batch
+        calc = Calculation("d = amount - amount.mean(); e = d + amount * 2").compile()
+        records = ({'amount': idx} for idx in xrange(7))
+        results = list(stream_records(calc, records, batch_size=3))
+        self.assertEqual([result['d'] for result in results], [0] * 7)
+        self.assertEqual([result['e'] for result in results], range(0, 14, 2))
+        
+        
+    def test_stream_csv(self):
+        
+        # The rate column is ignored because rate is not an input symbol
+        csv_file = StringIO("amount,rate\n100,0.2\n50,0.1\n")
+        results = list(stream_csv(self.calc, csv_file, outputs=['total']))
+        self.assertEqual(results, [{'total': 125.0}, {'total': 62.5}])
+        
+
+if __name__ == '__main__':
+    unittest.main()
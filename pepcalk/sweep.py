@@ -0,0 +1,136 @@
+""" Vectorized evaluation of a calculation over arrays of input values (parameter sweeps).
+"""
+from __future__ import absolute_import, division
+
+import logging
+
+import numpy as np
+
+from pepcalk.fused import is_elementwise
+
+logger = logging.getLogger(__name__)
+
+
+def make_sweep_inputs(inputs, grid=False):
+    """ Returns a dictionary that maps the swept symbols to arrays.
+
+        :param inputs: dictionary or list of (symbol, values) pairs.
+        :param grid: if True, the values must be 1-D and are combined into a grid with one
+            dimension per symbol. The dimensions are in the order of the list, or sorted by
+            symbol for a dictionary. The grid is sparse: each array only has a length larger
+            than one in its own dimension and is broadcast to the full grid when used.
+            If False, the arrays are broadcast against each other.
+    """
+    pairs = sorted(inputs.items()) if isinstance(inputs, dict) else list(inputs)
+    symbols = [symbol for symbol, _values in pairs]
+    arrays = [np.asarray(values) for _symbol, values in pairs]
+    if grid:
+        for symbol, array in zip(symbols, arrays):
+            if array.ndim != 1:
+                raise ValueError("Grid values of {!r} should be 1-D. Got {}-D"
+                                 .format(symbol, array.ndim))
+        if arrays:
+            arrays = np.meshgrid(*arrays, indexing='ij', sparse=True)
+    elif len(arrays) > 1:
+        np.broadcast(*arrays) # Raises a ValueError if the arrays cannot be broadcast
+    return dict(zip(symbols, arrays))
+
+
+def _broadcast_shape(values):
+    """ Returns the shape that the values are broadcast to. """
+    if len(values) == 1:
+        return np.shape(values[0])
+    else:
+        return np.broadcast(*values).shape
+
+
+def _can_vectorize(assignment, global_vars, local_vars, swept):
+    """ Returns True if evaluating the assignment once with the swept arrays gives the same
+        results as evaluating it per element: the expression must be element-wise and the
+        other symbols it uses must not be arrays or sequences, which would be combined
+        element-wise with the swept values instead of as a whole.
+    """
+    if not is_elementwise(assignment.evaluated_expression):
+        return False
+    for symbol in set(assignment.symbols):
+        if symbol in swept:
+            continue
+        value = local_vars[symbol] if symbol in local_vars else global_vars.get(symbol)
+        if isinstance(value, (np.ndarray, list, tuple)) and np.ndim(value) > 0:
+            return False
+    return True
+
+
+def _try_execute_vectorized(assignment, global_vars, local_vars, shape):
+    """ Executes the assignment with array values. Returns (success, value) tuple.
+
+        Not successful if an exception occurs or the result does not have the broadcast shape
+        of the swept values that the assignment uses.
+    """
+    try:
+        value = eval(assignment.compiled_expression, global_vars, local_vars)
+    except StandardError, ex:
+        logger.debug("Unable to vectorize {}: {}".format(assignment, ex))
+        return False, None
+    return np.shape(value) == shape, value
+
+
+def _execute_elementwise(assignment, global_vars, local_vars, swept_symbols, shape):
+    """ Executes the assignment once per element of the broadcast swept values.
+        Returns an array with the results.
+    """
+    element_vars = dict((symbol, local_vars[symbol]) for symbol in assignment.symbols
+                        if symbol in local_vars)
+    broadcast_values = [(symbol, np.broadcast_to(local_vars[symbol], shape))
+                        for symbol in swept_symbols]
+    results = []
+    for index in np.ndindex(*shape):
+        for symbol, values in broadcast_values:
+            element_vars[symbol] = values[index]
+        assignment.clear_result()
+        results.append(assignment.execute(global_vars, element_vars))
+        if assignment.error is not None:
+            return None
+
+    value = np.array(results)
+    if value.shape != (len(results), ):
+        value = np.empty(len(results), dtype=np.object_)
+        value[:] = results
+    return value.reshape(shape)
+
+
+def execute_sweep(assignments, global_vars, local_vars, input_symbols):
+    """ Executes the assignments where the input symbols are bound to arrays in local_vars.
+        The results are stored in local_vars.
+
+        Assignments that depend on the swept inputs are evaluated as if they were evaluated 
+        once per element of the swept values. Element-wise expressions (see is_elementwise)
+        are first evaluated once with the arrays, relying on NumPy broadcasting. If that 
+        fails, or if the result doesn't have the broadcast shape of the swept values it uses,
+        or if the expression is not element-wise, the assignment is evaluated once per
+        element. Assignments that don't depend on the swept inputs are evaluated only once.
+
+        :param assignments: compiled assignments in execution order.
+    """
+    swept = set(input_symbols)
+    for assignment in assignments:
+        swept_symbols = [symbol for symbol in set(assignment.symbols) if symbol in swept]
+        if not swept_symbols:
+            local_vars[assignment.target] = assignment.execute(global_vars, local_vars)
+            continue
+
+        swept.add(assignment.target)
+        shape = _broadcast_shape([local_vars[symbol] for symbol in swept_symbols])
+        success, value = False, None
+        if _can_vectorize(assignment, global_vars, local_vars, swept):
+            success, value = _try_execute_vectorized(assignment, global_vars, local_vars, 
+                                                     shape)
+        if success:
+            assignment.set_result(value, None)
+        else:
+            logger.debug("Executing element-wise: {}".format(assignment))
+            value = _execute_elementwise(assignment, global_vars, local_vars,
+                                         swept_symbols, shape)
+            if assignment.error is None:
+                assignment.set_result(value, None)
+        local_vars[assignment.target] = value
@@ -0,0 +1,76 @@
+""" Tests for the sweep module.
+"""
+
+from __future__ import absolute_import
+import unittest
+import numpy as np
+
+from pepcalk.calculation import Calculation
+from pepcalk.sweep import make_sweep_inputs, _can_vectorize
+
+
+class SweepCase(unittest.TestCase):
+    """A test class for parameter sweeps"""
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+
+    def test_make_sweep_inputs(self):
+        
+        inputs = make_sweep_inputs({'y': [1, 2, 3], 'x': [4, 5]}, grid=True)
+        self.assertEqual(inputs['x'].shape, (2, 1))
+        self.assertEqual(inputs['y'].shape, (1, 3))
+        
+        inputs = make_sweep_inputs([('y', [1, 2, 3]), ('x', [4, 5])], grid=True)
+        self.assertEqual(inputs['y'].shape, (3, 1))
+        
+        self.assertRaises(ValueError, make_sweep_inputs, {'x': [1, 2], 'y': [1, 2, 3]})
+        self.assertRaises(ValueError, make_sweep_inputs, {'x': [[1, 2]]}, grid=True)
+        
+    
+    def test_sweep(self):
+        
+        calls = []
+        def constant():
+            calls.append(1)
+            return 10
+        
+        calc = Calculation("b = a * 2 + c; c = constant(); d = int(b) % 7; e = b.sum()")
+        calc.execution_global_vars['constant'] = constant
+        calc.compile()
+        
+        result = calc.sweep({'a': np.arange(5)})
+        self.assertTrue(np.array_equal(result['b'], [10, 12, 14, 16, 18]))
+        self.assertTrue(np.array_equal(result['d'], [3, 5, 0, 2, 4]))   # element-wise
+        self.assertTrue(np.array_equal(result['e'], [10, 12, 14, 16, 18])) # element-wise
+        self.assertEqual(result['c'], 10)
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(np.array_equal(calc.assignments[2].value, [3, 5, 0, 2, 4]))
+        
+        calc = Calculation("z = x * y + w").compile()
+        calc.execution_local_vars['w'] = 0.5
+        result = calc.sweep({'x': [1, 2, 3], 'y': [10, 20]}, grid=True)
+        self.assertTrue(np.array_equal(result['z'], [[10.5, 20.5], [20.5, 40.5], [30.5, 60.5]]))
+        
+        result = calc.sweep({'x': np.arange(3), 'y': 2})
+        self.assertTrue(np.array_equal(result['z'], [0.5, 2.5, 4.5]))
+
+        # Only element-wise expressions with scalar operands are vectorized
+        calc = Calculation("b = a - a.mean(); c = a * w").compile()
+        calc.execution_local_vars['w'] = np.array([1, 10, 100])
+        result = calc.sweep({'a': [1, 2, 3]})
+        self.assertTrue(np.array_equal(result['b'], [0, 0, 0]))
+        self.assertEqual(result['c'].shape, (3, )) # an array per point
+        self.assertTrue(np.array_equal(result['c'][2], [3, 30, 300]))
+
+        calc = Calculation("d = _np.sqrt(b) - b / k").compile()
+        global_vars, local_vars = {'_np': np}, {'b': np.arange(3), 'k': 3}
+        self.assertTrue(_can_vectorize(calc.assignments[0], global_vars, local_vars, ['b']))
+
+
+if __name__ == '__main__':
+    unittest.main()
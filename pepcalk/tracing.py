@@ -0,0 +1,113 @@
+""" Tracing of the phases of compilation and execution.
+
+    A tracer is an object with begin(name, category, args) and end(name, category) methods.
+    The tracer that is set with set_tracer receives the events of all calculations in the
+    process. If no tracer is set, which is the default, tracing costs one function call and
+    one comparison per traced phase.
+"""
+from __future__ import absolute_import, division
+
+import logging, json, os, thread
+from timeit import default_timer
+
+logger = logging.getLogger(__name__)
+
+_tracer = None
+
+
+def get_tracer():
+    """ Returns the current tracer, or None if tracing is disabled.
+    """
+    return _tracer
+
+
+def set_tracer(tracer):
+    """ Sets the tracer that receives the events. Use None to disable tracing.
+        Returns the previous tracer.
+    """
+    global _tracer
+    previous, _tracer = _tracer, tracer
+    return previous
+
+
+class Span(object):
+    """ Context manager that emits a begin event on entering and an end event on exiting.
+
+        The tracer is determined when the span is created. Use direct calls to the tracer in
+        code where even the creation of the span is too expensive.
+    """
+    def __init__(self, name, category, args=None):
+        """ Constructor
+        """
+        self._tracer = _tracer
+        self._name = name
+        self._category = category
+        self._args = args
+
+    def __enter__(self):
+        if self._tracer is not None:
+            self._tracer.begin(self._name, self._category, self._args)
+        return self
+
+    def __exit__(self, _exc_type, _exc_value, _traceback):
+        if self._tracer is not None:
+            self._tracer.end(self._name, self._category)
+        return False
+
+
+class Tracer(object):
+    """ Records the events in memory, so that they can be written in the Chrome trace event
+        format. The file can be opened in chrome://tracing or other trace viewers.
+
+        Only the events of the current process are recorded; the assignments that are
+        executed in worker processes are not traced.
+    """
+    def __init__(self):
+        """ Constructor
+        """
+        self.events = []
+        self._pid = os.getpid()
+        self._start_time = default_timer()
+
+    def __len__(self):
+        "Number of events"
+        return len(self.events)
+
+    def clear(self):
+        """ Removes all events.
+        """
+        self.events = []
+
+    def _add_event(self, phase, name, category, args=None):
+        """ Appends an event. Appending to a list is thread safe.
+        """
+        event = {'name': name, 'cat': category, 'ph': phase,
+                 'ts': (default_timer() - self._start_time) * 1e6, # microseconds
+                 'pid': self._pid, 'tid': thread.get_ident()}
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def begin(self, name, category, args=None):
+        """ Records the beginning of a phase.
+
+            :param args: optional dictionary with extra information about the phase.
+        """
+        self._add_event('B', name, category, args)
+
+    def end(self, name, category):
+        """ Records the end of a phase.
+        """
+        self._add_event('E', name, category)
+
+    def chrome_trace(self):
+        """ Returns the events as a dictionary in the Chrome trace event format.
+        """
+        return {'traceEvents': list(self.events), 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, file_name):
+        """ Writes the events to a JSON file in the Chrome trace event format.
+        """
+        with open(file_name, 'w') as file_obj:
+            json.dump(self.chrome_trace(), file_obj)
+        logger.debug("Wrote {:d} trace events to {}".format(len(self.events), file_name))
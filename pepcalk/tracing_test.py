@@ -0,0 +1,73 @@
+""" Tests for the tracing module.
+"""
+
+from __future__ import absolute_import
+import unittest, json, os, shutil, tempfile, thread
+
+from pepcalk.calculation import Calculation
+from pepcalk.tracing import Tracer, get_tracer, set_tracer
+
+
+class TracingCase(unittest.TestCase):
+    """A test class for tracing"""
+
+    def setUp(self):
+        self.tracer = Tracer()
+        self.previous_tracer = set_tracer(self.tracer)
+
+    def tearDown(self):
+        set_tracer(self.previous_tracer)
+
+
+    def test_events(self):
+        
+        calc = Calculation("b = a + 1; c = b * 2")
+        calc.execution_local_vars['a'] = 1
+        calc.compile().execute()
+        
+        names = [(event['ph'], event['name']) for event in self.tracer.events]
+        self.assertEqual(names, [('B', 'parse'), ('E', 'parse'), 
+                                 ('B', 'Calculation.compile'), 
+                                 ('B', 'build_graph'), ('E', 'build_graph'),
+                                 ('B', 'linearize'), ('E', 'linearize'),
+                                 ('B', 'compile_assignments'), ('E', 'compile_assignments'),
+                                 ('E', 'Calculation.compile'),
+                                 ('B', 'Calculation.execute'), 
+                                 ('B', 'b'), ('E', 'b'), ('B', 'c'), ('E', 'c'),
+                                 ('E', 'Calculation.execute')])
+        self.assertEqual(self.tracer.events[11]['args'], {'source': 'a + 1'})
+        self.assertEqual(self.tracer.events[11]['tid'], thread.get_ident())
+        timestamps = [event['ts'] for event in self.tracer.events]
+        self.assertEqual(timestamps, sorted(timestamps))
+        
+        # Assignments that are executed in other threads.
+        self.tracer.clear()
+        calc.execute(n_threads=2)
+        assignment_events = [event for event in self.tracer.events 
+                             if event['cat'] == 'assignment']
+        self.assertEqual(len(assignment_events), 4)
+        self.assertNotEqual(assignment_events[0]['tid'], thread.get_ident())
+        
+        
+    def test_write_chrome_trace(self):
+        
+        Calculation("b = 1").compile().execute()
+        directory = tempfile.mkdtemp()
+        try:
+            file_name = os.path.join(directory, 'trace.json')
+            self.tracer.write_chrome_trace(file_name)
+            with open(file_name) as file_obj:
+                trace = json.load(file_obj)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(len(trace['traceEvents']), len(self.tracer))
+        
+        # Disabled tracing
+        set_tracer(None)
+        self.assertIsNone(get_tracer())
+        Calculation("b = 1").compile().execute()
+        self.assertEqual(len(trace['traceEvents']), len(self.tracer))
+        
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,6 @@
 """ Misc utility functions
 """
-import logging
+import logging, sys
 logger = logging.getLogger(__name__)
 
 # Global setting to indicate if we are debugging
@@ -26,4 +26,33 @@ def check_class(obj, target_class, allow_none = False):
             raise TypeError("obj must be a of type {}, got: {}"
                             .format(target_class, type(obj)))    
     
-    
\ No newline at end of file
+    
+
+def value_nbytes(value):
+    """ Returns the size of a value in bytes. 
+    
+        Uses the nbytes attribute of NumPy arrays and sys.getsizeof for other objects. 
+    """
+    nbytes = getattr(value, 'nbytes', None)
+    if isinstance(nbytes, (int, long)):
+        return nbytes
+    else:
+        return sys.getsizeof(value)
+
+
+def format_duration(seconds):
+    """ Returns a duration as a string in milliseconds. Returns "" if seconds is None.
+    """
+    return "" if seconds is None else "{:.3f} ms".format(seconds * 1000)
+
+
+def format_nbytes(nbytes):
+    """ Returns a number of bytes as a string in B, kB, MB or GB. Returns "" if nbytes is None.
+    """
+    if nbytes is None:
+        return ""
+    for unit in ('B', 'kB', 'MB'):
+        if nbytes < 1024:
+            return "{:.4g} {}".format(nbytes, unit)
+        nbytes /= 1024.0
+    return "{:.4g} GB".format(nbytes)
@@ -0,0 +1,165 @@
+""" Memoization of assignment values across executions.
+
+    The value of an assignment is stored under a Merkle-style key: a hash of the source of the
+    assignment and the keys of the values it uses. The key of a value that was calculated by
+    another assignment is the key of that assignment, so only the input values of the
+    calculation itself need to be hashed.
+"""
+from __future__ import absolute_import, division
+
+import logging, hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from pepcalk.metrics import VALUE_CACHE_HITS, VALUE_CACHE_MISSES, get_registry
+from pepcalk.utils import value_nbytes
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 2**30
+
+# Values of these types are hashed by their type and repr.
+_REPR_HASHABLE_TYPES = (type(None), bool, int, long, float, complex, str, unicode, np.generic)
+
+
+def value_hash(value):
+    """ Returns a hash of the value, or None if the value cannot be hashed.
+
+        NumPy arrays are hashed by their dtype, shape and data; scalars and strings by their
+        type and repr; tuples and lists by their elements. Other objects cannot be hashed.
+    """
+    if isinstance(value, np.ndarray):
+        if value.dtype.hasobject:
+            return None
+        digest = hashlib.md5("ndarray {} {}".format(value.dtype.str, value.shape))
+        digest.update(np.ascontiguousarray(value).ravel().view(np.uint8))
+        return digest.digest()
+    elif isinstance(value, _REPR_HASHABLE_TYPES):
+        return hashlib.md5("{} {!r}".format(type(value).__name__, value)).digest()
+    elif isinstance(value, (tuple, list)):
+        digest = hashlib.md5("{} {:d}".format(type(value).__name__, len(value)))
+        for element in value:
+            element_hash = value_hash(element)
+            if element_hash is None:
+                return None
+            digest.update(element_hash)
+        return digest.digest()
+    else:
+        return None
+
+
+def assignment_key(assignment, symbol_keys):
+    """ Returns the key of the value of the assignment.
+
+        symbol_keys must contain the keys of the local symbols that the assignment uses.
+        Symbols that are not in symbol_keys are considered global and must not change between
+        executions. Returns None if one of the keys is None.
+    """
+    digest = hashlib.md5(assignment.cache_key)
+    for symbol in sorted(set(assignment.symbols)):
+        if symbol in symbol_keys:
+            if symbol_keys[symbol] is None:
+                return None
+            digest.update("{}={}".format(symbol, symbol_keys[symbol]))
+    return digest.digest()
+
+
+class ValueCache(object):
+    """ Least recently used (LRU) cache of assignment values with a budget in bytes.
+
+        The sizes of the values are determined with value_nbytes. Values that are larger than
+        the budget are not stored. The cached values are shared between executions, so they
+        should not be modified.
+    """
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        """ Constructor
+        """
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict() # key -> (value, nbytes)
+        self.n_bytes = 0
+        self.n_hits = 0
+        self.n_misses = 0
+        self.n_evictions = 0
+
+    def __len__(self):
+        "Number of values in the cache"
+        return len(self._entries)
+
+    def __str__(self):
+        return ("<ValueCache: {:d} entries, {:d} bytes, {:d} hits, {:d} misses, {:d} evictions>"
+                .format(len(self._entries), self.n_bytes, self.n_hits, self.n_misses,
+                        self.n_evictions))
+
+    def clear(self):
+        """ Removes all values and resets the counters.
+        """
+        self._entries.clear()
+        self.n_bytes = 0
+        self.n_hits = 0
+        self.n_misses = 0
+        self.n_evictions = 0
+
+    def lookup(self, key):
+        """ Returns (found, value) tuple.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self.n_misses += 1
+            return False, None
+        else:
+            self.n_hits += 1
+            self._entries[key] = entry # Reinsert as most recently used value.
+            return True, entry[0]
+
+    def store(self, key, value):
+        """ Stores the value. Removes the least recently used values if the budget is exceeded.
+        """
+        nbytes = value_nbytes(value)
+        if nbytes > self.max_bytes:
+            return
+
+        old_entry = self._entries.pop(key, None)
+        if old_entry is not None:
+            self.n_bytes -= old_entry[1]
+
+        while self.n_bytes + nbytes > self.max_bytes:
+            _key, (_value, evicted_nbytes) = self._entries.popitem(last=False)
+            self.n_bytes -= evicted_nbytes
+            self.n_evictions += 1
+
+        self._entries[key] = (value, nbytes)
+        self.n_bytes += nbytes
+
+
+def execute_memoized(assignments, global_vars, local_vars, value_cache):
+    """ Executes the assignments and stores the results in local_vars. Values of assignments
+        that are found in the value_cache are not calculated again.
+
+        :param assignments: compiled assignments in execution order.
+    """
+    registry = get_registry()
+    symbol_keys = {}
+    for assignment in assignments:
+        for symbol in assignment.symbols:
+            if symbol in local_vars and symbol not in symbol_keys:
+                symbol_keys[symbol] = value_hash(local_vars[symbol])
+
+        key = assignment_key(assignment, symbol_keys)
+        if key is None:
+            found = False
+        else:
+            found, value = value_cache.lookup(key)
+
+        if registry is not None:
+            registry.counter(VALUE_CACHE_HITS if found else VALUE_CACHE_MISSES).inc()
+            
+        if found:
+            assignment.set_result(value, None)
+        else:
+            value = assignment.execute(global_vars, local_vars)
+            if key is not None and assignment.error is None:
+                value_cache.store(key, value)
+
+        local_vars[assignment.target] = value
+        symbol_keys[assignment.target] = key
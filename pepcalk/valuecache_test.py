@@ -0,0 +1,86 @@
+""" Tests for the valuecache module.
+"""
+
+from __future__ import absolute_import
+import unittest
+import numpy as np
+
+from pepcalk.calculation import Calculation
+from pepcalk.valuecache import ValueCache, value_hash
+
+
+class ValueCacheCase(unittest.TestCase):
+    """A test class for the ValueCache class"""
+
+    def setUp(self):
+        pass
+
+    def tearDown(self):
+        pass
+
+
+    def test_value_hash(self):
+        
+        self.assertEqual(value_hash(np.arange(10)), value_hash(np.arange(10)))
+        self.assertEqual(value_hash(np.arange(10)[::2]), value_hash(np.arange(0, 10, 2)))
+        self.assertNotEqual(value_hash(np.arange(10)), value_hash(np.arange(10.0)))
+        self.assertNotEqual(value_hash(np.zeros((2, 3))), value_hash(np.zeros((3, 2))))
+        self.assertNotEqual(value_hash(1), value_hash(1.0))
+        self.assertNotEqual(value_hash(1), value_hash(True))
+        self.assertEqual(value_hash((1, 'a')), value_hash((1, 'a')))
+        self.assertEqual(value_hash(np.array(5)), value_hash(np.array(5)))
+        self.assertTrue(value_hash(object()) is None)
+        self.assertTrue(value_hash([1, object()]) is None)
+        self.assertTrue(value_hash(np.array([None])) is None)
+        
+        
+    def test_budget(self):
+        
+        cache = ValueCache(max_bytes=2000)
+        cache.store('a', np.zeros(100))
+        cache.store('b', np.zeros(100))
+        self.assertEqual(cache.n_bytes, 1600)
+        self.assertEqual(cache.lookup('a')[0], True)
+        cache.store('c', np.zeros(100)) # evicts the least recently used value: b
+        self.assertEqual(cache.n_evictions, 1)
+        self.assertEqual(cache.lookup('b'), (False, None))
+        self.assertEqual(cache.lookup('a')[0], True)
+        cache.store('d', np.zeros(1000)) # too large
+        self.assertEqual(len(cache), 2)
+        
+        
+    def test_memoized_execution(self):
+        
+        calls = []
+        def f(x):
+            calls.append(x)
+            return x * 10
+        
+        calc = Calculation("b = f(a); c = f(b); d = f(e)")
+        calc.execution_global_vars['f'] = f
+        calc.execution_local_vars.update(a=1, e=np.arange(3))
+        calc.value_cache = ValueCache()
+        calc.compile()
+        
+        result = calc.execute()
+        self.assertEqual(result['c'], 100)
+        self.assertEqual(len(calls), 3)
+        
+        result = calc.compile().execute()
+        self.assertEqual(result['c'], 100)
+        self.assertEqual(calc.assignments[1].value, 100)
+        self.assertEqual(len(calls), 3)
+        
+        # Only the assignments that depend on a changed input are calculated
+        calc.execution_local_vars['a'] = 2
+        result = calc.compile().execute()
+        self.assertEqual(result['c'], 200)
+        self.assertEqual(len(calls), 5)
+        
+        calc.execution_local_vars['e'] = np.arange(4)
+        result = calc.compile().execute()
+        self.assertEqual(len(calls), 6)
+        
+
+if __name__ == '__main__':
+    unittest.main()